@@ -1,55 +1,276 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for, send_file
+from flask import Flask, Response, request, jsonify, render_template, redirect, url_for, send_file, stream_with_context
+import json
 import os
+import queue
 import time
 
-from database import init_db, get_db
+from config import SCHEDULER_ENABLED, TIMESERIES_MAX_POINTS, TTL_SECONDS
+from database import db_conn, init_db
 from routes import map_bp, flespi_bp
-from services.reporting_service import start_daily_beacon_check_thread, generate_activity_report
+from services.export_service import EXPORTS, csv_chunks, gzip_chunks, iter_records, ndjson_chunks
+from services.notification_history import search_history
+from services.notification_writer import notification_writer
+from services.proximity_events import notification_feed, proximity_detector
+from services.map_stream import stream_slots
+from services import retention_service
+from services.retention_service import recent_rollups
+from services.time_range import parse_range, range_clause
+from services.sighting_index import sighting_index
+from services.spatial_index import device_index
+from services.timeseries_store import downsample, timeseries_store
+from services.report_jobs import QueueFull, report_jobs, submit_activity_report, submit_daily_report
+from services.scheduler import scheduler
 
 app = Flask(__name__)
 app.register_blueprint(map_bp)
 app.register_blueprint(flespi_bp)
 
+# Schema migrations run once here, at import, for gunicorn and `python app.py` alike
+init_db()
+# Every worker runs the scheduler; only the lease holder runs its jobs
+# (daily report, retention). Report pool processes ("spawn") re-import this
+# module as __mp_main__
+if SCHEDULER_ENABLED and __name__ != "__mp_main__":
+    scheduler.start()
+
 
 # ---- API for saving notifications ----
 
+MAX_NOTIFICATIONS_PER_REQUEST = 5000
+
 @app.route("/api/notifications", methods=["POST"])
 def save_notification():
     """
-    Store a single notification event in the database.
-    Expected JSON: { "type": "left"/"in", "name": "...", "time": "...", "distance": <number> }
+    Store notification events through the group-commit writer.
+    Expected JSON: one event or a list of them, each
+    { "type": "left"/"in", "name": "...", "time": "...", "distance": <number> }
+    Answers 202 once queued; with ?wait=1, 201 once committed (503 if the
+    write did not make it within the timeout).
+    """
+    data = request.get_json(silent=True)
+    items = data if isinstance(data, list) else [data or {}]
+    if len(items) > MAX_NOTIFICATIONS_PER_REQUEST:
+        return jsonify({"status": "error", "message": f"At most {MAX_NOTIFICATIONS_PER_REQUEST} notifications per request"}), 413
+
+    events = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not item.get("type") or not item.get("name"):
+            return jsonify({"status": "error", "message": f"Invalid notification at index {index}"}), 400
+        events.append({
+            "type": item.get("type"),
+            "beacon_name": item.get("name"),
+            "event_time": item.get("time"),
+            "distance": item.get("distance"),
+        })
+
+    if request.args.get("wait") in ("1", "true"):
+        if not notification_writer.submit(events, wait=True):
+            return jsonify({"status": "error", "message": "Notifications not committed"}), 503
+        return jsonify({"status": "ok", "count": len(events)}), 201
+
+    notification_writer.submit(events)
+    return jsonify({"status": "queued", "count": len(events)}), 202
+
+
+@app.route("/api/notifications", methods=["GET"])
+def poll_notifications():
+    """
+    Notifications after ?after_id=N, for clients that poll instead of streaming.
+    Without after_id, only the current last id (to poll from) is returned.
+    """
+    after_id = request.args.get("after_id", type=int)
+    if after_id is None:
+        return jsonify({"last_id": notification_feed.latest_id(), "rows": []})
+    rows = notification_feed.rows_after(after_id)
+    return jsonify({"last_id": rows[-1]["id"] if rows else after_id, "rows": rows})
+
+
+@app.route("/api/notifications/stats", methods=["GET"])
+def notifications_stats():
+    """Group-commit writer counters (pending, batches, retries, drops)."""
+    return jsonify(notification_writer.stats())
+
+
+@app.route("/api/notifications/stream", methods=["GET"])
+def notifications_stream():
+    """
+    Server-Sent Events stream of IN/LEFT notifications detected at ingest.
+    Event ids are notifications row ids, so reconnecting with Last-Event-ID
+    replays anything missed. A client that falls too far behind has its
+    stream ended so it reconnects that way; a "resync" event tells it that
+    more rows were missed than the replay covers. The map gets the same
+    events on /data/stream; this stream counts toward SSE_MAX_CLIENTS too.
+    """
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_id")
+
+    def generate():
+        sub = notification_feed.subscribe(last_event_id)
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    row = sub.get(timeout=15)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if row is None:
+                    return  # overflowed: the client reconnects with Last-Event-ID
+                if row.get("resync"):
+                    yield f"event: resync\ndata: {json.dumps(row)}\n\n"
+                    continue
+                yield f"id: {row['id']}\nevent: notification\ndata: {json.dumps(row)}\n\n"
+        finally:
+            notification_feed.unsubscribe(sub)
+
+    return Response(
+        stream_slots.guard(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/api/beacon_thresholds", methods=["POST"])
+def set_beacon_threshold():
+    """
+    Override the IN/LEFT distances for one beacon.
+    Expected JSON: { "beacon_id": "...", "in_meters": <number>, "out_meters": <number> }
     """
     data = request.get_json(silent=True) or {}
-    ntype = data.get("type")
-    name = data.get("name")
-    event_time = data.get("time")
-    distance = data.get("distance")
-
-    if not ntype or not name:
-        return jsonify({"status": "error", "message": "Invalid notification"}), 400
-
-    created_at = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime())
-
-    conn = get_db()
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS notifications (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            type TEXT,
-            beacon_name TEXT,
-            event_time TEXT,
-            distance REAL,
-            created_at TEXT
+    beacon_id = data.get("beacon_id")
+    try:
+        in_meters = float(data["in_meters"])
+        out_meters = float(data.get("out_meters", in_meters))
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"status": "error", "message": "Invalid thresholds"}), 400
+
+    if not beacon_id or in_meters < 0 or out_meters < in_meters:
+        return jsonify({"status": "error", "message": "Invalid thresholds"}), 400
+
+    proximity_detector.set_threshold(beacon_id, in_meters, out_meters)
+    return jsonify({"status": "ok"})
+
+
+# ---- Rollups (hourly/daily summaries kept after raw rows are purged) ----
+
+@app.route("/api/rollups/<kind>", methods=["GET"])
+def rollups(kind):
+    """
+    Hourly or daily summaries: /api/rollups/uptime or /api/rollups/notifications
+    with ?period=hour|day, &limit=N and, for notifications, &beacon=<name>.
+    """
+    period = request.args.get("period", "hour")
+    if kind not in ("uptime", "notifications") or period not in ("hour", "day"):
+        return jsonify({"status": "error", "message": "Unknown rollup"}), 404
+    limit = min(request.args.get("limit", 168, type=int), 5000)
+    rows = recent_rollups(kind, period, request.args.get("beacon"), limit)
+    return jsonify({"period": period, "rows": rows, "last_run": retention_service.last_run_stats})
+
+
+# ---- Per-beacon last sighting and reading history (charts) ----
+
+@app.route("/api/beacons/<beacon_id>/location", methods=["GET"])
+def beacon_location(beacon_id):
+    """
+    Where a beacon was last heard: time, device, distance and the device's
+    current position. Beacons that have gone offline keep their last sighting.
+    """
+    seen = sighting_index.get(beacon_id)
+    if seen is None:
+        return jsonify({"status": "error", "message": "Beacon never seen"}), 404
+    position = device_index.position(seen["device"])
+    seen["lat"], seen["lon"] = position if position else (None, None)
+    seen["online"] = time.time() - seen["last_seen_raw"] <= TTL_SECONDS
+    return jsonify(seen)
+
+
+@app.route("/api/beacons/<beacon_id>/history", methods=["GET"])
+def beacon_history(beacon_id):
+    """
+    RSSI/distance/battery readings of one beacon as parallel arrays.
+    Range: ?from=<epoch s>&to=<epoch s>, or ?hours=N back from now (default 6).
+    Optional &device=<ident>. With &bucket=<seconds>, or when the range holds
+    more than TIMESERIES_MAX_POINTS readings, readings are averaged per bucket.
+    """
+    end = request.args.get("to", time.time(), type=float)
+    start = request.args.get("from", type=float)
+    if start is None:
+        start = end - request.args.get("hours", 6.0, type=float) * 3600
+    if start > end:
+        return jsonify({"status": "error", "message": "from must be before to"}), 400
+
+    points = timeseries_store.query(beacon_id, start, end, request.args.get("device"))
+    bucket = request.args.get("bucket", type=float)
+    if bucket is None and len(points) > TIMESERIES_MAX_POINTS:
+        bucket = max(1.0, (end - start) / TIMESERIES_MAX_POINTS)
+    result = {"beacon_id": beacon_id, "from": start, "to": end}
+
+    if bucket:
+        buckets = downsample(points, max(bucket, 1.0))
+        result["bucket"] = max(bucket, 1.0)
+        for i, key in enumerate(("t", "samples", "rssi", "distance", "distance_min", "distance_max", "battery")):
+            result[key] = [b[i] for b in buckets]
+    else:
+        for i, key in enumerate(("t", "device", "rssi", "distance", "battery")):
+            result[key] = [p[i] for p in points]
+    result["t"] = [t / 1000.0 for t in result["t"]]
+    return jsonify(result)
+
+
+@app.route("/api/history/stats", methods=["GET"])
+def history_stats():
+    return jsonify(timeseries_store.stats())
+
+
+# ---- Export ----
+
+MAX_EXPORT_PAGE_ROWS = 50000
+EXPORT_MIMETYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+@app.route("/api/export/<kind>", methods=["GET"])
+def export_rows(kind):
+    """
+    Export notifications, uptime or (daily) reports, oldest first.
+    ?format=csv|ndjson streams the whole selection (&gzip=1 for a .gz file);
+    the default JSON answers pages of &limit rows, continued with
+    ?after_id=<next_after_id>. ?from=/?to= (epoch seconds or Samoa
+    date/time; `to` is exclusive) filter on the event time and &beacon=<name>
+    on the beacon.
+    """
+    if kind not in EXPORTS:
+        return jsonify({"status": "error", "message": "Unknown export"}), 404
+    try:
+        start, end = parse_range(request.args)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    beacon = request.args.get("beacon") or None
+    after_id = request.args.get("after_id", type=int)
+    fmt = request.args.get("format", "json")
+
+    if fmt in EXPORT_MIMETYPES:
+        records = iter_records(kind, start, end, beacon, after_id, request.args.get("limit", type=int))
+        chunks = csv_chunks(kind, records) if fmt == "csv" else ndjson_chunks(records)
+        filename = f"{kind}.{fmt}"
+        mimetype = EXPORT_MIMETYPES[fmt]
+        if request.args.get("gzip") in ("1", "true"):
+            chunks = gzip_chunks(chunks)
+            filename += ".gz"
+            mimetype = "application/gzip"
+        return Response(
+            stream_with_context(chunks),
+            mimetype=mimetype,
+            headers={
+                "Content-Disposition": f"attachment; filename={filename}",
+                "X-Accel-Buffering": "no",
+            },
         )
-        """
-    )
-    conn.execute(
-        "INSERT INTO notifications (type, beacon_name, event_time, distance, created_at) VALUES (?, ?, ?, ?, ?)",
-        (ntype, name, event_time, distance, created_at),
-    )
-    conn.commit()
-    conn.close()
-    return jsonify({"status": "ok"}), 201
+    if fmt != "json":
+        return jsonify({"status": "error", "message": "format must be json, csv or ndjson"}), 400
+
+    limit = max(1, min(request.args.get("limit", MAX_EXPORT_PAGE_ROWS, type=int), MAX_EXPORT_PAGE_ROWS))
+    rows = list(iter_records(kind, start, end, beacon, after_id, limit + 1))
+    next_after_id = rows[limit - 1]["id"] if len(rows) > limit else None
+    return jsonify({"rows": rows[:limit], "next_after_id": next_after_id})
 
 
 # ---- Reports history & downloads ----
@@ -59,95 +280,66 @@ def reports_history():
     """
     Simple page showing daily_reports history.
     """
-    conn = get_db()
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS daily_reports (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            created_at TEXT,
-            pdf_path TEXT,
-            report_json TEXT,
-            summary TEXT
-        )
-        """
-    )
-    rows = conn.execute(
-        "SELECT id, created_at, summary FROM daily_reports ORDER BY id DESC LIMIT 200"
-    ).fetchall()
-    conn.close()
+    with db_conn() as conn:
+        rows = conn.execute(
+            "SELECT id, created_at, summary FROM daily_reports ORDER BY id DESC LIMIT 200"
+        ).fetchall()
     return render_template("reports_history.html", reports=rows)
 
 
 @app.route("/notifications/history", methods=["GET"])
 def notifications_history():
     """
-    Page showing notifications history with a simple search bar.
+    Page showing notifications history with a search bar.
+    Searches beacon name/type (full-text) or a date/time prefix; pages go
+    back in time with ?before_id=<id>. ?from=/?to= (epoch seconds or Samoa
+    date/time) limit the event time window.
     """
     q = (request.args.get("q") or "").strip()
-    conn = get_db()
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS notifications (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            type TEXT,
-            beacon_name TEXT,
-            event_time TEXT,
-            distance REAL,
-            created_at TEXT
-        )
-        """
+    before_id = request.args.get("before_id", type=int)
+    try:
+        start, end = parse_range(request.args)
+    except ValueError as e:
+        return str(e), 400
+    rows, next_before_id = search_history(q, before_id, start=start, end=end)
+    return render_template(
+        "notifications_history.html",
+        notifications=rows,
+        query=q,
+        range_from=request.args.get("from") or None,
+        range_to=request.args.get("to") or None,
+        before_id=before_id,
+        next_before_id=next_before_id,
     )
-    if q:
-        like = f"%{q}%"
-        rows = conn.execute(
-            """
-            SELECT id, type, beacon_name, event_time, distance, created_at
-            FROM notifications
-            WHERE beacon_name LIKE ? OR type LIKE ? OR event_time LIKE ? OR created_at LIKE ?
-            ORDER BY id DESC
-            LIMIT 500
-            """,
-            (like, like, like, like),
-        ).fetchall()
-    else:
-        rows = conn.execute(
-            """
-            SELECT id, type, beacon_name, event_time, distance, created_at
-            FROM notifications
-            ORDER BY id DESC
-            LIMIT 500
-            """
-        ).fetchall()
-    conn.close()
-    return render_template("notifications_history.html", notifications=rows, query=q)
 @app.route("/uptime", methods=["GET"])
 def uptime_page():
     """
     Simple page showing recent system health snapshots from uptime_logs.
+    ?from=/?to= (epoch seconds or Samoa date/time) pick the time window.
     """
-    conn = get_db()
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS uptime_logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT,
-            device_count INTEGER,
-            beacon_count INTEGER,
-            status TEXT
-        )
-        """
-    )
-    rows = conn.execute(
-        """
-        SELECT id, timestamp, device_count, beacon_count, status
-        FROM uptime_logs
-        ORDER BY id DESC
-        LIMIT 500
-        """
-    ).fetchall()
-    conn.close()
+    try:
+        start, end = parse_range(request.args)
+    except ValueError as e:
+        return str(e), 400
+    in_range, params = range_clause("ts", start, end)
+    with db_conn() as conn:
+        rows = conn.execute(
+            f"""
+            SELECT id, timestamp, device_count, beacon_count, status
+            FROM uptime_logs
+            {"WHERE " + in_range if in_range else ""}
+            ORDER BY id DESC
+            LIMIT 500
+            """,
+            params,
+        ).fetchall()
 
-    return render_template("uptime.html", logs=rows)
+    return render_template(
+        "uptime.html",
+        logs=rows,
+        range_from=request.args.get("from") or None,
+        range_to=request.args.get("to") or None,
+    )
 
 
 
@@ -156,22 +348,10 @@ def download_latest_report():
     """
     Download the most recent daily report PDF.
     """
-    conn = get_db()
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS daily_reports (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            created_at TEXT,
-            pdf_path TEXT,
-            report_json TEXT,
-            summary TEXT
-        )
-        """
-    )
-    row = conn.execute(
-        "SELECT id, pdf_path FROM daily_reports ORDER BY id DESC LIMIT 1"
-    ).fetchone()
-    conn.close()
+    with db_conn() as conn:
+        row = conn.execute(
+            "SELECT id, pdf_path FROM daily_reports ORDER BY id DESC LIMIT 1"
+        ).fetchone()
 
     if not row or not row[1] or not os.path.exists(row[1]):
         return "No reports available yet.", 404
@@ -186,23 +366,11 @@ def download_report(report_id):
     """
     Download a specific report PDF by id.
     """
-    conn = get_db()
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS daily_reports (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            created_at TEXT,
-            pdf_path TEXT,
-            report_json TEXT,
-            summary TEXT
-        )
-        """
-    )
-    row = conn.execute(
-        "SELECT pdf_path FROM daily_reports WHERE id = ?",
-        (report_id,),
-    ).fetchone()
-    conn.close()
+    with db_conn() as conn:
+        row = conn.execute(
+            "SELECT pdf_path FROM daily_reports WHERE id = ?",
+            (report_id,),
+        ).fetchone()
 
     if not row or not row[0] or not os.path.exists(row[0]):
         return "Report not found.", 404
@@ -214,55 +382,53 @@ def download_report(report_id):
 
 # ---- Activity reports page ----
 
+def _parse_max_events(value):
+    """Optional raw-event cap for an activity report; None means the ACTIVITY_MAX_EVENTS default."""
+    if value is None or str(value).strip() == "":
+        return None
+    try:
+        max_events = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid max_events: {value!r}")
+    if max_events < 0:
+        raise ValueError("max_events must be 0 (full history) or more")
+    return max_events
+
+
 @app.route("/activity-reports", methods=["GET", "POST"])  # noqa: E501
 def activity_reports():
     """
     Page to generate and list beacon activity reports.
     """
-    conn = get_db()
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS activity_reports (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            beacon_name TEXT,
-            pdf_path TEXT,
-            created_at TEXT,
-            summary TEXT
-        )
-        """
-    )
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS notifications (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            type TEXT,
-            beacon_name TEXT,
-            event_time TEXT,
-            distance REAL,
-            created_at TEXT
-        )
-        """
-    )
-
-    if request.method == "POST":
-        beacon_name = (request.form.get("beacon_name") or "").strip()
-        if beacon_name:
-            generate_activity_report(beacon_name)
-        return redirect(url_for("activity_reports"))
-
-    # Distinct beacon names from notifications
-    rows_beacons = conn.execute(
-        "SELECT DISTINCT beacon_name FROM notifications WHERE beacon_name IS NOT NULL ORDER BY beacon_name"
-    ).fetchall()
-    beacon_names = [r[0] for r in rows_beacons if r[0]]
+    with db_conn() as conn:
+
+        if request.method == "POST":
+            beacon_name = (request.form.get("beacon_name") or "").strip()
+            try:
+                start, end = parse_range(request.form)
+                max_events = _parse_max_events(request.form.get("max_events"))
+            except ValueError as e:
+                return str(e), 400
+            if beacon_name:
+                try:
+                    submit_activity_report(beacon_name, start, end, max_events)
+                except QueueFull:
+                    return "Too many reports are being generated, try again shortly.", 503
+            return redirect(url_for("activity_reports"))
+
+        # Distinct beacon names from notifications
+        rows_beacons = conn.execute(
+            "SELECT DISTINCT beacon_name FROM notifications WHERE beacon_name IS NOT NULL ORDER BY beacon_name"
+        ).fetchall()
+        beacon_names = [r[0] for r in rows_beacons if r[0]]
 
-    # Existing activity reports
-    rows_reports = conn.execute(
-        "SELECT id, beacon_name, created_at, summary FROM activity_reports ORDER BY id DESC LIMIT 200"
-    ).fetchall()
-    conn.close()
+        # Existing activity reports
+        rows_reports = conn.execute(
+            "SELECT id, beacon_name, created_at, summary FROM activity_reports ORDER BY id DESC LIMIT 200"
+        ).fetchall()
 
-    return render_template("activity_reports.html", beacons=beacon_names, reports=rows_reports)
+    jobs = report_jobs.recent(20, kind="activity")
+    return render_template("activity_reports.html", beacons=beacon_names, reports=rows_reports, jobs=jobs)
 
 
 @app.route("/download/activity-report/<int:report_id>", methods=["GET"])
@@ -270,23 +436,11 @@ def download_activity_report(report_id):
     """
     Download a specific activity report PDF by id.
     """
-    conn = get_db()
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS activity_reports (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            beacon_name TEXT,
-            pdf_path TEXT,
-            created_at TEXT,
-            summary TEXT
-        )
-        """
-    )
-    row = conn.execute(
-        "SELECT pdf_path FROM activity_reports WHERE id = ?",
-        (report_id,),
-    ).fetchone()
-    conn.close()
+    with db_conn() as conn:
+        row = conn.execute(
+            "SELECT pdf_path FROM activity_reports WHERE id = ?",
+            (report_id,),
+        ).fetchone()
 
     if not row or not row[0] or not os.path.exists(row[0]):
         return "Activity report not found.", 404
@@ -296,7 +450,80 @@ def download_activity_report(report_id):
     return send_file(pdf_path, as_attachment=True, download_name=filename)
 
 
+# ---- Report jobs ----
+
+def _job_json(job):
+    job = dict(job)
+    job.pop("owner_pid", None)
+    if job.pop("result_path", None) and job["status"] == "done":
+        job["download_url"] = url_for("download_report_job", job_id=job["id"])
+    return job
+
+
+@app.route("/api/reports/jobs", methods=["POST"])
+def create_report_job():
+    """
+    Queue a report render.
+    Expected JSON: { "kind": "activity", "beacon_name": "...", "from": ..., "to": ..., "max_events": N }
+    or { "kind": "daily" }. Answers 202 with the job id and its status URL.
+    """
+    data = request.get_json(silent=True) or {}
+    kind = data.get("kind")
+    try:
+        if kind == "activity":
+            beacon_name = (data.get("beacon_name") or "").strip()
+            if not beacon_name:
+                return jsonify({"status": "error", "message": "beacon_name is required"}), 400
+            start, end = parse_range(data)
+            job_id = submit_activity_report(beacon_name, start, end, _parse_max_events(data.get("max_events")))
+        elif kind == "daily":
+            job_id = submit_daily_report()
+        else:
+            return jsonify({"status": "error", "message": "kind must be activity or daily"}), 400
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except QueueFull as e:
+        return jsonify({"status": "error", "message": str(e)}), 503
+    return jsonify({
+        "status": "queued",
+        "job_id": job_id,
+        "status_url": url_for("report_job_status", job_id=job_id),
+    }), 202
+
+
+@app.route("/api/reports/jobs", methods=["GET"])
+def list_report_jobs():
+    """Recent report jobs (?kind=activity|daily, &limit=N) and this worker's runner counters."""
+    limit = max(1, min(request.args.get("limit", 20, type=int), 200))
+    jobs = report_jobs.recent(limit, kind=request.args.get("kind"))
+    return jsonify({"jobs": [_job_json(j) for j in jobs], "runner": report_jobs.stats()})
+
+
+@app.route("/api/scheduler", methods=["GET"])
+def scheduler_status():
+    """Scheduled jobs with their last and next run, the current leader and this worker's counters."""
+    return jsonify(scheduler.stats())
+
+
+@app.route("/api/reports/jobs/<job_id>", methods=["GET"])
+def report_job_status(job_id):
+    """Status (queued/running/done/failed), progress 0-1 and, when done, a download URL."""
+    job = report_jobs.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Job not found"}), 404
+    return jsonify(_job_json(job))
+
+
+@app.route("/download/report-job/<job_id>", methods=["GET"])
+def download_report_job(job_id):
+    """
+    Download the PDF of a finished report job.
+    """
+    job = report_jobs.get(job_id)
+    if not job or job["status"] != "done" or not job["result_path"] or not os.path.exists(job["result_path"]):
+        return "Report not found.", 404
+    return send_file(job["result_path"], as_attachment=True, download_name=os.path.basename(job["result_path"]))
+
+
 if __name__ == "__main__":
-    init_db()
-    start_daily_beacon_check_thread()
     app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
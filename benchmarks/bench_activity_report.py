@@ -0,0 +1,101 @@
+"""Peak RSS and time of an activity report PDF for a long notification history.
+
+Renders the same history as the full report (one canvas, and merged
+segments when pypdf is installed) and as daily totals plus the most recent
+`max_events` events. Each render runs in its own process so ru_maxrss is
+that render's peak; rows are read from the cursor in page-sized chunks
+either way, so what grows with the history is the PDF's pages. Database
+pages mapped through mmap count toward ru_maxrss too; run with
+DB_MMAP_SIZE=0 to leave them out.
+
+Usage: python benchmarks/bench_activity_report.py [events] [max_events]
+"""
+
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import database  # noqa: E402
+
+
+def seed(db_path, events):
+    database.pool = database.ConnectionPool(db_path)
+    database.init_db()
+    start = int(time.time()) - events * 60
+    with database.db_conn() as conn:
+        conn.executemany(
+            "INSERT INTO notifications (type, beacon_name, event_time, distance, created_at, event_ts, created_ts) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    "in" if i % 2 else "left",
+                    "bench",
+                    time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(start + i * 60)),
+                    1.0 + (i % 50) / 10.0,
+                    time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(start + i * 60)),
+                    start + i * 60,
+                    start + i * 60,
+                )
+                for i in range(events)
+            ),
+        )
+
+
+def render(db_path, mode, max_events):
+    """Child process: render one report and print seconds, base RSS, peak RSS and size."""
+    database.pool = database.ConnectionPool(db_path)
+    from services import reporting_service
+
+    if mode == "single":
+        reporting_service.PdfWriter = None
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.perf_counter()
+    path = reporting_service.generate_activity_report(
+        "bench", max_events=max_events if mode == "summary" else 0
+    )
+    elapsed = time.perf_counter() - t0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    size = os.path.getsize(path)
+    os.remove(path)
+    print(elapsed, base, peak, size)
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--render":
+        render(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+        return
+
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    max_events = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    from services import activity_cache
+    from services.reporting_service import PdfWriter
+
+    modes = ["single"] + (["segments"] if PdfWriter is not None else []) + ["summary"]
+    segments_before = set(os.listdir(activity_cache.segments_dir()))
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        seed(db_path, events)
+        print(f"{events} events, summary keeps the last {max_events}")
+        for mode in modes:
+            out = subprocess.run(
+                [sys.executable, __file__, "--render", db_path, mode, str(max_events)],
+                check=True, capture_output=True, text=True,
+            ).stdout.split("\n")[-2]
+            elapsed, base, peak, size = (float(v) for v in out.split())
+            print(
+                f"{mode:9s} {elapsed:7.2f} s  peak RSS {peak / 1024:7.1f} MB "
+                f"(+{(peak - base) / 1024:6.1f} MB)  pdf {size / 1024:8.0f} KB"
+            )
+
+    # Segments rendered here are not tracked in the real database's LRU
+    for name in set(os.listdir(activity_cache.segments_dir())) - segments_before:
+        os.remove(os.path.join(activity_cache.segments_dir(), name))
+
+
+if __name__ == "__main__":
+    main()
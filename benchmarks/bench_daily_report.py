@@ -0,0 +1,108 @@
+"""Daily report lookups: scan every live payload per named beacon vs the last-sighting index.
+
+The old generate_daily_report walked every device and every beacon on it for
+each named beacon (O(named beacons x devices x beacons per device)); the
+index answers each beacon with one dict lookup and is kept current by the
+ingest path.
+
+Usage: python benchmarks/bench_daily_report.py [beacons] [devices] [batches]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from services.sighting_index import LastSightingIndex  # noqa: E402
+
+
+def make_payloads(beacons, devices, now_ts):
+    payloads = {}
+    for d in range(devices):
+        ident = f"dev{d}"
+        payloads[ident] = {
+            "ident": ident,
+            "timestamp_raw": now_ts,
+            "beacons": [
+                {"id": f"b{i}", "last_seen_raw": now_ts, "last_seen": "-", "distance": 1.5, "rssi": -60}
+                for i in range(d, beacons, devices)
+            ],
+        }
+    return payloads
+
+
+def scan_report(names, payloads):
+    """The old loop, verbatim in shape."""
+    report = []
+    for bid, bname in names:
+        last_seen = distance = device = None
+        for ident, dev in payloads.items():
+            for b in dev.get("beacons") or []:
+                if b.get("id") == bid:
+                    last_seen = b.get("last_seen")
+                    distance = b.get("distance")
+                    device = ident
+        report.append((bid, bname, last_seen, device, distance))
+    return report
+
+
+def index_report(names, sightings):
+    report = []
+    for bid, bname in names:
+        seen = sightings.get(bid)
+        report.append((
+            bid,
+            bname,
+            seen["last_seen"] if seen else None,
+            seen["device"] if seen else None,
+            seen["distance"] if seen else None,
+        ))
+    return report
+
+
+def main():
+    beacons = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    devices = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    batches = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+    random.seed(0)
+    now_ts = time.time()
+    payloads = make_payloads(beacons, devices, now_ts)
+    names = [(f"b{i}", f"Beacon {i}") for i in range(beacons)]
+    print(f"{beacons} named beacons on {devices} devices")
+
+    index = LastSightingIndex(persistent=False)
+    t0 = time.perf_counter()
+    index.apply(payloads)
+    t1 = time.perf_counter()
+    print(f"index build        {1000 * (t1 - t0):10.2f} ms")
+
+    # Ingest-time cost: one webhook message (one device payload) per apply
+    idents = list(payloads)
+    t0 = time.perf_counter()
+    for i in range(batches):
+        ident = random.choice(idents)
+        payload = payloads[ident]
+        for b in payload["beacons"]:
+            b["last_seen_raw"] = now_ts + i + 1
+        index.apply({ident: payload})
+    t1 = time.perf_counter()
+    per_device = beacons // devices
+    print(f"index update       {1000 * (t1 - t0) / batches:10.4f} ms/message ({per_device} beacons)")
+
+    t0 = time.perf_counter()
+    fast = index_report(names, index.snapshot())
+    t1 = time.perf_counter()
+    print(f"report via index   {1000 * (t1 - t0):10.2f} ms")
+
+    t0 = time.perf_counter()
+    slow = scan_report(names, payloads)
+    t1 = time.perf_counter()
+    print(f"report via scan    {1000 * (t1 - t0):10.2f} ms")
+
+    assert [r[:4] for r in fast] == [r[:4] for r in slow], "reports differ"
+
+
+if __name__ == "__main__":
+    main()
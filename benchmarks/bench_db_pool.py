@@ -0,0 +1,111 @@
+"""Compare connect-per-request (the old get_db) with the pooled, tuned get_db.
+
+Each simulated request opens a connection, runs the kind of statements the
+routes run (a notification insert, or a history read), and closes it. Runs
+single-threaded and with concurrent writer + reader threads.
+
+Usage: python benchmarks/bench_db_pool.py [requests] [threads]
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from database import ConnectionPool  # noqa: E402
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS notifications (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    type TEXT,
+    beacon_name TEXT,
+    event_time TEXT,
+    distance REAL,
+    created_at TEXT
+)
+"""
+
+
+def write_request(get_conn, i):
+    conn = get_conn()
+    try:
+        conn.execute(
+            "INSERT INTO notifications (type, beacon_name, event_time, distance, created_at) VALUES (?, ?, ?, ?, ?)",
+            ("in", f"beacon-{i % 50}", "-", 1.5, "-"),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def read_request(get_conn, i):
+    conn = get_conn()
+    try:
+        conn.execute(
+            "SELECT id, type, beacon_name, event_time, distance, created_at "
+            "FROM notifications WHERE beacon_name = ? ORDER BY id DESC LIMIT 50",
+            (f"beacon-{i % 50}",),
+        ).fetchall()
+    finally:
+        conn.close()
+
+
+def run(name, get_conn, requests, threads):
+    t0 = time.perf_counter()
+    for i in range(requests):
+        (write_request if i % 4 == 0 else read_request)(get_conn, i)
+    serial = time.perf_counter() - t0
+
+    errors = []
+
+    def worker(fn, offset):
+        try:
+            for i in range(requests // threads):
+                fn(get_conn, offset + i)
+        except sqlite3.OperationalError as e:
+            errors.append(e)
+
+    workers = [
+        threading.Thread(target=worker, args=(write_request if t % 2 == 0 else read_request, t * requests))
+        for t in range(threads)
+    ]
+    t0 = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    concurrent = time.perf_counter() - t0
+
+    print(
+        f"{name:20s} serial {1e6 * serial / requests:8.1f} us/req   "
+        f"{threads} threads {1e6 * concurrent / requests:8.1f} us/req   "
+        f"lock errors {len(errors)}"
+    )
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 4000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+
+    with tempfile.TemporaryDirectory() as tmp:
+        plain_path = os.path.join(tmp, "plain.db")
+        conn = sqlite3.connect(plain_path)
+        conn.execute(SCHEMA)
+        conn.close()
+        run("connect-per-request", lambda: sqlite3.connect(plain_path), requests, threads)
+
+        pool = ConnectionPool(os.path.join(tmp, "pooled.db"), size=threads)
+        conn = pool.acquire()
+        conn.execute(SCHEMA)
+        conn.close()
+        run("pooled + WAL", pool.acquire, requests, threads)
+        print(f"pool: {pool.stats()}")
+        pool.close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Compare live state backends: in-process dict vs shared SQLite-WAL.
+
+Usage: python benchmarks/bench_live_state.py [devices] [beacons_per_device] [batches]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from services.live_state import MemoryLiveState, SQLiteLiveState  # noqa: E402
+
+
+def make_batches(devices, beacons_per_device, batches):
+    out = []
+    for _ in range(batches):
+        now_ts = time.time()
+        rows = []
+        payloads = []
+        for d in random.sample(range(devices), k=max(1, devices // 4)):
+            ident = f"dev{d}"
+            for b in range(beacons_per_device):
+                bid = f"b{d}-{b}"
+                rows.append((ident, bid, {
+                    "id": bid, "device_ident": ident, "rssi": -60, "distance": 1.0,
+                    "last_seen_raw": now_ts, "last_seen": "-", "battery_percent": 90,
+                }))
+            payloads.append((ident, {"ident": ident, "timestamp_raw": now_ts, "lat": 0.0, "lon": 0.0}))
+        out.append((rows, payloads, now_ts))
+    return out
+
+
+def bench(name, state, batches, reads_per_batch=5):
+    t0 = time.perf_counter()
+    for rows, payloads, now_ts in batches:
+        state.apply(rows, [(i, dict(p)) for i, p in payloads], now_ts)
+    t1 = time.perf_counter()
+    for _ in range(len(batches) * reads_per_batch):
+        state.messages()
+    t2 = time.perf_counter()
+    # Reads after a write elsewhere must rebuild the snapshot
+    rows, payloads, now_ts = batches[-1]
+    t_fresh = 0.0
+    for _ in range(len(batches)):
+        state.apply(rows[:1], [(i, dict(p)) for i, p in payloads[:1]], now_ts)
+        t = time.perf_counter()
+        state.messages()
+        t_fresh += time.perf_counter() - t
+    n = len(batches)
+    print(
+        f"{name:8s} apply {1000 * (t1 - t0) / n:8.3f} ms/batch   "
+        f"cached read {1000 * (t2 - t1) / (n * reads_per_batch):8.3f} ms   "
+        f"fresh read {1000 * t_fresh / n:8.3f} ms"
+    )
+
+
+def main():
+    devices = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    per_device = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    n_batches = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    random.seed(0)
+    batches = make_batches(devices, per_device, n_batches)
+    print(f"{devices} devices x {per_device} beacons, {n_batches} batches of {max(1, devices // 4)} devices")
+
+    bench("memory", MemoryLiveState(), batches)
+    with tempfile.TemporaryDirectory() as tmp:
+        bench("sqlite", SQLiteLiveState(os.path.join(tmp, "live_state.db")), batches)
+
+
+if __name__ == "__main__":
+    main()
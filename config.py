@@ -12,3 +12,131 @@ SAMOA_OFFSET_HOURS = 13  # UTC+13 for Samoa
 # RSSI -> distance model
 TX_POWER = -59
 PATH_LOSS_N = 2.0
+
+# Webhook ingest: "inline" applies payloads inside the /flespi request,
+# "queue" hands them to a background worker and answers immediately.
+INGEST_MODE = os.environ.get("INGEST_MODE", "inline")
+INGEST_QUEUE_MAXSIZE = int(os.environ.get("INGEST_QUEUE_MAXSIZE", "20000"))  # messages
+# What to do when the queue is full: "block" (wait up to INGEST_BLOCK_TIMEOUT,
+# then 503), "drop_oldest" (evict queued messages) or "reject" (503 at once).
+INGEST_BACKPRESSURE = os.environ.get("INGEST_BACKPRESSURE", "block")
+INGEST_BLOCK_TIMEOUT = float(os.environ.get("INGEST_BLOCK_TIMEOUT", "2.0"))  # seconds
+
+# Live device/beacon state: "memory" (per process) or "sqlite" (shared by all
+# gunicorn workers on the host through a WAL-mode database file).
+LIVE_STATE_BACKEND = os.environ.get("LIVE_STATE_BACKEND", "memory")
+LIVE_STATE_DB_PATH = os.environ.get(
+    "LIVE_STATE_DB_PATH", os.path.join(os.path.dirname(__file__), "live_state.db")
+)
+
+# Server-side Kalman smoothing of beacon RSSI (adds rssi_smoothed /
+# distance_smoothed next to the raw values)
+KALMAN_SMOOTHING = os.environ.get("KALMAN_SMOOTHING", "1") == "1"
+
+# Server-side IN/LEFT detection (metres). A beacon goes IN at or below
+# PROXIMITY_IN_METERS and LEFT above PROXIMITY_OUT_METERS; the gap between
+# the two is the hysteresis band. Per-beacon overrides live in beacon_thresholds.
+PROXIMITY_IN_METERS = float(os.environ.get("PROXIMITY_IN_METERS", "3.0"))
+PROXIMITY_OUT_METERS = float(os.environ.get("PROXIMITY_OUT_METERS", "4.0"))
+
+# Viewport-scoped /data (?bbox=west,south,east,north&zoom=z). Devices are
+# indexed on a lat/lon grid of SPATIAL_CELL_DEGREES; below MAP_CLUSTER_MAX_ZOOM
+# devices closer than about MAP_CLUSTER_RADIUS_PX screen pixels are merged
+# into clusters with counts.
+SPATIAL_CELL_DEGREES = float(os.environ.get("SPATIAL_CELL_DEGREES", "0.01"))
+MAP_CLUSTER_MAX_ZOOM = int(os.environ.get("MAP_CLUSTER_MAX_ZOOM", "15"))
+MAP_CLUSTER_RADIUS_PX = int(os.environ.get("MAP_CLUSTER_RADIUS_PX", "60"))
+
+# Server-Sent Events: each open stream holds one gthread thread for as long
+# as it is open, so at most SSE_MAX_CLIENTS streams per worker are served
+# (keep it well under gunicorn --threads). Clients past the cap are told to
+# poll and to try the stream again after SSE_POLL_RETRY_MS.
+SSE_MAX_CLIENTS = int(os.environ.get("SSE_MAX_CLIENTS", "16"))
+SSE_POLL_RETRY_MS = int(os.environ.get("SSE_POLL_RETRY_MS", "60000"))
+
+# Main database connections (database.get_db): idle connections kept per
+# process, and the pragmas every new connection gets.
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+DB_BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_MMAP_SIZE = int(os.environ.get("DB_MMAP_SIZE", str(256 * 1024 * 1024)))  # bytes
+DB_CACHE_SIZE_KB = int(os.environ.get("DB_CACHE_SIZE_KB", "16384"))
+DB_STATEMENT_CACHE = int(os.environ.get("DB_STATEMENT_CACHE", "256"))
+
+# Notification writer (IN/LEFT events and POST /api/notifications): rows are
+# group-committed every NOTIFY_FLUSH_INTERVAL seconds (the durability window)
+# or as soon as NOTIFY_BATCH_MAX rows are pending; a failed batch is retried
+# NOTIFY_MAX_RETRIES times with doubling backoff before it is dropped.
+NOTIFY_FLUSH_INTERVAL = float(os.environ.get("NOTIFY_FLUSH_INTERVAL", "1.0"))  # seconds
+NOTIFY_BATCH_MAX = int(os.environ.get("NOTIFY_BATCH_MAX", "500"))
+NOTIFY_MAX_RETRIES = int(os.environ.get("NOTIFY_MAX_RETRIES", "5"))
+NOTIFY_RETRY_BACKOFF = float(os.environ.get("NOTIFY_RETRY_BACKOFF", "0.5"))  # seconds
+
+# Retention: a scheduler job (run by the lease holder only, see Scheduler
+# below) rolls uptime_logs and notifications into hourly/daily summary
+# tables, then purges raw rows older than the retention ages in batches and
+# returns the freed pages with incremental vacuum.
+RETENTION_ENABLED = os.environ.get("RETENTION_ENABLED", "1") == "1"
+RETENTION_SCHEDULE = os.environ.get("RETENTION_SCHEDULE", "15 * * * *")  # cron, local time
+UPTIME_RETENTION_DAYS = float(os.environ.get("UPTIME_RETENTION_DAYS", "30"))
+NOTIFICATION_RETENTION_DAYS = float(os.environ.get("NOTIFICATION_RETENTION_DAYS", "90"))
+RETENTION_BATCH_SIZE = int(os.environ.get("RETENTION_BATCH_SIZE", "2000"))  # rows per delete transaction
+RETENTION_VACUUM_PAGES = int(os.environ.get("RETENTION_VACUUM_PAGES", "2000"))  # pages per incremental vacuum
+# An hour is rolled up only once it closed ROLLUP_GRACE_SECONDS ago, so rows
+# still on their way in (a notification batch waiting for its flush, then
+# retried with backoff, each attempt possibly waiting out the busy timeout)
+# are in the table before the hour is summarised; default adds a minute.
+_NOTIFY_RETRY_BUDGET = (
+    NOTIFY_RETRY_BACKOFF * (2 ** NOTIFY_MAX_RETRIES - 1)
+    + (NOTIFY_MAX_RETRIES + 1) * DB_BUSY_TIMEOUT_MS / 1000.0
+)
+ROLLUP_GRACE_SECONDS = float(
+    os.environ.get("ROLLUP_GRACE_SECONDS", NOTIFY_FLUSH_INTERVAL + _NOTIFY_RETRY_BUDGET + 60.0)
+)
+
+# Per-beacon reading history (services/timeseries_store.py): readings are
+# buffered per beacon and written as compressed chunks of up to
+# TIMESERIES_CHUNK_POINTS readings or TIMESERIES_CHUNK_SECONDS of data.
+# History queries return at most TIMESERIES_MAX_POINTS points, bucketing
+# longer ranges.
+TIMESERIES_ENABLED = os.environ.get("TIMESERIES_ENABLED", "1") == "1"
+TIMESERIES_CHUNK_POINTS = int(os.environ.get("TIMESERIES_CHUNK_POINTS", "512"))
+TIMESERIES_CHUNK_SECONDS = float(os.environ.get("TIMESERIES_CHUNK_SECONDS", "300"))
+TIMESERIES_RETENTION_DAYS = float(os.environ.get("TIMESERIES_RETENTION_DAYS", "14"))
+TIMESERIES_MAX_POINTS = int(os.environ.get("TIMESERIES_MAX_POINTS", "5000"))
+
+# Last-sighting index (services/sighting_index.py): seconds between saves of
+# changed beacon sightings to beacon_sightings.
+SIGHTING_FLUSH_INTERVAL = float(os.environ.get("SIGHTING_FLUSH_INTERVAL", "30"))
+
+# Report jobs (services/report_jobs.py): PDF renders run in a pool of
+# REPORT_WORKERS processes per web worker; at most REPORT_QUEUE_MAX jobs
+# may be queued or running per web worker before submissions get a 503.
+REPORT_WORKERS = int(os.environ.get("REPORT_WORKERS", "2"))
+REPORT_QUEUE_MAX = int(os.environ.get("REPORT_QUEUE_MAX", "20"))
+
+# Scheduler (services/scheduler.py): every web worker runs it, but only the
+# holder of a SQLite lease (renewed every SCHEDULER_LEASE_SECONDS / 3) runs
+# jobs. Schedules are cron expressions in local time ("minute hour
+# day-of-month month day-of-week", or @hourly/@daily/@weekly/@monthly).
+# With SCHEDULER_CATCH_UP, a run missed while no worker was up is made once
+# at startup.
+SCHEDULER_ENABLED = os.environ.get("SCHEDULER_ENABLED", "1") == "1"
+SCHEDULER_LEASE_SECONDS = float(os.environ.get("SCHEDULER_LEASE_SECONDS", "60"))
+SCHEDULER_CATCH_UP = os.environ.get("SCHEDULER_CATCH_UP", "1") == "1"
+DAILY_REPORT_SCHEDULE = os.environ.get("DAILY_REPORT_SCHEDULE", "0 22 * * *")
+
+# Activity reports: table pages after the first are rendered in segments of
+# ACTIVITY_SEGMENT_PAGES pages, cached by content (needs pypdf) so unchanged
+# parts of a long history are reused; at most ACTIVITY_SEGMENT_CACHE_MAX
+# segment files are kept.
+ACTIVITY_SEGMENT_PAGES = int(os.environ.get("ACTIVITY_SEGMENT_PAGES", "20"))
+ACTIVITY_SEGMENT_CACHE_MAX = int(os.environ.get("ACTIVITY_SEGMENT_CACHE_MAX", "2000"))
+
+# A PDF holds every page until it is saved, so memory grows with the page
+# count. With ACTIVITY_MAX_EVENTS > 0, a longer activity report shows per-day
+# totals followed by only the most recent ACTIVITY_MAX_EVENTS raw events
+# (0 = always the full history; a request may pass its own max_events).
+ACTIVITY_MAX_EVENTS = int(os.environ.get("ACTIVITY_MAX_EVENTS", "0"))
+
+# Exports (/api/export/<kind>): rows read per keyset query while streaming.
+EXPORT_CHUNK_ROWS = int(os.environ.get("EXPORT_CHUNK_ROWS", "2000"))
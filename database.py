@@ -1,61 +1,167 @@
+import os
 import sqlite3
-from config import DB_PATH
+import threading
+from contextlib import contextmanager
+
+from config import (
+    DB_BUSY_TIMEOUT_MS,
+    DB_CACHE_SIZE_KB,
+    DB_MMAP_SIZE,
+    DB_PATH,
+    DB_POOL_SIZE,
+    DB_STATEMENT_CACHE,
+)
+from migrations import migrate
+
+
+def tune(conn):
+    """Apply the connection pragmas used for the main database."""
+    if conn.execute("PRAGMA page_count").fetchone()[0] == 0:
+        # A new database file: incremental vacuum can only be chosen before
+        # anything is written (WAL included). Existing files keep their mode
+        # until an operator runs `python -m services.retention_service vacuum`.
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+def connect(path=DB_PATH, **kwargs):
+    """Open a tuned connection that is not part of the pool."""
+    kwargs.setdefault("timeout", DB_BUSY_TIMEOUT_MS / 1000.0)
+    kwargs.setdefault("cached_statements", DB_STATEMENT_CACHE)
+    return tune(sqlite3.connect(path, **kwargs))
+
+
+class PooledConnection(sqlite3.Connection):
+    """A connection whose close() hands it back to its pool."""
+
+    pool = None
+    checked_out = False  # set by acquire(), cleared by release()
+
+    def _check_out(self):
+        if self.pool is not None and not self.checked_out:
+            raise sqlite3.ProgrammingError("Connection was returned to the pool")
+
+    def cursor(self, *args, **kwargs):
+        self._check_out()
+        return super().cursor(*args, **kwargs)
+
+    def execute(self, *args, **kwargs):
+        self._check_out()
+        return super().execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self._check_out()
+        return super().executemany(*args, **kwargs)
+
+    def executescript(self, *args, **kwargs):
+        self._check_out()
+        return super().executescript(*args, **kwargs)
+
+    def close(self):
+        if self.pool is None or not self.pool.release(self):
+            super().close()
+
+    def discard(self):
+        sqlite3.Connection.close(self)
+
+
+class ConnectionPool:
+    """Keeps up to `size` idle tuned connections per process.
+
+    Each connection is used by one caller at a time (checked out by
+    get_db(), returned by close()), so callers keep the plain
+    get_db() / commit() / close() pattern while connections, their pragmas
+    and their statement caches are reused instead of reopened.
+    """
+
+    def __init__(self, path=DB_PATH, size=DB_POOL_SIZE):
+        self.path = path
+        self.size = int(size)
+        self._lock = threading.Lock()
+        self._idle = []
+        self._pid = os.getpid()
+        self.opened = 0
+        self.reused = 0
+
+    def acquire(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Never share connections inherited across fork()
+                self._idle = []
+                self._pid = os.getpid()
+            if self._idle:
+                self.reused += 1
+                conn = self._idle.pop()
+                conn.checked_out = True
+                return conn
+            self.opened += 1
+        conn = connect(self.path, factory=PooledConnection, check_same_thread=False)
+        conn.pool = self
+        conn.checked_out = True
+        return conn
+
+    def release(self, conn):
+        """Take `conn` back; False if the caller should really close it.
+
+        A connection that is not checked out (a second close()) is ignored.
+        """
+        with self._lock:
+            if not conn.checked_out:
+                return True
+            conn.checked_out = False
+        try:
+            if conn.in_transaction:
+                conn.rollback()  # never leak an uncommitted transaction to the next user
+            conn.row_factory = None
+        except sqlite3.ProgrammingError:
+            return False  # already closed
+        with self._lock:
+            if self._pid != os.getpid() or len(self._idle) >= self.size:
+                return False
+            self._idle.append(conn)
+            return True
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.discard()
+
+    def stats(self):
+        with self._lock:
+            return {"idle": len(self._idle), "opened": self.opened, "reused": self.reused}
+
+
+pool = ConnectionPool()
+
 
 def get_db():
-    return sqlite3.connect(DB_PATH)
+    """Check a connection out of the pool; close() returns it."""
+    return pool.acquire()
 
-def init_db():
+
+@contextmanager
+def db_conn():
+    """`with db_conn() as conn:` commits on success, rolls back on error,
+    and always returns the connection to the pool."""
     conn = get_db()
-    # Beacon names table
-    conn.execute("CREATE TABLE IF NOT EXISTS beacon_names (id TEXT PRIMARY KEY, name TEXT)")
-    # Notifications history table
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS notifications (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            type TEXT,
-            beacon_name TEXT,
-            event_time TEXT,
-            distance REAL,
-            created_at TEXT
-        )
-        """
-    )
-    # Daily reports table
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS daily_reports (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            created_at TEXT,
-            pdf_path TEXT,
-            report_json TEXT,
-            summary TEXT
-        )
-        """
-    )
-    # Activity reports table
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS activity_reports (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            beacon_name TEXT,
-            pdf_path TEXT,
-            created_at TEXT,
-            summary TEXT
-        )
-        """
-    )
-    # Uptime logs table
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS uptime_logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT,
-            device_count INTEGER,
-            beacon_count INTEGER,
-            status TEXT
-        )
-        """
-    )
-    conn.commit()
-    conn.close()
\ No newline at end of file
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def init_db():
+    """Bring the schema up to date (run once at startup)."""
+    with db_conn() as conn:
+        migrate(conn)
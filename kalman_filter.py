@@ -1,5 +1,7 @@
 """Kalman Filter for RSSI smoothing (Option C: more stable distance)."""
 
+import threading
+
 class KalmanFilter:
     def __init__(
         self,
@@ -58,3 +60,213 @@ class KalmanFilter:
         self.covariance = (1.0 - K) * self.covariance
 
         return self.estimated
+
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; the bank falls back to Python lists
+    np = None
+
+
+class KalmanFilterBank:
+    """Many independent 1-D RSSI Kalman filters stored as parallel arrays.
+
+    Same math as KalmanFilter, but one slot per key (e.g. (device, beacon))
+    instead of one Python object per pair, and one `update` call per batch.
+    Slots idle for longer than the beacon TTL are released by `expire` and
+    the arrays are repacked once enough of them are free.
+
+    Webhook threads share one bank, so every method holds `lock` (an RLock:
+    callers may hold it across an update and the following expire).
+    """
+
+    def __init__(
+        self,
+        process_variance: float = 0.3,
+        measurement_variance: float = 9.0,
+        max_step: float = 3.0,
+        capacity: int = 256,
+    ):
+        self.process_variance = float(process_variance)
+        self.measurement_variance = float(measurement_variance)
+        self.max_step = float(max_step)
+
+        self.lock = threading.RLock()
+        self._slots = {}  # key -> slot index
+        self._keys = []   # slot index -> key (None when free)
+        self._free = []
+        self._alloc(max(1, int(capacity)))
+
+    def _alloc(self, capacity):
+        # estimate is NaN until a slot has seen its first measurement
+        if np is not None:
+            self._est = np.full(capacity, np.nan)
+            self._cov = np.ones(capacity)
+            self._last = np.zeros(capacity)
+        else:
+            self._est = [None] * capacity
+            self._cov = [1.0] * capacity
+            self._last = [0.0] * capacity
+
+    def __len__(self):
+        with self.lock:
+            return len(self._slots)
+
+    @property
+    def capacity(self):
+        return len(self._est)
+
+    def _grow(self, needed):
+        old = self.capacity
+        new = old
+        while new < needed:
+            new *= 2
+        if new == old:
+            return
+        est, cov, last = self._est, self._cov, self._last
+        self._alloc(new)
+        self._est[:old] = est
+        self._cov[:old] = cov
+        self._last[:old] = last
+
+    def _slot(self, key):
+        slot = self._slots.get(key)
+        if slot is not None:
+            return slot
+        if self._free:
+            slot = self._free.pop()
+            self._keys[slot] = key
+        else:
+            slot = len(self._keys)
+            self._grow(slot + 1)
+            self._keys.append(key)
+        self._slots[key] = slot
+        # A reused slot must not keep the previous key's state
+        if np is not None:
+            self._est[slot] = np.nan
+        else:
+            self._est[slot] = None
+        self._cov[slot] = 1.0
+        self._last[slot] = 0.0
+        return slot
+
+    def estimate(self, key):
+        """Current smoothed RSSI for `key`, or None."""
+        with self.lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                return None
+            value = self._est[slot]
+        if value is None or value != value:
+            return None
+        return float(value)
+
+    def update(self, keys, measurements, now_ts):
+        """Feed one measurement per key (None = no reading) and return the
+        smoothed RSSI for each key, in order. Keys must be unique per call.
+        """
+        with self.lock:
+            return self._update(keys, measurements, now_ts)
+
+    def _update(self, keys, measurements, now_ts):
+        slots = [self._slot(k) for k in keys]
+        if not slots:
+            return []
+        if np is None:
+            return self._update_py(slots, measurements, now_ts)
+
+        idx = np.array(slots, dtype=np.intp)
+        m = np.array([np.nan if v is None else float(v) for v in measurements])
+        est = self._est[idx]
+        cov = self._cov[idx]
+
+        has = ~np.isnan(m)
+        first = has & np.isnan(est)
+        step = has & ~first
+
+        # --- Prediction + update (only meaningful where `step`) ---
+        pred_cov = cov + self.process_variance
+        gain = pred_cov / (pred_cov + self.measurement_variance)
+        with np.errstate(invalid="ignore"):
+            delta = np.clip(gain * (m - est), -self.max_step, self.max_step)
+
+        new_est = np.where(step, est + delta, np.where(first, m, est))
+        new_cov = np.where(step, (1.0 - gain) * pred_cov, np.where(first, 1.0, cov))
+
+        self._est[idx] = new_est
+        self._cov[idx] = new_cov
+        self._last[idx] = np.where(has, now_ts, self._last[idx])
+        return [None if v != v else float(v) for v in new_est]
+
+    def _update_py(self, slots, measurements, now_ts):
+        out = []
+        for slot, m in zip(slots, measurements):
+            est = self._est[slot]
+            if m is None:
+                out.append(est)
+                continue
+            m = float(m)
+            self._last[slot] = now_ts
+            if est is None:
+                self._est[slot] = m
+                self._cov[slot] = 1.0
+                out.append(m)
+                continue
+            cov = self._cov[slot] + self.process_variance
+            gain = cov / (cov + self.measurement_variance)
+            delta = max(-self.max_step, min(self.max_step, gain * (m - est)))
+            self._est[slot] = est + delta
+            self._cov[slot] = (1.0 - gain) * cov
+            out.append(self._est[slot])
+        return out
+
+    def expire(self, cutoff):
+        """Release every slot not updated since `cutoff`. Returns the count."""
+        with self.lock:
+            return self._expire(cutoff)
+
+    def _expire(self, cutoff):
+        live = len(self._keys)
+        if np is not None:
+            stale = np.nonzero(self._last[:live] < cutoff)[0].tolist()
+        else:
+            stale = [i for i in range(live) if self._last[i] < cutoff]
+
+        released = 0
+        for slot in stale:
+            key = self._keys[slot]
+            if key is None:
+                continue
+            del self._slots[key]
+            self._keys[slot] = None
+            self._free.append(slot)
+            released += 1
+
+        if self._free and len(self._free) * 2 > len(self._keys):
+            self._compact()
+        return released
+
+    def compact(self):
+        """Repack live slots to the front of the arrays."""
+        with self.lock:
+            self._compact()
+
+    def _compact(self):
+        order = [i for i, k in enumerate(self._keys) if k is not None]
+        keys = [self._keys[i] for i in order]
+        if np is not None:
+            idx = np.array(order, dtype=np.intp)
+            est, cov, last = self._est[idx], self._cov[idx], self._last[idx]
+        else:
+            est = [self._est[i] for i in order]
+            cov = [self._cov[i] for i in order]
+            last = [self._last[i] for i in order]
+
+        self._alloc(max(256, 2 * len(order)))
+        n = len(order)
+        self._est[:n] = est
+        self._cov[:n] = cov
+        self._last[:n] = last
+        self._keys = keys
+        self._slots = {k: i for i, k in enumerate(keys)}
+        self._free = []
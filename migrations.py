@@ -0,0 +1,355 @@
+"""Versioned schema migrations for the main database (beacons.db).
+
+Each migration runs exactly once, in order, and is recorded in the
+schema_version table. `migrate()` is called at app startup (see
+database.init_db); it takes SQLite's write lock first, so when several
+gunicorn workers start together one applies the pending migrations and the
+others find them already recorded.
+
+To change the schema, append a new (version, description, statements)
+entry; never edit one that has shipped.
+"""
+
+import threading
+import time
+
+from config import SAMOA_OFFSET_HOURS
+
+MIGRATIONS = [
+    (
+        1,
+        "baseline tables",
+        [
+            # IF NOT EXISTS so databases created before migrations adopt this
+            "CREATE TABLE IF NOT EXISTS beacon_names (id TEXT PRIMARY KEY, name TEXT)",
+            """
+            CREATE TABLE IF NOT EXISTS devices (
+                id TEXT PRIMARY KEY,
+                name TEXT,
+                color TEXT
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS notifications (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                type TEXT,
+                beacon_name TEXT,
+                event_time TEXT,
+                distance REAL,
+                created_at TEXT
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS daily_reports (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at TEXT,
+                pdf_path TEXT,
+                report_json TEXT,
+                summary TEXT
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS activity_reports (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                beacon_name TEXT,
+                pdf_path TEXT,
+                created_at TEXT,
+                summary TEXT
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS uptime_logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT,
+                device_count INTEGER,
+                beacon_count INTEGER,
+                status TEXT
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS beacon_thresholds (
+                id TEXT PRIMARY KEY,
+                in_meters REAL,
+                out_meters REAL
+            )
+            """,
+        ],
+    ),
+    (
+        2,
+        "index notifications by beacon name",
+        [
+            "CREATE INDEX IF NOT EXISTS idx_notifications_beacon_name ON notifications (beacon_name, id)",
+        ],
+    ),
+    (
+        3,
+        "full-text search and time indexes for notifications",
+        [
+            # External-content FTS5 index: the text lives once, in notifications
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS notifications_fts USING fts5(
+                beacon_name, type, content='notifications', content_rowid='id'
+            )
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS notifications_fts_insert AFTER INSERT ON notifications BEGIN
+                INSERT INTO notifications_fts (rowid, beacon_name, type)
+                VALUES (new.id, new.beacon_name, new.type);
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS notifications_fts_delete AFTER DELETE ON notifications BEGIN
+                INSERT INTO notifications_fts (notifications_fts, rowid, beacon_name, type)
+                VALUES ('delete', old.id, old.beacon_name, old.type);
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS notifications_fts_update AFTER UPDATE ON notifications BEGIN
+                INSERT INTO notifications_fts (notifications_fts, rowid, beacon_name, type)
+                VALUES ('delete', old.id, old.beacon_name, old.type);
+                INSERT INTO notifications_fts (rowid, beacon_name, type)
+                VALUES (new.id, new.beacon_name, new.type);
+            END
+            """,
+            "INSERT INTO notifications_fts (notifications_fts) VALUES ('rebuild')",
+            "CREATE INDEX IF NOT EXISTS idx_notifications_event_time ON notifications (event_time)",
+            "CREATE INDEX IF NOT EXISTS idx_notifications_created_at ON notifications (created_at)",
+        ],
+    ),
+    (
+        4,
+        "hourly/daily rollups for uptime_logs and notifications",
+        [
+            "CREATE INDEX IF NOT EXISTS idx_uptime_logs_timestamp ON uptime_logs (timestamp)",
+            # period is 'hour' (bucket 'YYYY-MM-DD HH') or 'day' (bucket 'YYYY-MM-DD')
+            """
+            CREATE TABLE IF NOT EXISTS uptime_rollups (
+                period TEXT,
+                bucket TEXT,
+                samples INTEGER,
+                device_sum INTEGER,
+                device_min INTEGER,
+                device_max INTEGER,
+                beacon_sum INTEGER,
+                beacon_min INTEGER,
+                beacon_max INTEGER,
+                status_ok INTEGER,
+                status_no_data INTEGER,
+                status_no_devices INTEGER,
+                status_no_beacons INTEGER,
+                status_other INTEGER,
+                PRIMARY KEY (period, bucket)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS notification_rollups (
+                period TEXT,
+                bucket TEXT,
+                beacon_name TEXT,
+                in_count INTEGER,
+                left_count INTEGER,
+                other_count INTEGER,
+                min_distance REAL,
+                max_distance REAL,
+                PRIMARY KEY (period, bucket, beacon_name)
+            )
+            """,
+            "CREATE TABLE IF NOT EXISTS retention_state (key TEXT PRIMARY KEY, value TEXT)",
+        ],
+    ),
+    (
+        5,
+        "compressed per-beacon reading history",
+        [
+            # data is a zlib blob of delta-encoded columns (see services/timeseries_store.py)
+            """
+            CREATE TABLE IF NOT EXISTS beacon_series_chunks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                beacon_id TEXT,
+                start_ms INTEGER,
+                end_ms INTEGER,
+                points INTEGER,
+                data BLOB
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_beacon_series_chunks_range ON beacon_series_chunks (beacon_id, end_ms)",
+            "CREATE INDEX IF NOT EXISTS idx_beacon_series_chunks_end ON beacon_series_chunks (end_ms)",
+        ],
+    ),
+    (
+        6,
+        "integer epoch columns for time-range queries",
+        [
+            "ALTER TABLE notifications ADD COLUMN created_ts INTEGER",
+            "ALTER TABLE notifications ADD COLUMN event_ts INTEGER",
+            "ALTER TABLE uptime_logs ADD COLUMN ts INTEGER",
+            # created_at / timestamp were written in server local time
+            "UPDATE notifications SET created_ts = CAST(strftime('%s', created_at, 'utc') AS INTEGER)",
+            "UPDATE uptime_logs SET ts = CAST(strftime('%s', timestamp, 'utc') AS INTEGER)",
+            # event_time is Samoa local time (format_samoa_time); fall back to created_ts
+            f"""
+            UPDATE notifications SET event_ts = COALESCE(
+                CASE WHEN event_time GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*'
+                     THEN CAST(strftime('%s', event_time, '{-SAMOA_OFFSET_HOURS:+d} hours') AS INTEGER)
+                END,
+                created_ts
+            )
+            """,
+            # Covering indexes: range scans and per-beacon reports never touch the table
+            "CREATE INDEX IF NOT EXISTS idx_notifications_event_ts ON notifications (event_ts, id)",
+            """
+            CREATE INDEX IF NOT EXISTS idx_notifications_beacon_event_ts ON notifications (
+                beacon_name, event_ts, id, type, distance, event_time, created_at
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_uptime_logs_ts ON uptime_logs (ts, id, device_count, beacon_count, status, timestamp)",
+        ],
+    ),
+    (
+        7,
+        "last sighting of every beacon",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS beacon_sightings (
+                beacon_id TEXT PRIMARY KEY,
+                last_seen_raw REAL,
+                last_seen TEXT,
+                device TEXT,
+                distance REAL,
+                rssi REAL
+            )
+            """,
+        ],
+    ),
+    (
+        8,
+        "report jobs",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS report_jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT,
+                params TEXT,
+                status TEXT,
+                progress REAL,
+                message TEXT,
+                result_path TEXT,
+                error TEXT,
+                owner_pid INTEGER,
+                created_at TEXT,
+                started_at TEXT,
+                finished_at TEXT
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_report_jobs_created_at ON report_jobs (created_at)",
+        ],
+    ),
+    (
+        9,
+        "incremental activity aggregates and report caching",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS activity_aggregates (
+                beacon_name TEXT PRIMARY KEY,
+                total INTEGER,
+                in_count INTEGER,
+                left_count INTEGER,
+                first_id INTEGER,
+                last_id INTEGER,
+                updated_at INTEGER
+            )
+            """,
+            "ALTER TABLE activity_reports ADD COLUMN cache_key TEXT",
+            "ALTER TABLE activity_reports ADD COLUMN last_notification_id INTEGER",
+            "CREATE INDEX IF NOT EXISTS idx_activity_reports_cache_key ON activity_reports (cache_key)",
+            "CREATE TABLE IF NOT EXISTS activity_segments (digest TEXT PRIMARY KEY, last_used REAL)",
+            "CREATE INDEX IF NOT EXISTS idx_activity_segments_last_used ON activity_segments (last_used)",
+        ],
+    ),
+    (
+        10,
+        "scheduler lease and last runs",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS scheduler_leases (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """,
+            "CREATE TABLE IF NOT EXISTS scheduled_runs (job TEXT PRIMARY KEY, last_run REAL NOT NULL)",
+        ],
+    ),
+    (
+        11,
+        "metadata version counter",
+        [
+            # One row, bumped by every change to beacon names or devices (see
+            # services/metadata_cache.py)
+            """
+            CREATE TABLE IF NOT EXISTS metadata_version (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL
+            )
+            """,
+            "INSERT OR IGNORE INTO metadata_version (id, version) VALUES (1, 0)",
+            *[
+                f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_metadata_{op} AFTER {op.upper()} ON {table} BEGIN
+                    UPDATE metadata_version SET version = version + 1 WHERE id = 1;
+                END
+                """
+                for table in ("beacon_names", "devices")
+                for op in ("insert", "update", "delete")
+            ],
+        ],
+    ),
+]
+
+_lock = threading.Lock()
+
+
+def current_version(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TEXT
+        )
+        """
+    )
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def migrate(conn, migrations=MIGRATIONS):
+    """Apply pending migrations on `conn`; returns the list of versions applied."""
+    applied = []
+    with _lock:
+        isolation_level = conn.isolation_level
+        conn.isolation_level = None  # explicit transactions so DDL stays inside them
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                version = current_version(conn)
+                for number, description, statements in migrations:
+                    if number <= version:
+                        continue
+                    for statement in statements:
+                        conn.execute(statement)
+                    conn.execute(
+                        "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                        (number, description, time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime())),
+                    )
+                    applied.append(number)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.isolation_level = isolation_level
+    for number in applied:
+        print(f"Applied schema migration {number}")
+    return applied
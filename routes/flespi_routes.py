@@ -1,6 +1,9 @@
-from flask import Blueprint, request
+from flask import Blueprint, request, jsonify
 
-from services.beacon_logic import simplify_message, latest_messages
+from config import INGEST_MODE
+from services import beacon_logic
+from services.beacon_logic import ingest_batch, live_state
+from services.ingest_queue import ingest_queue
 from services.uptime_service import log_uptime_snapshot
 
 flespi_bp = Blueprint("flespi", __name__)
@@ -17,14 +20,35 @@ def flespi_receiver():
     else:
         msgs = data
 
-    count = 0
-    for raw in msgs:
-        if isinstance(raw, dict):
-            simplified = simplify_message(raw)
-            latest_messages[simplified["ident"]] = simplified
-            count += 1
+    if not isinstance(msgs, list):
+        return "invalid payload", 400
+    msgs = [m for m in msgs if isinstance(m, dict)]
+
+    if INGEST_MODE == "queue":
+        # Answer right away; the ingest worker applies the messages.
+        if not ingest_queue.submit(msgs):
+            return "ingest queue full", 503
+        return "OK", 200
+
+    stats = ingest_batch(msgs)
 
     # Log a lightweight uptime snapshot (throttled in uptime_service)
     log_uptime_snapshot()
-    print(f"Received {len(msgs)} msgs, processed {count}, tracking {len(latest_messages)} devices.")
-    return "OK", 200
\ No newline at end of file
+    print(
+        f"Received {len(msgs)} msgs, processed {stats['messages']} "
+        f"({stats['devices']} devices, {stats['beacons']} beacons) in {stats['total_ms']} ms, "
+        f"tracking {live_state.device_count()} devices."
+    )
+    return "OK", 200
+
+
+@flespi_bp.route("/flespi/stats", methods=["GET"])
+def flespi_stats():
+    """Ingest counters: queue depth/lag/drops and the last batch timings."""
+    return jsonify(
+        {
+            "mode": INGEST_MODE,
+            "queue": ingest_queue.stats(),
+            "last_batch": beacon_logic.last_batch_stats,
+        }
+    )
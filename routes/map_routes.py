@@ -1,7 +1,8 @@
-from flask import Blueprint, request, jsonify, render_template, redirect, url_for
+from flask import Blueprint, Response, request, jsonify, make_response, render_template, redirect, url_for
 
-from database import get_db
-from services.beacon_logic import latest_messages
+from services.map_payload import VIEWS, brotli, build_viewport_payload, map_payload_cache, parse_bbox
+from services.metadata_cache import metadata_cache
+from services.map_stream import map_update_hub, stream_slots
 
 map_bp = Blueprint("map", __name__)
 
@@ -18,118 +19,103 @@ def map_page():
     return render_template("index.html")
 
 
-def _ensure_tables(conn):
-    # Beacon and device tables (names + colors)
-    conn.execute(
-        "CREATE TABLE IF NOT EXISTS beacon_names (id TEXT PRIMARY KEY, name TEXT)"
-    )
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS devices (
-            id TEXT PRIMARY KEY,
-            name TEXT,
-            color TEXT
-        )
-        """
-    )
-
-
 @map_bp.route("/data", methods=["GET"])
 def map_data():
-    """Return current devices + beacon names for the frontend.""" 
-
-    # Snapshot so we don't hold the global dict too long
-    snapshot = dict(latest_messages)
-
-    conn = get_db()
-    _ensure_tables(conn)
-
-    # Load beacon names
-    beacon_rows = conn.execute(
-        "SELECT id, name FROM beacon_names"
-    ).fetchall()
-    beacon_names = {row[0]: row[1] for row in beacon_rows}
-
-    # Load device metadata
-    device_rows = conn.execute(
-        "SELECT id, name, color FROM devices"
-    ).fetchall()
-    device_meta = {
-        row[0]: {"name": row[1], "color": row[2]} for row in device_rows
-    }
-
-    # Color palette for devices
-    palette = [
-        "#3b82f6",  # blue
-        "#10b981",  # green
-        "#f59e0b",  # amber
-        "#ef4444",  # red
-        "#8b5cf6",  # violet
-        "#ec4899",  # pink
-        "#22c55e",  # emerald
-        "#f97316",  # orange
-        "#0ea5e9",  # sky
-        "#a855f7",  # purple
-    ]
-    used_colors = {m["color"] for m in device_meta.values() if m.get("color")}
-
-    def next_color():
-        # Pick first unused color, then cycle
-        for c in palette:
-            if c not in used_colors:
-                used_colors.add(c)
-                return c
-        if not palette:
-            return "#3b82f6"
-        idx = len(used_colors) % len(palette)
-        c = palette[idx]
-        used_colors.add(c)
-        return c
-
-    # Ensure every device has a row + color
-    for ident, msg in snapshot.items():
-        if ident == "DAILY_REPORT":
-            continue
-        if ident not in device_meta:
-            color = next_color()
-            conn.execute(
-                "INSERT OR REPLACE INTO devices (id, name, color) VALUES (?, ?, ?)",
-                (ident, None, color),
-            )
-            device_meta[ident] = {"name": None, "color": color}
-
-    conn.commit()
-    conn.close()
-
-    devices_payload = []
-
-    for ident, msg in snapshot.items():
-        if ident == "DAILY_REPORT":
-            devices_payload.append(msg)
-            continue
-
-        meta = device_meta.get(ident, {})
-        devices_payload.append(
-            {
-                "ident": ident,
-                "name": meta.get("name"),
-                "color": meta.get("color"),
-                "timestamp_raw": msg.get("timestamp_raw"),
-                "timestamp": msg.get("timestamp"),
-                "lat": msg.get("lat"),
-                "lon": msg.get("lon"),
-                "beacons": msg.get("beacons") or [],
-            }
-        )
-
-    return jsonify(
-        {
-            "devices": devices_payload,
-            "beacon_names": beacon_names,
-        }
+    """Return current devices + beacon names for the frontend.
+
+    Every response carries a `version` cursor (also sent as the ETag).
+    `/data?since=<version>` returns only devices changed and beacons expired
+    since then, or a full snapshot (`"full": true`) when the cursor is too
+    old, from another process lifetime, or names/colors changed meanwhile.
+    A matching If-None-Match gets 304 Not Modified. Bodies are serialized
+    (and gzip/brotli compressed) once per state version and shared by every
+    viewer.
+
+    `/data?bbox=west,south,east,north&zoom=z` returns only the devices in
+    that box, with nearby devices merged into `clusters` at low zoom.
+
+    Device entries nest their beacons by default. `view=beacons` (also for
+    deltas and bbox requests) instead lists each beacon once under
+    `beacons`, with its best device, every sighting and last seen, and
+    devices come without beacon lists; deltas re-send the beacons that
+    changed and list the ones gone under `removed_beacon_ids`.
+    """
+    view = request.args.get("view", "devices")
+    if view not in VIEWS:
+        return jsonify({"status": "error", "message": f"view must be one of {', '.join(VIEWS)}"}), 400
+    if request.args.get("bbox") is not None:
+        return _viewport_data(view)
+
+    entry = map_payload_cache.get(request.args.get("since"), view)
+    cursor = entry.cursor
+
+    if request.if_none_match.contains(cursor):
+        response = make_response("", 304)
+    else:
+        offered = ["gzip", "identity"] if brotli is None else ["br", "gzip", "identity"]
+        encoding = request.accept_encodings.best_match(offered, default="identity")
+        # Tiny deltas are not worth compressing
+        if len(entry.data) < 512:
+            encoding = "identity"
+        response = Response(entry.encoded(encoding), mimetype="application/json")
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    response.set_etag(cursor)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def _viewport_data(view):
+    bbox = parse_bbox(request.args.get("bbox"))
+    try:
+        zoom = int(request.args.get("zoom", "0"))
+    except ValueError:
+        zoom = None
+    if bbox is None or zoom is None or not 0 <= zoom <= 24:
+        return jsonify({"status": "error", "message": "bbox must be west,south,east,north and zoom 0-24"}), 400
+
+    etag, body = build_viewport_payload(bbox, zoom, view)
+    if request.if_none_match.contains(etag):
+        response = make_response("", 304)
+    else:
+        response = jsonify(body)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+@map_bp.route("/data/stream", methods=["GET"])
+def map_stream():
+    """Server-Sent Events push of the same payloads /data returns, plus notifications.
+
+    The first event is a full snapshot, or the delta since Last-Event-ID when
+    a client reconnects; after that every change is pushed as a delta, and
+    every new notifications row as a `notification` event (ids combine both
+    cursors). Comment heartbeats keep idle connections open through proxies.
+    Past SSE_MAX_CLIENTS streams in this worker the only event is `poll`.
+    `view` is the same as for /data.
+    """
+    view = request.args.get("view", "devices")
+    if view not in VIEWS:
+        return jsonify({"status": "error", "message": f"view must be one of {', '.join(VIEWS)}"}), 400
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("since")
+    return Response(
+        stream_slots.guard(map_update_hub.stream(last_event_id, view)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
 
+@map_bp.route("/data/stats", methods=["GET"])
+def map_data_stats():
+    """Payload cache and push channel counters."""
+    return jsonify({
+        "payload_cache": map_payload_cache.stats(),
+        "stream": map_update_hub.stats(),
+    })
+
+
 @map_bp.route("/rename", methods=["POST"])
 def rename_beacon():
     """Rename a beacon (stored in beacon_names table).""" 
@@ -140,14 +126,8 @@ def rename_beacon():
     if not beacon_id or new_name is None:
         return jsonify({"status": "error", "message": "Invalid input"}), 400
 
-    conn = get_db()
-    _ensure_tables(conn)
-    conn.execute(
-        "INSERT OR REPLACE INTO beacon_names (id, name) VALUES (?, ?)",
-        (beacon_id, new_name),
-    )
-    conn.commit()
-    conn.close()
+    metadata_cache.rename_beacon(beacon_id, new_name)
+    map_update_hub.notify()
 
     return jsonify({"status": "ok"})
 
@@ -162,21 +142,7 @@ def rename_device():
     if not device_id or new_name is None:
         return jsonify({"status": "error", "message": "Invalid input"}), 400
 
-    conn = get_db()
-    _ensure_tables(conn)
-
-    row = conn.execute(
-        "SELECT color FROM devices WHERE id = ?",
-        (device_id,),
-    ).fetchone()
-    existing_color = row[0] if row and row[0] else None
-    color = existing_color or "#3b82f6"
-
-    conn.execute(
-        "INSERT OR REPLACE INTO devices (id, name, color) VALUES (?, ?, ?)",
-        (device_id, new_name, color),
-    )
-    conn.commit()
-    conn.close()
+    metadata_cache.rename_device(device_id, new_name)
+    map_update_hub.notify()
 
     return jsonify({"status": "ok"})
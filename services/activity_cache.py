@@ -0,0 +1,190 @@
+"""Incremental aggregates and PDF caches for activity reports.
+
+activity_aggregates keeps per-beacon totals (events, IN, LEFT) together
+with the last notifications id folded in, so a full-history report only
+reads rows newer than that id to know its summary. The retention purge
+takes the rows it deletes back out (forget_notifications). Together with the id
+range, that summary is the report's cache key: a request whose key
+matches an existing activity report is served that PDF.
+
+When a report does need rendering, the table pages after the first are
+built from segments of ACTIVITY_SEGMENT_PAGES pages. A segment PDF is
+stored under the hash of the rows it shows, so re-rendering a long history
+after a few new events only draws the first page and the segments that
+changed, then merges the rest from disk.
+"""
+
+import hashlib
+import os
+import time
+
+from config import ACTIVITY_SEGMENT_CACHE_MAX
+
+# Bump when the page layout changes so cached segments are not reused
+LAYOUT_VERSION = 1
+
+
+def _type_sums(where):
+    return f"""
+        SELECT COUNT(*),
+               COALESCE(SUM(type = 'in'), 0),
+               COALESCE(SUM(type = 'left'), 0),
+               MIN(id),
+               MAX(id)
+        FROM notifications
+        WHERE {where}
+    """
+
+
+def advance_aggregate(conn, beacon_name):
+    """Fold notifications newer than the stored last id into the beacon's totals.
+
+    Returns {total, in_count, left_count, first_id, last_id}. Runs in its own
+    write transaction so a retention purge cannot land between the read and
+    the write.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT total, in_count, left_count, first_id, last_id FROM activity_aggregates WHERE beacon_name = ?",
+            (beacon_name,),
+        ).fetchone()
+        total, in_count, left_count, first_id, last_id = row if row else (0, 0, 0, None, 0)
+
+        n, n_in, n_left, new_first, new_last = conn.execute(
+            _type_sums("beacon_name = ? AND id > ?"), (beacon_name, last_id)
+        ).fetchone()
+        if n:
+            total += n
+            in_count += n_in
+            left_count += n_left
+            first_id = new_first if first_id is None else first_id
+            last_id = new_last
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO activity_aggregates
+                    (beacon_name, total, in_count, left_count, first_id, last_id, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (beacon_name, total, in_count, left_count, first_id, last_id, int(time.time())),
+            )
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return {
+        "total": total,
+        "in_count": in_count,
+        "left_count": left_count,
+        "first_id": first_id,
+        "last_id": last_id,
+    }
+
+
+def forget_notifications(conn, where, params=()):
+    """Take the notifications matching `where` out of their beacons' totals.
+
+    Call it in the deleting transaction, just before the DELETE with the same
+    `where` (unqualified notifications columns). Only rows already folded in
+    (id <= last_id) are subtracted; first_id moves up to the oldest folded
+    row that stays.
+    """
+    purged = conn.execute(
+        f"""
+        SELECT a.beacon_name, COUNT(*),
+               COALESCE(SUM(type = 'in'), 0),
+               COALESCE(SUM(type = 'left'), 0)
+        FROM notifications JOIN activity_aggregates AS a USING (beacon_name)
+        WHERE {where} AND id <= a.last_id
+        GROUP BY a.beacon_name
+        """,
+        params,
+    ).fetchall()
+    now = int(time.time())
+    for beacon_name, n, n_in, n_left in purged:
+        conn.execute(
+            f"""
+            UPDATE activity_aggregates SET
+                total = total - ?,
+                in_count = in_count - ?,
+                left_count = left_count - ?,
+                first_id = (
+                    SELECT MIN(id) FROM notifications
+                    WHERE beacon_name = ? AND id <= activity_aggregates.last_id AND NOT ({where})
+                ),
+                updated_at = ?
+            WHERE beacon_name = ?
+            """,
+            [n, n_in, n_left, beacon_name, *params, now, beacon_name],
+        )
+    return len(purged)
+
+
+def report_summary(conn, beacon_name, in_range="", range_params=()):
+    """Totals for a report: from the aggregate, or a covering-index scan for a time range."""
+    if not in_range:
+        return advance_aggregate(conn, beacon_name)
+    n, n_in, n_left, first_id, last_id = conn.execute(
+        _type_sums(f"beacon_name = ? AND {in_range}"), [beacon_name] + list(range_params)
+    ).fetchone()
+    return {"total": n, "in_count": n_in, "left_count": n_left, "first_id": first_id, "last_id": last_id}
+
+
+def cache_key(beacon_name, start, end, summary, max_events=0):
+    """Identifies a report's content: same beacon, range, row count, id span and event cap."""
+    parts = [
+        LAYOUT_VERSION, beacon_name, start, end,
+        summary["total"], summary["first_id"], summary["last_id"],
+    ]
+    if max_events:
+        parts.append(f"max{max_events}")
+    text = "|".join(str(v) for v in parts)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def cached_report(conn, key):
+    """Path of an existing activity report PDF with this cache key, if it is still on disk."""
+    row = conn.execute(
+        "SELECT pdf_path FROM activity_reports WHERE cache_key = ? ORDER BY id DESC LIMIT 1", (key,)
+    ).fetchone()
+    if row and row[0] and os.path.exists(row[0]):
+        return row[0]
+    return None
+
+
+def segment_digest(rows):
+    """Content hash of the rows one segment shows."""
+    h = hashlib.sha1(f"v{LAYOUT_VERSION}".encode("ascii"))
+    for row in rows:
+        h.update(repr(row).encode("utf-8"))
+    return h.hexdigest()
+
+
+def segments_dir():
+    path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "activity_reports", "segments"))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def segment_path(digest):
+    return os.path.join(segments_dir(), f"{digest}.pdf")
+
+
+def touch_segments(conn, digests):
+    """Record segment use; the least recently used beyond ACTIVITY_SEGMENT_CACHE_MAX are deleted."""
+    now = time.time()
+    conn.executemany(
+        "INSERT OR REPLACE INTO activity_segments (digest, last_used) VALUES (?, ?)",
+        [(d, now) for d in digests],
+    )
+    stale = conn.execute(
+        "SELECT digest FROM activity_segments ORDER BY last_used DESC LIMIT -1 OFFSET ?",
+        (ACTIVITY_SEGMENT_CACHE_MAX,),
+    ).fetchall()
+    for (digest,) in stale:
+        try:
+            os.remove(segment_path(digest))
+        except FileNotFoundError:
+            pass
+    conn.executemany("DELETE FROM activity_segments WHERE digest = ?", stale)
+    conn.commit()
@@ -0,0 +1,106 @@
+"""Per-beacon aggregate across devices: every sighting and the best device."""
+
+from services.live_mirror import LiveStateMirror
+
+
+def _distance(info):
+    # Server-side Kalman-smoothed distance when available
+    value = info.get("distance_smoothed")
+    return info.get("distance") if value is None else value
+
+
+def _rssi(info):
+    value = info.get("rssi_smoothed")
+    return info.get("rssi") if value is None else value
+
+
+def _rank(sighting):
+    """Sort key: closest first, then strongest, then most recent."""
+    distance = sighting["distance"]
+    rssi = sighting["rssi"]
+    return (
+        float("inf") if distance is None else distance,
+        float("inf") if rssi is None else -rssi,
+        -(sighting["last_seen_raw"] or 0),
+    )
+
+
+class BeaconAggregate(LiveStateMirror):
+    """Folds the per-device beacon lists into one entry per beacon.
+
+    Each beacon keeps the sighting from every device currently hearing it,
+    ordered best first (closest, then strongest RSSI, then most recent).
+    Beacons expired from a device's payload drop out with it.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._device_beacons = {}  # ident -> set of beacon ids it reports
+        self._sightings = {}       # beacon id -> {ident: sighting}
+        self._ranked = {}          # beacon id -> sightings, best first
+
+    def _reset(self):
+        self._device_beacons.clear()
+        self._sightings.clear()
+        self._ranked.clear()
+
+    def _update(self, ident, payload):
+        beacons = {str(b.get("id")): b for b in payload.get("beacons") or [] if b.get("id") is not None}
+        touched = set(beacons)
+
+        for bid in self._device_beacons.get(ident, set()) - touched:
+            seen = self._sightings.get(bid)
+            if seen is not None:
+                seen.pop(ident, None)
+            touched.add(bid)
+
+        for bid, info in beacons.items():
+            self._sightings.setdefault(bid, {})[ident] = {
+                "ident": ident,
+                "distance": _distance(info),
+                "rssi": _rssi(info),
+                "last_seen": info.get("last_seen"),
+                "last_seen_raw": info.get("last_seen_raw"),
+            }
+        if beacons:
+            self._device_beacons[ident] = set(beacons)
+        else:
+            self._device_beacons.pop(ident, None)
+
+        for bid in touched:
+            seen = self._sightings.get(bid)
+            if not seen:
+                self._sightings.pop(bid, None)
+                self._ranked.pop(bid, None)
+            else:
+                self._ranked[bid] = sorted(seen.values(), key=_rank)
+
+    def beacons(self, ids=None):
+        """Return [{id, best, sightings, last_seen, last_seen_raw}], one per beacon.
+
+        With `ids`, only those beacons (ids no device hears are left out).
+        """
+        self.sync()
+        with self._lock:
+            result = []
+            if ids is None:
+                selected = self._ranked.items()
+            else:
+                selected = [(bid, self._ranked[bid]) for bid in ids if bid in self._ranked]
+            for bid, ranked in selected:
+                latest = max(ranked, key=lambda s: s["last_seen_raw"] or 0)
+                result.append({
+                    "id": bid,
+                    "best": ranked[0],
+                    "sightings": list(ranked),
+                    "last_seen": latest["last_seen"],
+                    "last_seen_raw": latest["last_seen_raw"],
+                })
+            return result
+
+    def __len__(self):
+        with self._lock:
+            return len(self._ranked)
+
+
+beacon_aggregate = BeaconAggregate().attach()
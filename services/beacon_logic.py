@@ -1,12 +1,31 @@
 from datetime import datetime, timedelta
 import time
 
-from config import SAMOA_OFFSET_HOURS, TTL_SECONDS, TX_POWER, PATH_LOSS_N
+from config import KALMAN_SMOOTHING, SAMOA_OFFSET_HOURS, TIMESERIES_ENABLED, TTL_SECONDS, TX_POWER, PATH_LOSS_N
+from kalman_filter import KalmanFilterBank
 
-# Shared in-memory state
-latest_messages = {}  # ident -> simplified device payload
-beacon_state = {}     # (ident, beacon_id) -> beacon info
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; batch math falls back to pure Python
+    np = None
 
+from services.live_state import make_live_state
+from services.notification_writer import notification_writer
+from services.proximity_events import proximity_detector
+from services.timeseries_store import timeseries_store
+
+# Shared live state (backend chosen by LIVE_STATE_BACKEND)
+live_state = make_live_state()
+
+# One RSSI Kalman filter slot per (ident, beacon_id), kept per process
+rssi_filters = KalmanFilterBank() if KALMAN_SMOOTHING else None
+_FILTER_EXPIRE_INTERVAL = 10.0  # seconds between idle-slot sweeps
+_last_filter_expire = 0.0
+
+# Callables run with {ident: payload} after every live_state write
+_apply_listeners = []
+
+last_batch_stats = {}  # counts + timings of the most recent ingest_batch call
 
 
 def voltage_to_percent(mv):
@@ -69,72 +88,289 @@ def _coerce_timestamp(ts_raw):
     return ts
 
 
-def simplify_message(msg):
-    """Extract compact structure, apply TTL, use raw RSSI, and update beacon_state."""
-    global latest_messages, beacon_state
+def _message_ident(msg):
+    return msg.get("ident") or msg.get("device.id") or "unknown"
+
+
+def _message_beacons(msg):
+    # BLE beacon data fields differ between firmwares
+    return msg.get("ble.beacons") or msg.get("ble.beacons.list") or []
+
+
+def _beacon_id(b):
+    return b.get("id") or b.get("uuid") or b.get("mac") or "unknown"
 
-    ident = msg.get("ident") or msg.get("device.id") or "unknown"
 
+def _beacon_voltage(b):
+    return b.get("battery.voltage") or (b.get("battery") or {}).get("voltage")
+
+
+def _device_payload(ident, msg):
+    """Device fields of a message; live_state fills in the beacon list."""
     ts_raw = msg.get("timestamp") or msg.get("server.timestamp") or time.time()
     ts = _coerce_timestamp(ts_raw)
+    return {
+        "ident": ident,
+        "timestamp_raw": ts,
+        "timestamp": format_samoa_time(ts),
+        "lat": msg.get("position.latitude"),
+        "lon": msg.get("position.longitude"),
+    }
 
-    lat = msg.get("position.latitude")
-    lon = msg.get("position.longitude")
 
-    # BLE beacon data fields differ between firmwares
-    raw_beacons = msg.get("ble.beacons") or msg.get("ble.beacons.list") or []
+def _smooth_rssi(keys, rssis, now_ts):
+    """Run the filter bank over parsed RSSI values; returns smoothed RSSI per key.
+
+    Also releases filter slots of beacons that have been silent for longer
+    than the TTL (i.e. expired from live_state), at most every few seconds.
+    """
+    global _last_filter_expire
+    if rssi_filters is None:
+        return [None] * len(keys)
+    # One lock for the batch update and the expiry: webhook threads run in parallel
+    with rssi_filters.lock:
+        smoothed = rssi_filters.update(keys, rssis, now_ts)
+        if now_ts - _last_filter_expire >= _FILTER_EXPIRE_INTERVAL:
+            rssi_filters.expire(now_ts - TTL_SECONDS)
+            _last_filter_expire = now_ts
+    return [round(v, 2) if v is not None else None for v in smoothed]
+
+
+def add_apply_listener(fn):
+    """Register fn({ident: payload}) to run after each live_state write."""
+    _apply_listeners.append(fn)
+
+
+def _notify_listeners(stored):
+    for fn in _apply_listeners:
+        try:
+            fn(stored)
+        except Exception as e:
+            print(f"Live state listener {fn!r} failed: {e}")
+
+
+def _record_history(beacon_rows):
+    # The live state is already written; a history failure must not undo the ingest
+    if not TIMESERIES_ENABLED:
+        return
+    try:
+        timeseries_store.append(beacon_rows)
+    except Exception as e:
+        print(f"Could not record beacon history: {e}")
+
+
+def _event_collector(events):
+    """live_state merge hook: run IN/LEFT detection and collect transitions."""
+    def merge(prev, info):
+        event = proximity_detector.classify(prev, info)
+        if event is not None:
+            events.append(event)
+    return merge
+
+
+def get_latest_messages():
+    """Snapshot of ident -> latest simplified device payload."""
+    return live_state.messages()
+
+
+def set_latest_message(ident, payload):
+    live_state.set_message(ident, payload)
+    _notify_listeners({ident: payload})
+
+
+def get_live_cursor():
+    """(epoch, version) of the live state; changes whenever a payload does."""
+    return live_state.cursor()
+
+
+def get_changes_since(version):
+    """Delta since `version` (see live_state.changes_since), or None for a full resync."""
+    return live_state.changes_since(version)
+
+
+def simplify_message(msg):
+    """Extract compact structure, apply TTL, use raw RSSI, and record it in live_state."""
+    ident = _message_ident(msg)
+    raw_beacons = _message_beacons(msg)
 
     now_ts = time.time()
 
-    # Update beacon_state with any beacons in this message
+    beacon_rows = []
     if isinstance(raw_beacons, list):
         for b in raw_beacons:
-            bid = b.get("id") or b.get("uuid") or b.get("mac") or "unknown"
+            bid = _beacon_id(b)
             rssi = b.get("rssi")
             dist = rssi_to_distance(rssi)
-            key = (ident, bid)
-            beacon_state[key] = {
+            smoothed = _smooth_rssi([(ident, bid)], [_to_float(rssi)], now_ts)[0]
+            beacon_rows.append((ident, bid, {
                 "id": bid,
                 "device_ident": ident,
                 "rssi": rssi,
                 "distance": dist,
+                "rssi_smoothed": smoothed,
+                "distance_smoothed": rssi_to_distance(smoothed),
                 "last_seen_raw": now_ts,
                 "last_seen": format_samoa_time(now_ts),
-                "battery_percent": voltage_to_percent(b.get("battery.voltage") or (b.get("battery") or {}).get("voltage")),
-            }
-
-    # TTL filtering: keep only fresh beacons for this device
-    simple_beacons = []
-    for (dev_id, bid), info in list(beacon_state.items()):
-        last_seen_raw = info.get("last_seen_raw", 0)
-        if now_ts - last_seen_raw > TTL_SECONDS:
-            # Expire globally
-            del beacon_state[(dev_id, bid)]
+                "battery_percent": voltage_to_percent(_beacon_voltage(b)),
+            }))
+
+    # TTL filtering happens inside apply: stale beacons expire globally and
+    # the payload keeps only fresh beacons for this device.
+    proximity_detector.refresh_if_due()  # not inside the apply write
+    events = []
+    stored = live_state.apply(
+        beacon_rows, [(ident, _device_payload(ident, msg))], now_ts, merge=_event_collector(events)
+    )
+    notification_writer.submit(events)
+    _record_history(beacon_rows)
+    _notify_listeners(stored)
+    return stored[ident]
+
+
+# ---- Batch ingest ----
+
+def _to_float(value):
+    """float(value) or None; non-finite values count as missing."""
+    try:
+        f = float(value)
+    except (TypeError, ValueError):
+        return None
+    if f != f or f in (float("inf"), float("-inf")):
+        return None
+    return f
+
+
+def batch_rssi_to_distance(rssis, tx_power=TX_POWER, n=PATH_LOSS_N):
+    """Vectorized rssi_to_distance over a list; same values, None where missing."""
+    values = [_to_float(r) for r in rssis]
+    if np is None or not values:
+        return [rssi_to_distance(v, tx_power, n) if v is not None else None for v in values]
+
+    arr = np.array([v if v is not None else np.nan for v in values], dtype=np.float64)
+    with np.errstate(over="ignore", invalid="ignore"):
+        dist = np.power(10.0, (tx_power - arr) / (10 * n))
+    # Python's round() (not np.round) so results match rssi_to_distance exactly
+    return [
+        round(float(d), 2) if v is not None and np.isfinite(d) else None
+        for v, d in zip(values, dist)
+    ]
+
+
+def batch_voltage_to_percent(voltages):
+    """Vectorized voltage_to_percent over a list; same values, None where missing."""
+    values = [_to_float(v) for v in voltages]
+    if np is None or not values:
+        return [voltage_to_percent(v) for v in values]
+
+    arr = np.array([v if v is not None else np.nan for v in values], dtype=np.float64)
+    pct = np.clip((arr / 1000.0 - 2.0) / 1.0, 0.0, 1.0)
+    return [round(float(p) * 100) if v is not None else None for v, p in zip(values, pct)]
+
+
+def ingest_batch(msgs):
+    """Apply a whole flespi payload to live_state.
+
+    Messages are grouped by ident; only the last message per device and the
+    last reading per (device, beacon) are applied, with one clock read, one
+    expiry pass, one Kalman filter bank update and vectorized
+    distance/battery math for the whole batch.
+    Raw values in the resulting device payloads are the same as calling
+    simplify_message on each message in order; the smoothed values differ
+    only in that each beacon feeds its filter once per batch.
+
+    Returns a stats dict (counts and per-phase timings in ms), also kept in
+    `last_batch_stats`.
+    """
+    global last_batch_stats
+
+    t_start = time.perf_counter()
+
+    # ident -> [last message, {beacon_id -> last raw beacon}]
+    groups = {}
+    received = 0
+    for raw in msgs:
+        if not isinstance(raw, dict):
             continue
-        if dev_id == ident:
-            simple_beacons.append(info)
+        received += 1
+        ident = _message_ident(raw)
+        group = groups.get(ident)
+        if group is None:
+            group = groups[ident] = [raw, {}]
+        else:
+            group[0] = raw
+        raw_beacons = _message_beacons(raw)
+        if isinstance(raw_beacons, list):
+            for b in raw_beacons:
+                if isinstance(b, dict):
+                    group[1][_beacon_id(b)] = b
 
-    return {
-        "ident": ident,
-        "timestamp_raw": ts,
-        "timestamp": format_samoa_time(ts),
-        "lat": lat,
-        "lon": lon,
-        "beacons": simple_beacons,
+    flat = [
+        (ident, bid, b)
+        for ident, (_msg, beacons) in groups.items()
+        for bid, b in beacons.items()
+    ]
+    t_grouped = time.perf_counter()
+
+    now_ts = time.time()
+    rssis = [_to_float(b.get("rssi")) for _ident, _bid, b in flat]
+    distances = batch_rssi_to_distance(rssis)
+    smoothed = _smooth_rssi([(ident, bid) for ident, bid, _b in flat], rssis, now_ts)
+    smoothed_distances = batch_rssi_to_distance(smoothed)
+    batteries = batch_voltage_to_percent([_beacon_voltage(b) for _ident, _bid, b in flat])
+    last_seen = format_samoa_time(now_ts)
+    t_computed = time.perf_counter()
+
+    beacon_rows = [
+        (ident, bid, {
+            "id": bid,
+            "device_ident": ident,
+            "rssi": b.get("rssi"),
+            "distance": dist,
+            "rssi_smoothed": rssi_s,
+            "distance_smoothed": dist_s,
+            "last_seen_raw": now_ts,
+            "last_seen": last_seen,
+            "battery_percent": battery,
+        })
+        for (ident, bid, b), dist, rssi_s, dist_s, battery in zip(
+            flat, distances, smoothed, smoothed_distances, batteries
+        )
+    ]
+    devices = [(ident, _device_payload(ident, msg)) for ident, (msg, _beacons) in groups.items()]
+    proximity_detector.refresh_if_due()  # not inside the apply write
+    events = []
+    stored = live_state.apply(beacon_rows, devices, now_ts, merge=_event_collector(events))
+    notification_writer.submit(events)
+    _record_history(beacon_rows)
+    _notify_listeners(stored)
+    t_applied = time.perf_counter()
+
+    last_batch_stats = {
+        "messages": received,
+        "devices": len(groups),
+        "beacons": len(flat),
+        "events": len(events),
+        "vectorized": np is not None,
+        "group_ms": round((t_grouped - t_start) * 1000, 3),
+        "compute_ms": round((t_computed - t_grouped) * 1000, 3),
+        "apply_ms": round((t_applied - t_computed) * 1000, 3),
+        "total_ms": round((t_applied - t_start) * 1000, 3),
     }
+    return last_batch_stats
+
 
 def get_current_health():
     """Return a simple snapshot of system health: (active_devices, active_beacons).
 
     Devices are considered active if their last message timestamp is within TTL_SECONDS.
-    Beacons are counted after applying TTL filtering on beacon_state.
+    Beacons are counted after applying TTL expiry in live_state.
     The special ident "DAILY_REPORT" is ignored when counting devices.
     """
     now_ts = time.time()
 
     # Count active devices
     active_devices = 0
-    for ident, msg in list(latest_messages.items()):
+    for ident, msg in get_latest_messages().items():
         if ident == "DAILY_REPORT":
             continue
         ts_raw = msg.get("timestamp_raw")
@@ -150,18 +386,7 @@ def get_current_health():
         if now_ts - ts_val <= TTL_SECONDS:
             active_devices += 1
 
-    # Count active beacons with TTL filtering
-    active_beacons = 0
-    for key, info in list(beacon_state.items()):
-        last_seen_raw = info.get("last_seen_raw", 0)
-        try:
-            last_seen_val = float(last_seen_raw)
-        except (TypeError, ValueError):
-            continue
-        if now_ts - last_seen_val > TTL_SECONDS:
-            # Expire stale entries
-            del beacon_state[key]
-            continue
-        active_beacons += 1
+    # Count active beacons with TTL expiry
+    active_beacons = live_state.beacon_count(now_ts)
 
     return active_devices, active_beacons
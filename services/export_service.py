@@ -0,0 +1,179 @@
+"""Streaming exports of notifications, uptime_logs and daily_reports.
+
+Rows are read in keyset chunks (id > last id, EXPORT_CHUNK_ROWS at a time)
+on a dedicated read-only connection. Each chunk is its own short read, so a
+multi-million-row export neither holds a pooled connection nor keeps a read
+transaction open that would stop WAL checkpoints, and memory stays at one
+chunk whatever the size of the export.
+"""
+
+import csv
+import io
+import json
+import time
+import zlib
+
+from config import EXPORT_CHUNK_ROWS
+from database import connect
+from services.time_range import range_clause
+
+_FLUSH_BYTES = 64 * 1024
+
+
+def _local_time(ts, sep):
+    return time.strftime(f"%Y-%m-%d{sep}%H:%M:%S", time.localtime(ts))
+
+
+class _Export:
+    def __init__(self, table, columns, time_column, beacon_column=None, time_format=None):
+        self.table = table
+        self.columns = columns
+        self.time_column = time_column
+        self.beacon_column = beacon_column
+        # daily_reports has no epoch column: compare its local-time strings
+        self.time_format = time_format
+
+    def where(self, start, end, beacon):
+        if self.time_format:
+            start = None if start is None else self.time_format(start)
+            end = None if end is None else self.time_format(end)
+        clause, params = range_clause(self.time_column, start, end)
+        where = [clause] if clause else []
+        if beacon and self.beacon_column:
+            where.append(f"{self.beacon_column} = ?")
+            params.append(beacon)
+        return where, params
+
+    def records(self, rows, beacon=None):
+        for row in rows:
+            yield dict(zip(self.columns, row))
+
+    def csv_header(self):
+        return list(self.columns)
+
+    def csv_rows(self, record):
+        yield [record[c] for c in self.columns]
+
+
+class _ReportsExport(_Export):
+    """daily_reports: one record per report; CSV has one line per beacon in it."""
+
+    ENTRY_FIELDS = ["id", "name", "status", "last_seen", "last_device", "distance"]
+
+    def records(self, rows, beacon=None):
+        for report_id, created_at, summary, report_json in rows:
+            try:
+                entries = json.loads(report_json or "[]")
+            except ValueError:
+                entries = []
+            if beacon:
+                entries = [e for e in entries if beacon in (e.get("id"), e.get("name"))]
+                if not entries:
+                    continue
+            yield {"id": report_id, "created_at": created_at, "summary": summary, "report": entries}
+
+    def csv_header(self):
+        return ["report_id", "created_at"] + [f"beacon_{f}" for f in self.ENTRY_FIELDS]
+
+    def csv_rows(self, record):
+        for entry in record["report"]:
+            yield [record["id"], record["created_at"]] + [entry.get(f) for f in self.ENTRY_FIELDS]
+
+
+EXPORTS = {
+    "notifications": _Export(
+        "notifications",
+        ("id", "type", "beacon_name", "event_time", "event_ts", "distance", "created_at", "created_ts"),
+        "event_ts",
+        "beacon_name",
+    ),
+    "uptime": _Export(
+        "uptime_logs",
+        ("id", "timestamp", "ts", "device_count", "beacon_count", "status"),
+        "ts",
+    ),
+    "reports": _ReportsExport(
+        "daily_reports",
+        ("id", "created_at", "summary", "report_json"),
+        "created_at",
+        time_format=lambda ts: _local_time(ts, "T"),
+    ),
+}
+
+
+def iter_records(kind, start=None, end=None, beacon=None, after_id=None, limit=None,
+                 chunk_size=EXPORT_CHUNK_ROWS):
+    """Yield up to `limit` export records (dicts) oldest first, reading `chunk_size` rows at a time."""
+    spec = EXPORTS[kind]
+    where, params = spec.where(start, end, beacon)
+    where.append("id > ?")
+    sql = (
+        f"SELECT {', '.join(spec.columns)} FROM {spec.table} "
+        f"WHERE {' AND '.join(where)} ORDER BY id LIMIT ?"
+    )
+    conn = connect()
+    conn.execute("PRAGMA query_only = ON")
+    try:
+        last_id = after_id or 0
+        sent = 0
+        while True:
+            size = chunk_size if limit is None else max(1, min(chunk_size, limit - sent))
+            rows = conn.execute(sql, params + [last_id, size]).fetchall()
+            if not rows:
+                return
+            for record in spec.records(rows, beacon):
+                yield record
+                sent += 1
+                if limit is not None and sent >= limit:
+                    return
+            last_id = rows[-1][0]
+            if len(rows) < size:
+                return
+    finally:
+        conn.close()
+
+
+def _batched(pieces):
+    """Join small string pieces into ~64 KB response chunks."""
+    buf, size = [], 0
+    for piece in pieces:
+        buf.append(piece)
+        size += len(piece)
+        if size >= _FLUSH_BYTES:
+            yield "".join(buf)
+            buf, size = [], 0
+    if buf:
+        yield "".join(buf)
+
+
+def ndjson_chunks(records):
+    return _batched(json.dumps(r, separators=(",", ":")) + "\n" for r in records)
+
+
+def csv_chunks(kind, records):
+    spec = EXPORTS[kind]
+
+    def lines():
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(spec.csv_header())
+        for record in records:
+            for row in spec.csv_rows(record):
+                writer.writerow(row)
+            if out.tell() >= _FLUSH_BYTES:
+                yield out.getvalue()
+                out.seek(0)
+                out.truncate()
+        yield out.getvalue()
+
+    return _batched(lines())
+
+
+def gzip_chunks(chunks, level=6):
+    """Gzip-compress a stream of text chunks incrementally."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
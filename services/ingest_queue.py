@@ -0,0 +1,142 @@
+"""Bounded in-process queue between the /flespi webhook and ingest_batch."""
+
+from collections import deque
+import threading
+import time
+
+from config import (
+    INGEST_BACKPRESSURE,
+    INGEST_BLOCK_TIMEOUT,
+    INGEST_QUEUE_MAXSIZE,
+)
+from services.beacon_logic import ingest_batch
+from services.uptime_service import log_uptime_snapshot
+
+BACKPRESSURE_POLICIES = ("block", "drop_oldest", "reject")
+
+
+class IngestQueue:
+    """Message queue drained by a single daemon worker thread.
+
+    The webhook only validates and enqueues; the worker takes everything
+    queued so far and applies it with one ingest_batch call, so a burst of
+    small POSTs is coalesced into a few large batches.
+    """
+
+    def __init__(self, maxsize=INGEST_QUEUE_MAXSIZE, policy=INGEST_BACKPRESSURE,
+                 block_timeout=INGEST_BLOCK_TIMEOUT):
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown ingest backpressure policy: {policy!r}")
+        self.maxsize = max(1, int(maxsize))
+        self.policy = policy
+        self.block_timeout = float(block_timeout)
+
+        self._items = deque()  # (enqueued_at, message)
+        self._cond = threading.Condition()
+        self._thread = None
+
+        self.enqueued = 0
+        self.processed = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.batches = 0
+        self.errors = 0
+        self.last_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+
+    # ---- Producer side (webhook) ----
+
+    def submit(self, msgs):
+        """Enqueue a list of messages. Returns False if the payload was refused."""
+        self._ensure_worker()
+        now = time.time()
+
+        with self._cond:
+            if self.policy == "reject":
+                if len(self._items) + len(msgs) > self.maxsize:
+                    self.rejected += len(msgs)
+                    return False
+                self._items.extend((now, m) for m in msgs)
+
+            elif self.policy == "drop_oldest":
+                self._items.extend((now, m) for m in msgs)
+                overflow = len(self._items) - self.maxsize
+                for _ in range(max(0, overflow)):
+                    self._items.popleft()
+                self.dropped += max(0, overflow)
+
+            else:  # block
+                # All or nothing, like "reject": a refused payload is retried
+                # whole by flespi, so none of it may be applied twice.
+                deadline = time.monotonic() + self.block_timeout
+                while len(self._items) + len(msgs) > self.maxsize:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or len(msgs) > self.maxsize:
+                        self.rejected += len(msgs)
+                        return False
+                    self._cond.notify_all()
+                    self._cond.wait(remaining)
+                self._items.extend((now, m) for m in msgs)
+
+            self.enqueued += len(msgs)
+            self._cond.notify_all()
+        return True
+
+    # ---- Consumer side (worker thread) ----
+
+    def _ensure_worker(self):
+        # Started lazily so each gunicorn worker gets its own thread after fork.
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._worker_loop, name="ingest-worker", daemon=True
+                )
+                self._thread.start()
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                while not self._items:
+                    self._cond.wait()
+                batch = list(self._items)
+                self._items.clear()
+                # Wake producers blocked on a full queue
+                self._cond.notify_all()
+
+            try:
+                ingest_batch([m for _ts, m in batch])
+                log_uptime_snapshot()
+            except Exception as e:
+                self.errors += 1
+                print(f"Ingest worker failed on batch of {len(batch)} msgs: {e}")
+                continue
+
+            lag_ms = (time.time() - batch[0][0]) * 1000.0
+            self.last_lag_ms = round(lag_ms, 3)
+            self.max_lag_ms = round(max(self.max_lag_ms, lag_ms), 3)
+            self.processed += len(batch)
+            self.batches += 1
+
+    def stats(self):
+        with self._cond:
+            depth = len(self._items)
+            oldest_age_ms = (time.time() - self._items[0][0]) * 1000.0 if depth else 0.0
+        return {
+            "policy": self.policy,
+            "maxsize": self.maxsize,
+            "depth": depth,
+            "oldest_age_ms": round(oldest_age_ms, 3),
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+            "batches": self.batches,
+            "errors": self.errors,
+            "last_lag_ms": self.last_lag_ms,
+            "max_lag_ms": self.max_lag_ms,
+        }
+
+
+ingest_queue = IngestQueue()
@@ -0,0 +1,59 @@
+"""Base for in-process views derived from the live device payloads."""
+
+import threading
+
+from services.beacon_logic import (
+    add_apply_listener,
+    get_changes_since,
+    get_latest_messages,
+    get_live_cursor,
+)
+
+
+class LiveStateMirror:
+    """Keeps a derived view in step with the live state.
+
+    Subclasses implement `_reset()` and `_update(ident, payload)`. Updates
+    arrive at ingest through the live state apply listener (see `attach`),
+    and `sync()` catches up from the live state cursor before reads, so
+    expiry and writes made by other workers (shared sqlite backend) are
+    picked up too. Both run under `self._lock`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cursor = None  # (epoch, version) the view is known to cover
+
+    def _reset(self):
+        raise NotImplementedError
+
+    def _update(self, ident, payload):
+        raise NotImplementedError
+
+    def attach(self):
+        add_apply_listener(self.apply)
+        return self
+
+    def apply(self, stored):
+        """Apply listener: fold in the devices from one live_state write."""
+        with self._lock:
+            for ident, payload in stored.items():
+                self._update(ident, payload)
+
+    def sync(self):
+        """Catch up with the live state; cheap when nothing changed."""
+        epoch, version = get_live_cursor()
+        with self._lock:
+            if self._cursor == (epoch, version):
+                return
+            changes = None
+            if self._cursor is not None and self._cursor[0] == epoch:
+                changes = get_changes_since(self._cursor[1])
+            if changes is None:
+                self._reset()
+                devices = get_latest_messages()
+            else:
+                devices = changes["devices"]
+            for ident, payload in devices.items():
+                self._update(ident, payload)
+            self._cursor = (epoch, version)
@@ -0,0 +1,493 @@
+"""Pluggable storage for live device/beacon state.
+
+Two backends share one interface:
+
+- MemoryLiveState: per-process dicts plus an expiry min-heap. Fastest, but
+  every gunicorn worker only sees the webhooks it received itself.
+- SQLiteLiveState: a WAL-mode SQLite file shared by every worker on the
+  host, so all of them serve the same map.
+
+Pick one with LIVE_STATE_BACKEND ("memory" or "sqlite").
+
+Both keep a monotonically increasing version: every change to a device
+payload stamps the device with the new version and every expired beacon
+leaves a tombstone, so `changes_since(version)` returns just the delta.
+"""
+
+from collections import OrderedDict, deque
+import heapq
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import uuid
+
+from config import LIVE_STATE_BACKEND, LIVE_STATE_DB_PATH, TTL_SECONDS
+
+# Tombstones are kept for this many versions; older cursors get a full resync
+TOMBSTONE_VERSIONS = 10000
+
+
+class MemoryLiveState:
+    """In-process live state (the default)."""
+
+    def __init__(self, ttl_seconds=TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.latest_messages = {}  # ident -> simplified device payload
+        self.beacon_state = {}     # ident -> {beacon_id -> beacon info}
+
+        # Min-heap of (last_seen_raw, seq, ident, beacon_id) driving TTL expiry.
+        # Entries are invalidated lazily: a popped entry whose timestamp no
+        # longer matches the beacon's current last_seen_raw was superseded by
+        # a newer sighting.
+        self._expiry_heap = []
+        self._expiry_seq = itertools.count()
+        self._beacon_count = 0
+        self._lock = threading.RLock()
+
+        # Version cursors. The epoch changes on every restart so cursors from
+        # a previous process are never mistaken for current ones.
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+        self._device_versions = OrderedDict()  # ident -> version, oldest change first
+        self._tombstones = deque()             # (version, ident, beacon_id) of expired beacons
+        self._tombstone_floor = 0              # cursors below this need a full resync
+
+    def _mark_changed(self, ident):
+        self._device_versions[ident] = self.version
+        self._device_versions.move_to_end(ident)
+
+    def _touch_beacon(self, ident, bid, info):
+        beacons = self.beacon_state.get(ident)
+        if beacons is None:
+            beacons = self.beacon_state[ident] = {}
+        if bid not in beacons:
+            self._beacon_count += 1
+        beacons[bid] = info
+        heapq.heappush(
+            self._expiry_heap, (info["last_seen_raw"], next(self._expiry_seq), ident, bid)
+        )
+
+    def _expire(self, now_ts):
+        # Only heap entries that are actually due are touched, so the cost is
+        # proportional to the number of expiring beacons, not the fleet size.
+        cutoff = now_ts - self.ttl_seconds
+        heap = self._expiry_heap
+        expired = {}  # ident -> {beacon_id}
+        while heap and heap[0][0] < cutoff:
+            last_seen_raw, _seq, ident, bid = heapq.heappop(heap)
+            beacons = self.beacon_state.get(ident)
+            if not beacons:
+                continue
+            info = beacons.get(bid)
+            if info is None or info.get("last_seen_raw") != last_seen_raw:
+                continue
+            del beacons[bid]
+            self._beacon_count -= 1
+            if not beacons:
+                del self.beacon_state[ident]
+            expired.setdefault(ident, set()).add(bid)
+
+        if expired:
+            # Drop expired beacons from the stored device payloads too, so a
+            # device that went quiet stops showing them after the TTL.
+            self.version += 1
+            for ident, bids in expired.items():
+                payload = self.latest_messages.get(ident)
+                if payload is not None:
+                    self.latest_messages[ident] = dict(
+                        payload,
+                        beacons=[b for b in payload.get("beacons") or [] if b.get("id") not in bids],
+                    )
+                    self._mark_changed(ident)
+                for bid in bids:
+                    self._tombstones.append((self.version, ident, bid))
+            while self._tombstones and self._tombstones[0][0] <= self.version - TOMBSTONE_VERSIONS:
+                self._tombstone_floor = self._tombstones.popleft()[0]
+
+        # Rebuild if superseded entries pile up (devices re-reporting the same
+        # beacons faster than the TTL).
+        if len(heap) > 2 * self._beacon_count + 1024:
+            heap[:] = [
+                (info["last_seen_raw"], next(self._expiry_seq), ident, bid)
+                for ident, beacons in self.beacon_state.items()
+                for bid, info in beacons.items()
+            ]
+            heapq.heapify(heap)
+
+    def apply(self, beacon_rows, devices, now_ts, merge=None):
+        """Upsert beacons, expire stale ones and store device payloads.
+
+        beacon_rows: iterable of (ident, beacon_id, info)
+        devices: iterable of (ident, payload without "beacons")
+        merge: optional callable(prev_info or None, info) run for every beacon
+            row before it is stored, atomically with the write
+        Returns {ident: payload} with each device's current beacon list filled in.
+        """
+        cutoff = now_ts - self.ttl_seconds
+        with self._lock:
+            for ident, bid, info in beacon_rows:
+                if merge is not None:
+                    prev = self.beacon_state.get(ident, {}).get(bid)
+                    if prev is not None and prev.get("last_seen_raw", 0) < cutoff:
+                        prev = None
+                    merge(prev, info)
+                self._touch_beacon(ident, bid, info)
+            self._expire(now_ts)
+
+            self.version += 1
+            stored = {}
+            for ident, payload in devices:
+                payload["beacons"] = list(self.beacon_state.get(ident, {}).values())
+                self.latest_messages[ident] = payload
+                self._mark_changed(ident)
+                stored[ident] = payload
+            return stored
+
+    def beacon_count(self, now_ts):
+        with self._lock:
+            self._expire(now_ts)
+            return self._beacon_count
+
+    def device_count(self):
+        return len(self.latest_messages)
+
+    def messages(self):
+        """Snapshot of ident -> latest device payload."""
+        with self._lock:
+            return dict(self.latest_messages)
+
+    def set_message(self, ident, payload):
+        with self._lock:
+            self.version += 1
+            self.latest_messages[ident] = payload
+            self._mark_changed(ident)
+
+    def cursor(self):
+        """(epoch, version) identifying the current state."""
+        return self.epoch, self.version
+
+    def changes_since(self, since):
+        """Devices changed and beacons expired after version `since`.
+
+        Returns {"version", "devices": {ident: payload}, "removed_beacons":
+        [(ident, beacon_id)]}, or None if `since` is too old (or from the
+        future) and the caller needs a full snapshot instead.
+        """
+        with self._lock:
+            if since > self.version or since < self._tombstone_floor:
+                return None
+            devices = {}
+            # Newest changes sit at the end; stop at the first older one
+            for ident in reversed(self._device_versions):
+                if self._device_versions[ident] <= since:
+                    break
+                devices[ident] = self.latest_messages[ident]
+            removed = []
+            for version, ident, bid in reversed(self._tombstones):
+                if version <= since:
+                    break
+                removed.append((ident, bid))
+            return {"version": self.version, "devices": devices, "removed_beacons": removed}
+
+    def clear(self):
+        with self._lock:
+            self.latest_messages.clear()
+            self.beacon_state.clear()
+            self._expiry_heap.clear()
+            self._beacon_count = 0
+            self.version += 1
+            self._device_versions.clear()
+            self._tombstones.clear()
+            self._tombstone_floor = self.version
+
+
+class SQLiteLiveState:
+    """Live state in a WAL-mode SQLite file shared across worker processes.
+
+    Device payloads are stored as JSON exactly as the memory backend keeps
+    them; beacons get their own rows with an index on last_seen_raw, which
+    plays the role of the expiry heap. Reads of the full device map are
+    cached per process and reused until SQLite's data_version on a dedicated
+    watch connection says some other connection (in any worker) committed.
+    """
+
+    # Bumped whenever the layout below changes; the file only holds
+    # short-lived state, so an old layout is simply dropped and recreated.
+    SCHEMA_VERSION = 2
+
+    def __init__(self, path=LIVE_STATE_DB_PATH, ttl_seconds=TTL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        self._watch_lock = threading.Lock()
+        self._watch_conn = None
+        self._watch_pid = None
+        self._cache_key = None
+        self._cache = {}
+
+    def _connect(self, **kwargs):
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, **kwargs)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if conn.execute("PRAGMA user_version").fetchone()[0] != self.SCHEMA_VERSION:
+            self._create_schema(conn)
+        return conn
+
+    def _create_schema(self, conn):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another worker may have won the race while we waited for the lock
+            if conn.execute("PRAGMA user_version").fetchone()[0] == self.SCHEMA_VERSION:
+                conn.execute("COMMIT")
+                return
+            for table in ("live_devices", "live_beacons", "live_tombstones", "live_meta"):
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+            conn.execute(
+                """
+                CREATE TABLE live_devices (
+                    ident TEXT PRIMARY KEY,
+                    payload TEXT,
+                    version INTEGER
+                )
+                """
+            )
+            conn.execute("CREATE INDEX idx_live_devices_version ON live_devices (version)")
+            conn.execute(
+                """
+                CREATE TABLE live_beacons (
+                    ident TEXT,
+                    beacon_id TEXT,
+                    info TEXT,
+                    last_seen_raw REAL,
+                    PRIMARY KEY (ident, beacon_id)
+                )
+                """
+            )
+            conn.execute("CREATE INDEX idx_live_beacons_last_seen ON live_beacons (last_seen_raw)")
+            conn.execute(
+                """
+                CREATE TABLE live_tombstones (
+                    version INTEGER,
+                    ident TEXT,
+                    beacon_id TEXT
+                )
+                """
+            )
+            conn.execute("CREATE INDEX idx_live_tombstones_version ON live_tombstones (version)")
+            conn.execute("CREATE TABLE live_meta (key TEXT PRIMARY KEY, value)")
+            conn.executemany(
+                "INSERT INTO live_meta (key, value) VALUES (?, ?)",
+                [("epoch", uuid.uuid4().hex[:8]), ("version", 0), ("tombstone_floor", 0)],
+            )
+            conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        # Never reuse a connection inherited across fork()
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = self._connect()
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _meta(conn, key):
+        return conn.execute("SELECT value FROM live_meta WHERE key = ?", (key,)).fetchone()[0]
+
+    @staticmethod
+    def _next_version(conn):
+        return conn.execute(
+            "UPDATE live_meta SET value = value + 1 WHERE key = 'version' RETURNING value"
+        ).fetchone()[0]
+
+    def _store_device(self, conn, ident, payload, version):
+        conn.execute(
+            "INSERT OR REPLACE INTO live_devices (ident, payload, version) VALUES (?, ?, ?)",
+            (ident, json.dumps(payload), version),
+        )
+
+    def _expire(self, conn, now_ts, skip_idents=()):
+        expired = conn.execute(
+            "DELETE FROM live_beacons WHERE last_seen_raw < ? RETURNING ident, beacon_id",
+            (now_ts - self.ttl_seconds,),
+        ).fetchall()
+        if not expired:
+            return
+
+        version = self._next_version(conn)
+        conn.executemany(
+            "INSERT INTO live_tombstones (version, ident, beacon_id) VALUES (?, ?, ?)",
+            [(version, ident, bid) for ident, bid in expired],
+        )
+        by_device = {}
+        for ident, bid in expired:
+            by_device.setdefault(ident, set()).add(bid)
+        for ident, bids in by_device.items():
+            if ident in skip_idents:
+                continue  # rewritten by the caller in this transaction anyway
+            row = conn.execute("SELECT payload FROM live_devices WHERE ident = ?", (ident,)).fetchone()
+            if row is None:
+                continue
+            payload = json.loads(row[0])
+            payload["beacons"] = [
+                b for b in payload.get("beacons") or [] if str(b.get("id")) not in bids
+            ]
+            self._store_device(conn, ident, payload, version)
+
+        floor = version - TOMBSTONE_VERSIONS
+        if floor > 0:
+            pruned = conn.execute(
+                "DELETE FROM live_tombstones WHERE version <= ? RETURNING version", (floor,)
+            ).fetchall()
+            if pruned:
+                conn.execute(
+                    "UPDATE live_meta SET value = MAX(value, ?) WHERE key = 'tombstone_floor'",
+                    (max(v for (v,) in pruned),),
+                )
+
+    def apply(self, beacon_rows, devices, now_ts, merge=None):
+        """Same contract as MemoryLiveState.apply, in one write transaction."""
+        cutoff = now_ts - self.ttl_seconds
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if merge is not None:
+                prev = {}
+                for ident in {row[0] for row in beacon_rows}:
+                    for bid, info in conn.execute(
+                        "SELECT beacon_id, info FROM live_beacons WHERE ident = ? AND last_seen_raw >= ?",
+                        (ident, cutoff),
+                    ):
+                        prev[(ident, bid)] = json.loads(info)
+                for ident, bid, info in beacon_rows:
+                    merge(prev.get((ident, str(bid))), info)
+
+            conn.executemany(
+                """
+                INSERT INTO live_beacons (ident, beacon_id, info, last_seen_raw)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (ident, beacon_id) DO UPDATE SET
+                    info = excluded.info,
+                    last_seen_raw = excluded.last_seen_raw
+                """,
+                [
+                    (ident, str(bid), json.dumps(info), info["last_seen_raw"])
+                    for ident, bid, info in beacon_rows
+                ],
+            )
+            self._expire(conn, now_ts, skip_idents={ident for ident, _payload in devices})
+
+            version = self._next_version(conn)
+            stored = {}
+            for ident, payload in devices:
+                # rowid order == first-insert order, same as the dict backend
+                rows = conn.execute(
+                    "SELECT info FROM live_beacons WHERE ident = ? ORDER BY rowid",
+                    (ident,),
+                ).fetchall()
+                payload["beacons"] = [json.loads(r[0]) for r in rows]
+                self._store_device(conn, ident, payload, version)
+                stored[ident] = payload
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return stored
+
+    def beacon_count(self, now_ts):
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT COUNT(*) FROM live_beacons WHERE last_seen_raw >= ?",
+            (now_ts - self.ttl_seconds,),
+        ).fetchone()
+        return row[0]
+
+    def device_count(self):
+        return self._conn().execute("SELECT COUNT(*) FROM live_devices").fetchone()[0]
+
+    def messages(self):
+        with self._watch_lock:
+            if self._watch_conn is None or self._watch_pid != os.getpid():
+                self._watch_conn = self._connect(check_same_thread=False)
+                self._watch_pid = os.getpid()
+                self._cache_key = None
+            conn = self._watch_conn
+            # data_version only moves when *another* connection commits, and
+            # every write goes through the per-thread connections.
+            key = conn.execute("PRAGMA data_version").fetchone()[0]
+            if key != self._cache_key:
+                rows = conn.execute("SELECT ident, payload FROM live_devices").fetchall()
+                self._cache = {ident: json.loads(payload) for ident, payload in rows}
+                self._cache_key = key
+            return dict(self._cache)
+
+    def set_message(self, ident, payload):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._store_device(conn, ident, payload, self._next_version(conn))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def cursor(self):
+        conn = self._conn()
+        meta = dict(conn.execute("SELECT key, value FROM live_meta WHERE key IN ('epoch', 'version')"))
+        return meta["epoch"], meta["version"]
+
+    def changes_since(self, since):
+        """Same contract as MemoryLiveState.changes_since, from one read snapshot."""
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            version = self._meta(conn, "version")
+            if since > version or since < self._meta(conn, "tombstone_floor"):
+                return None
+            rows = conn.execute(
+                "SELECT ident, payload FROM live_devices WHERE version > ?", (since,)
+            ).fetchall()
+            removed = conn.execute(
+                "SELECT ident, beacon_id FROM live_tombstones WHERE version > ?", (since,)
+            ).fetchall()
+        finally:
+            conn.execute("COMMIT")
+        return {
+            "version": version,
+            "devices": {ident: json.loads(payload) for ident, payload in rows},
+            "removed_beacons": [tuple(r) for r in removed],
+        }
+
+    def clear(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM live_beacons")
+            conn.execute("DELETE FROM live_devices")
+            conn.execute("DELETE FROM live_tombstones")
+            version = self._next_version(conn)
+            conn.execute("UPDATE live_meta SET value = ? WHERE key = 'tombstone_floor'", (version,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+LIVE_STATE_BACKENDS = {
+    "memory": MemoryLiveState,
+    "sqlite": SQLiteLiveState,
+}
+
+
+def make_live_state(name=LIVE_STATE_BACKEND):
+    try:
+        return LIVE_STATE_BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown live state backend: {name!r}") from None
@@ -0,0 +1,378 @@
+"""Builds the /data map payload (full snapshots, version deltas and viewports).
+
+Shared by the /data route and the /data/stream push channel so both send
+exactly the same shapes and cursors.
+"""
+
+import gzip
+import json
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; clients then get gzip
+    brotli = None
+
+from config import MAP_CLUSTER_MAX_ZOOM
+from services.beacon_aggregate import beacon_aggregate
+from services.beacon_logic import get_changes_since, get_latest_messages, get_live_cursor
+from services.metadata_cache import metadata_cache
+from services.spatial_index import cluster, device_index
+
+# Color palette for devices
+PALETTE = [
+    "#3b82f6",  # blue
+    "#10b981",  # green
+    "#f59e0b",  # amber
+    "#ef4444",  # red
+    "#8b5cf6",  # violet
+    "#ec4899",  # pink
+    "#22c55e",  # emerald
+    "#f97316",  # orange
+    "#0ea5e9",  # sky
+    "#a855f7",  # purple
+]
+
+
+def _next_color(used_colors):
+    # Pick first unused color, then cycle
+    for c in PALETTE:
+        if c not in used_colors:
+            used_colors.add(c)
+            return c
+    if not PALETTE:
+        return "#3b82f6"
+    idx = len(used_colors) % len(PALETTE)
+    c = PALETTE[idx]
+    used_colors.add(c)
+    return c
+
+
+def _assign_colors(snapshot, device_meta):
+    """Give every device in `snapshot` without a row one with the next palette color."""
+    new_idents = [
+        ident for ident in snapshot
+        if ident != "DAILY_REPORT" and ident not in device_meta
+    ]
+    if not new_idents:
+        return device_meta
+    return metadata_cache.add_devices(new_idents, _next_color)
+
+
+def device_entry(ident, msg, device_meta):
+    if ident == "DAILY_REPORT":
+        return msg
+    meta = device_meta.get(ident, {})
+    return {
+        "ident": ident,
+        "name": meta.get("name"),
+        "color": meta.get("color"),
+        "timestamp_raw": msg.get("timestamp_raw"),
+        "timestamp": msg.get("timestamp"),
+        "lat": msg.get("lat"),
+        "lon": msg.get("lon"),
+        "beacons": msg.get("beacons") or [],
+    }
+
+
+def meta_fingerprint(beacon_names, device_meta):
+    payload = json.dumps([beacon_names, device_meta], sort_keys=True).encode("utf-8")
+    return "%08x" % zlib.crc32(payload)
+
+
+_fingerprint_memo = (None, None)
+
+
+def _current_fingerprint(generation, beacon_names, device_meta):
+    """meta_fingerprint, recomputed only when the metadata cache changed."""
+    global _fingerprint_memo
+    memo_generation, fingerprint = _fingerprint_memo
+    if memo_generation != generation:
+        fingerprint = meta_fingerprint(beacon_names, device_meta)
+        _fingerprint_memo = (generation, fingerprint)
+    return fingerprint
+
+
+def parse_cursor(value):
+    """'<epoch>.<version>.<meta>' -> (epoch, version, meta), or None."""
+    try:
+        epoch, version, meta = (value or "").split(".")
+        return epoch, int(version), meta
+    except ValueError:
+        return None
+
+
+# "devices" (the default) nests beacons per device, "beacons" lists each once
+VIEWS = ("devices", "beacons")
+
+
+def _beacon_view(device_entries, beacon_names, idents=None, ids=None):
+    """Strip per-device beacon lists and add one entry per beacon.
+
+    With `idents`, only beacons whose best device is in that set are kept;
+    with `ids`, only those beacons.
+    """
+    for entry in device_entries:
+        if entry.get("ident") != "DAILY_REPORT":
+            entry.pop("beacons", None)
+    beacons = []
+    for agg in beacon_aggregate.beacons(ids):
+        if idents is not None and agg["best"]["ident"] not in idents:
+            continue
+        agg["name"] = beacon_names.get(agg["id"])
+        beacons.append(agg)
+    return beacons
+
+
+def build_map_payload(since=None, view="devices"):
+    """Return (cursor, body) for the map.
+
+    With a usable `since` cursor the body only holds devices changed and
+    beacons expired since then (`"full": false`); otherwise it is a full
+    snapshot with beacon names (`"full": true`). A full snapshot is also
+    sent when names/colors changed after `since`, because they are merged
+    into every device entry.
+
+    In the beacon view (view="beacons"), device entries carry no beacon lists; `beacons`
+    has each beacon once, with its best device (closest, then strongest),
+    every sighting and last seen. A delta re-sends the beacons the changed
+    devices hear or lost and lists under `removed_beacon_ids` those no
+    device hears any more.
+    """
+    since = parse_cursor(since) if isinstance(since, str) else since
+
+    # Read the cursor before the state so anything newer is re-sent next time
+    epoch, version = get_live_cursor()
+    changes = None
+    if since is not None and since[0] == epoch:
+        changes = get_changes_since(since[1])
+
+    generation, beacon_names, device_meta = metadata_cache.versioned_snapshot()
+    fingerprint = _current_fingerprint(generation, beacon_names, device_meta)
+    full = changes is None or since[2] != fingerprint
+    if full:
+        # Snapshot so we don't hold the live state too long
+        snapshot = get_latest_messages()
+    else:
+        snapshot = changes["devices"]
+
+    # New devices get a color here; that changes the fingerprint, but they are
+    # in this response, so the new cursor is still accurate for the client.
+    assigned = _assign_colors(snapshot, device_meta)
+    if assigned is not device_meta:
+        device_meta = assigned
+        fingerprint = meta_fingerprint(beacon_names, device_meta)
+    cursor = f"{epoch}.{version}.{fingerprint}"
+
+    devices_payload = [
+        device_entry(ident, msg, device_meta) for ident, msg in snapshot.items()
+    ]
+
+    body = {"devices": devices_payload, "version": cursor, "full": full}
+    if full:
+        body["beacon_names"] = beacon_names
+
+    if view == "devices":
+        if not full:
+            body["removed_beacons"] = [
+                {"ident": ident, "id": bid} for ident, bid in changes["removed_beacons"]
+            ]
+    elif full:
+        body["beacons"] = _beacon_view(devices_payload, beacon_names)
+        body["view"] = "beacons"
+    else:
+        # Beacons the changed devices hear, or heard before they expired
+        touched = {str(bid) for _ident, bid in changes["removed_beacons"]}
+        for msg in snapshot.values():
+            touched.update(str(b["id"]) for b in msg.get("beacons") or [] if b.get("id") is not None)
+        body["beacons"] = _beacon_view(devices_payload, beacon_names, ids=sorted(touched))
+        body["removed_beacon_ids"] = sorted(touched - {b["id"] for b in body["beacons"]})
+        body["view"] = "beacons"
+    return cursor, body
+
+
+def parse_bbox(value):
+    """'west,south,east,north' -> tuple of floats, or None if malformed."""
+    try:
+        west, south, east, north = (float(v) for v in (value or "").split(","))
+    except ValueError:
+        return None
+    if not (-90.0 <= south <= north <= 90.0 and -180.0 <= west <= 180.0 and -180.0 <= east <= 180.0):
+        return None
+    return west, south, east, north
+
+
+def build_viewport_payload(bbox, zoom, view="devices"):
+    """Return (etag, body) for the devices inside `bbox` at map `zoom`.
+
+    Below MAP_CLUSTER_MAX_ZOOM, devices that would overlap on screen come
+    back as `clusters` (centroid, count, bounds) instead of entries. Always
+    a full answer for the viewport; the ETag combines the live cursor with
+    the viewport, so an unchanged view still gets 304s. With
+    view="beacons", beacons come once each, for those whose best device is drawn
+    individually in the viewport.
+    """
+    epoch, version = get_live_cursor()
+    generation, beacon_names, device_meta = metadata_cache.versioned_snapshot()
+    fingerprint = _current_fingerprint(generation, beacon_names, device_meta)
+
+    points = device_index.query(*bbox)
+    clusters = []
+    if zoom < MAP_CLUSTER_MAX_ZOOM:
+        points, clusters = cluster(points, zoom)
+
+    messages = get_latest_messages() if points else {}
+    assigned = _assign_colors({ident: None for ident, _lat, _lon in points}, device_meta)
+    if assigned is not device_meta:
+        device_meta = assigned
+        fingerprint = meta_fingerprint(beacon_names, device_meta)
+    devices_payload = [
+        device_entry(ident, messages[ident], device_meta)
+        for ident, _lat, _lon in points
+        if ident in messages
+    ]
+
+    cursor = f"{epoch}.{version}.{fingerprint}"
+    view_key = "%08x" % zlib.crc32(json.dumps([bbox, zoom, view]).encode("utf-8"))
+    body = {
+        "devices": devices_payload,
+        "clusters": clusters,
+        "beacon_names": beacon_names,
+        "version": cursor,
+        "viewport": {"bbox": list(bbox), "zoom": zoom},
+        "full": True,
+    }
+    if view == "beacons":
+        body["beacons"] = _beacon_view(
+            devices_payload, beacon_names, {ident for ident, _lat, _lon in points}
+        )
+        body["view"] = "beacons"
+    return f"{cursor}:{view_key}", body
+
+
+class SerializedPayload:
+    """One built map payload as JSON bytes, plus lazily compressed variants."""
+
+    def __init__(self, cursor, full, data):
+        self.cursor = cursor
+        self.full = full
+        self.data = data
+        self._encoded = {"identity": data}
+        self._lock = threading.Lock()
+
+    def encoded(self, encoding):
+        """Return the body for 'br', 'gzip' or 'identity', compressing once."""
+        body = self._encoded.get(encoding)
+        if body is not None:
+            return body
+        with self._lock:
+            body = self._encoded.get(encoding)
+            if body is None:
+                if encoding == "br":
+                    body = brotli.compress(self.data, quality=5)
+                else:
+                    body = gzip.compress(self.data, compresslevel=6)
+                self._encoded[encoding] = body
+        return body
+
+
+class MapPayloadCache:
+    """Serializes each map payload once per (state version, metadata, since).
+
+    Every viewer polling the same cursor gets the same bytes; concurrent
+    misses for one key wait for a single build instead of each building.
+    """
+
+    def __init__(self, max_entries=64):
+        self.max_entries = int(max_entries)
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.builds = 0
+        self.build_ms_total = 0.0
+        self.last_build_ms = 0.0
+
+    def _key(self, since, view):
+        """Cache key for what the build for (since, view) would return right now."""
+        epoch, version = get_live_cursor()
+        generation, beacon_names, device_meta = metadata_cache.versioned_snapshot()
+        fingerprint = _current_fingerprint(generation, beacon_names, device_meta)
+        parsed = parse_cursor(since) if isinstance(since, str) else since
+        if parsed is None or parsed[0] != epoch or parsed[2] != fingerprint:
+            return (epoch, version, fingerprint, None, view)  # full snapshot
+        return (epoch, version, fingerprint, parsed[1], view)
+
+    def get(self, since=None, view="devices"):
+        """Return the SerializedPayload for `since` (a cursor string or None) in `view`."""
+        key = self._key(since, view)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            waiter = self._inflight.get(key)
+            if waiter is None:
+                waiter = self._inflight[key] = threading.Event()
+                owner = True
+                self.misses += 1
+            else:
+                owner = False
+                self.coalesced += 1
+
+        if not owner:
+            waiter.wait()
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is not None:
+                return entry
+            # The build failed or was already evicted; build our own copy
+            return self._build(since, view)
+
+        try:
+            entry = self._build(since, view)
+            with self._lock:
+                self._entries[key] = entry
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            waiter.set()
+        return entry
+
+    def _build(self, since, view):
+        start = time.perf_counter()
+        cursor, body = build_map_payload(since, view)
+        data = json.dumps(body, separators=(",", ":")).encode("utf-8")
+        entry = SerializedPayload(cursor, body["full"], data)
+        elapsed = (time.perf_counter() - start) * 1000.0
+        with self._lock:
+            self.builds += 1
+            self.build_ms_total += elapsed
+            self.last_build_ms = elapsed
+        return entry
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "builds": self.builds,
+                "build_ms_total": round(self.build_ms_total, 2),
+                "build_ms_avg": round(self.build_ms_total / self.builds, 2) if self.builds else 0.0,
+                "last_build_ms": round(self.last_build_ms, 2),
+                "brotli": brotli is not None,
+            }
+
+
+map_payload_cache = MapPayloadCache()
@@ -0,0 +1,194 @@
+"""Push channel for live map updates and notifications (Server-Sent Events)."""
+
+import json
+import queue
+import threading
+
+from config import SSE_MAX_CLIENTS, SSE_POLL_RETRY_MS
+from services.beacon_logic import add_apply_listener, get_live_cursor
+from services.map_payload import map_payload_cache
+from services.proximity_events import Subscription, notification_feed
+
+
+class StreamSlots:
+    """Caps the SSE streams open in this process.
+
+    Each open stream holds a gthread worker thread, so without a cap a few
+    dozen browser tabs would leave none for webhooks and pages.
+    """
+
+    def __init__(self, limit=SSE_MAX_CLIENTS, poll_retry_ms=SSE_POLL_RETRY_MS):
+        self.limit = int(limit)
+        self.poll_retry_ms = int(poll_retry_ms)
+        self._lock = threading.Lock()
+        self.open = 0
+        self.turned_away = 0
+
+    def guard(self, frames):
+        """Yield `frames` while holding a slot; past the cap, tell the client to poll instead."""
+        with self._lock:
+            admitted = self.open < self.limit
+            if admitted:
+                self.open += 1
+            else:
+                self.turned_away += 1
+        if not admitted:
+            frames.close()
+            yield f"retry: {self.poll_retry_ms}\nevent: poll\ndata: {{}}\n\n"
+            return
+        try:
+            yield from frames
+        finally:
+            frames.close()
+            with self._lock:
+                self.open -= 1
+
+    def stats(self):
+        with self._lock:
+            return {"open": self.open, "limit": self.limit, "turned_away": self.turned_away}
+
+
+stream_slots = StreamSlots()
+
+
+def split_event_id(value):
+    """'<map cursor>~<notification id>' -> (map cursor, notification id); either may be None."""
+    if not value:
+        return None, None
+    cursor, _, notification_id = value.partition("~")
+    return cursor or None, notification_id or None
+
+
+class MapUpdateHub:
+    """Builds each map delta once per process and view and fans it out to SSE clients.
+
+    A single thread wakes when this process applies ingest (or a rename) and
+    otherwise checks the live cursor every `poll_interval` seconds, which
+    also picks up changes made by other workers through a shared backend.
+
+    Each client is also subscribed to the notification feed on the same
+    queue, so one stream per map tab carries both; event ids combine the map
+    cursor and the last notification id, and a reconnect resumes both. A
+    client whose queue fills up has its stream ended and reconnects that way.
+    """
+
+    def __init__(self, poll_interval=1.0, heartbeat_interval=15.0, client_queue_size=1000):
+        self.poll_interval = float(poll_interval)
+        self.heartbeat_interval = float(heartbeat_interval)
+        # Room for the notification backlog a reconnecting client is sent
+        self.client_queue_size = max(int(client_queue_size), notification_feed.backlog_limit + 32)
+        self._clients = {}        # client -> view
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._cursors = {}        # view -> last broadcast cursor
+        self._live_cursor = None  # (epoch, version) behind them
+
+        self.events_sent = 0
+        self.overflows = 0
+
+    def notify(self, *_args):
+        """Wake the publisher (called after ingest and metadata writes)."""
+        self._wake.set()
+
+    def _subscribe(self, view):
+        client = Subscription(self.client_queue_size)
+        with self._lock:
+            self._clients[client] = view
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._publish_loop, name="map-update-hub", daemon=True
+                )
+                self._thread.start()
+        return client
+
+    def _unsubscribe(self, client):
+        notification_feed.unsubscribe(client)
+        with self._lock:
+            self._clients.pop(client, None)
+            if client.overflowed:
+                self.overflows += 1
+
+    def stream(self, last_event_id=None, view="devices"):
+        """Generator of SSE frames for one client of `view` (see map_payload.VIEWS)."""
+        since, notification_after = split_event_id(last_event_id)
+        # Subscribe before building the first payload so no broadcast is missed
+        client = self._subscribe(view)
+        try:
+            notification_feed.subscribe(notification_after, sub=client)
+            yield "retry: 3000\n\n"
+            entry = map_payload_cache.get(since, view)
+            with self._lock:
+                # The first client's snapshot is the publisher's baseline for its view
+                self._cursors.setdefault(view, entry.cursor)
+            cursor = entry.cursor
+            yield f"id: {cursor}~{client.last_id}\nevent: map\ndata: {entry.data.decode('utf-8')}\n\n"
+            while True:
+                try:
+                    item = client.get(timeout=self.heartbeat_interval)
+                except queue.Empty:
+                    yield ": heartbeat\n\n"
+                    continue
+                if item is None:
+                    return  # fell behind: the client reconnects with Last-Event-ID
+                if isinstance(item, tuple):
+                    cursor, data = item
+                    yield f"id: {cursor}~{client.last_id}\nevent: map\ndata: {data}\n\n"
+                elif item.get("resync"):
+                    yield f"event: resync\ndata: {json.dumps(item)}\n\n"
+                else:
+                    client.last_id = item["id"]
+                    yield f"id: {cursor}~{client.last_id}\nevent: notification\ndata: {json.dumps(item)}\n\n"
+        finally:
+            self._unsubscribe(client)
+
+    def _publish_loop(self):
+        while True:
+            forced = self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            with self._lock:
+                clients = dict(self._clients)
+                # A view's first client has not sent its snapshot yet, or it left
+                views = set(clients.values())
+                self._cursors = {v: c for v, c in self._cursors.items() if v in views}
+                cursors = dict(self._cursors)
+                if not clients:
+                    self._live_cursor = None
+                    continue
+                if not cursors:
+                    continue
+
+            try:
+                live_cursor = get_live_cursor()
+                if not forced and live_cursor == self._live_cursor:
+                    continue
+                entries = {view: map_payload_cache.get(cursor, view) for view, cursor in cursors.items()}
+            except Exception as e:
+                print(f"Map update hub failed to build payload: {e}")
+                continue
+
+            self._live_cursor = live_cursor
+            for view, entry in entries.items():
+                if entry.cursor == cursors[view]:
+                    continue
+                with self._lock:
+                    self._cursors[view] = entry.cursor
+                # Decoded once, shared by every client of the view
+                event = (entry.cursor, entry.data.decode("utf-8"))
+                for client, client_view in clients.items():
+                    if client_view == view:
+                        client.offer(event)
+                self.events_sent += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "clients": len(self._clients),
+                "events_sent": self.events_sent,
+                "overflows": self.overflows,
+                "slots": stream_slots.stats(),
+            }
+
+
+map_update_hub = MapUpdateHub()
+add_apply_listener(map_update_hub.notify)
@@ -0,0 +1,134 @@
+"""Process-wide cache of beacon names and device names/colors.
+
+Loaded once, updated write-through by the rename routes and by automatic
+color assignment, and invalidated across workers by the metadata_version
+row, which triggers bump on every change to beacon_names or devices.
+Other commits (notifications, uptime, ...) leave it alone, so they never
+force a reload. Our own writes record the version they produced, so they
+do not either.
+"""
+
+import os
+import threading
+
+from config import DB_PATH
+from database import connect
+
+
+class MetadataCache:
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._key = None
+        self._beacon_names = {}
+        self._device_meta = {}
+        self.reloads = 0
+        self.generation = 0  # bumped whenever the cached contents change
+
+    def _connection(self):
+        # Never reuse a connection inherited across fork()
+        if self._conn is None or self._pid != os.getpid():
+            conn = connect(self.path, isolation_level=None, check_same_thread=False)
+            self._conn = conn
+            self._pid = os.getpid()
+            self._key = None
+        return self._conn
+
+    @staticmethod
+    def _version(conn):
+        return conn.execute("SELECT version FROM metadata_version WHERE id = 1").fetchone()[0]
+
+    def _refresh(self, conn):
+        key = self._version(conn)
+        if key == self._key:
+            return
+        self._beacon_names = dict(conn.execute("SELECT id, name FROM beacon_names").fetchall())
+        self._device_meta = {
+            row[0]: {"name": row[1], "color": row[2]}
+            for row in conn.execute("SELECT id, name, color FROM devices")
+        }
+        self._key = key
+        self.reloads += 1
+        self.generation += 1
+
+    def _write(self, fn):
+        """Run fn(conn) in a write transaction on top of a current cache."""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Holding the write lock, so this sees every other commit
+                self._refresh(conn)
+                result = fn(conn)
+                # fn() already applied its change to the cache
+                self._key = self._version(conn)
+                conn.execute("COMMIT")
+                self.generation += 1
+            except Exception:
+                conn.execute("ROLLBACK")
+                self._key = None
+                raise
+            return result
+
+    def snapshot(self):
+        """Return copies of (beacon_names, device_meta)."""
+        return self.versioned_snapshot()[1:]
+
+    def versioned_snapshot(self):
+        """Return (generation, beacon_names, device_meta), read together."""
+        with self._lock:
+            self._refresh(self._connection())
+            return self.generation, dict(self._beacon_names), dict(self._device_meta)
+
+    def beacon_names(self):
+        with self._lock:
+            self._refresh(self._connection())
+            return dict(self._beacon_names)
+
+    def rename_beacon(self, beacon_id, name):
+        def write(conn):
+            conn.execute(
+                "INSERT OR REPLACE INTO beacon_names (id, name) VALUES (?, ?)",
+                (beacon_id, name),
+            )
+            self._beacon_names[beacon_id] = name
+
+        self._write(write)
+
+    def rename_device(self, ident, name, default_color="#3b82f6"):
+        """Rename a device, keeping its color (or `default_color` if it has none)."""
+        def write(conn):
+            color = (self._device_meta.get(ident) or {}).get("color") or default_color
+            conn.execute(
+                "INSERT OR REPLACE INTO devices (id, name, color) VALUES (?, ?, ?)",
+                (ident, name, color),
+            )
+            self._device_meta[ident] = {"name": name, "color": color}
+
+        self._write(write)
+
+    def add_devices(self, idents, next_color):
+        """Give each ident without a devices row one, colored by next_color(used_colors).
+
+        Returns the updated device_meta copy. Idents another worker added in
+        the meantime keep that worker's color.
+        """
+        def write(conn):
+            used_colors = {m["color"] for m in self._device_meta.values() if m.get("color")}
+            for ident in idents:
+                if ident in self._device_meta:
+                    continue
+                color = next_color(used_colors)
+                conn.execute(
+                    "INSERT INTO devices (id, name, color) VALUES (?, ?, ?)",
+                    (ident, None, color),
+                )
+                self._device_meta[ident] = {"name": None, "color": color}
+            return dict(self._device_meta)
+
+        return self._write(write)
+
+
+metadata_cache = MetadataCache()
@@ -0,0 +1,96 @@
+"""Notifications history queries: full-text search and keyset pagination."""
+
+import re
+
+from database import db_conn
+from services.time_range import range_clause
+
+PAGE_SIZE = 100
+
+_COLUMNS = "n.id, n.type, n.beacon_name, n.event_time, n.distance, n.created_at"
+# A date prefix ("2024-05", "2024-05-01 13:"); bare numbers such as "1001"
+# are beacon names or ids and go to full-text search
+_TIME_QUERY = re.compile(r"^\d{4}-\d{2}(-\d{2}([ T]\d{2}(:\d{2}){0,2}:?)?)?$")
+
+
+def fts_query(q):
+    """Turn free text into an FTS5 query: every word must prefix-match."""
+    words = re.findall(r"\w+", q)
+    return " ".join(f'"{w}"*' for w in words)
+
+
+def _prefix_range(prefix):
+    # Everything that starts with `prefix` sorts in [prefix, prefix + U+10FFFF)
+    return prefix, prefix + "\U0010ffff"
+
+
+def search_history(q="", before_id=None, limit=PAGE_SIZE, start=None, end=None):
+    """Return (rows, next_before_id), newest first.
+
+    `q` is matched against beacon name and type through the FTS index, or,
+    when it looks like a date/time ("2024-05-01", "2024-05-01 13:"), as a
+    prefix of event_time or created_at through their indexes. Pages are
+    keyset-based: pass the returned next_before_id as `before_id` for the
+    next (older) page; it is None on the last page. `start`/`end` (epoch
+    seconds) keep only events with start <= event_ts < end.
+    """
+    q = (q or "").strip()
+    params = []
+    where = []
+    if before_id is not None:
+        where.append("n.id < ?")
+        params.append(int(before_id))
+    in_range, range_params = range_clause("n.event_ts", start, end)
+    if in_range:
+        where.append(in_range)
+        params += range_params
+
+    sql = f"SELECT {_COLUMNS} FROM notifications n"
+    if q and _TIME_QUERY.match(q):
+        event_lo, event_hi = _prefix_range(q.replace("T", " "))
+        created_lo, created_hi = _prefix_range(q.replace(" ", "T"))
+        where.append(
+            "((n.event_time >= ? AND n.event_time < ?) OR (n.created_at >= ? AND n.created_at < ?))"
+        )
+        params += [event_lo, event_hi, created_lo, created_hi]
+    elif q:
+        match = fts_query(q)
+        if not match:
+            return [], None
+        if in_range:
+            # Text and a time window: check the FTS hits inside the event_ts range
+            where.append("n.id IN (SELECT rowid FROM notifications_fts WHERE notifications_fts MATCH ?)")
+            params.append(match)
+        else:
+            fts_where = ["notifications_fts MATCH ?"]
+            fts_params = [match]
+            if before_id is not None:
+                fts_where.append("rowid < ?")
+                fts_params.append(int(before_id))
+            # The FTS index walks rowids newest first and stops after one page
+            sql = f"""
+                SELECT {_COLUMNS}
+                FROM (
+                    SELECT rowid AS id FROM notifications_fts
+                    WHERE {" AND ".join(fts_where)}
+                    ORDER BY rowid DESC
+                    LIMIT ?
+                ) AS hits
+                JOIN notifications n ON n.id = hits.id
+            """
+            params = fts_params + [limit + 1]
+            where = []
+
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY n.id DESC LIMIT ?"
+    params.append(limit + 1)
+
+    with db_conn() as conn:
+        rows = conn.execute(sql, params).fetchall()
+
+    next_before_id = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_before_id = rows[-1][0]
+    return rows, next_before_id
@@ -0,0 +1,186 @@
+"""Background writer that group-commits notification rows."""
+
+import threading
+import time
+
+from config import (
+    NOTIFY_BATCH_MAX,
+    NOTIFY_FLUSH_INTERVAL,
+    NOTIFY_MAX_RETRIES,
+    NOTIFY_RETRY_BACKOFF,
+)
+from database import db_conn
+from services.metadata_cache import metadata_cache
+from services.time_range import samoa_to_epoch
+
+
+def _event_ts(event, default):
+    ts = event.get("event_ts")
+    if ts is None:
+        ts = samoa_to_epoch(event.get("event_time"))
+    return default if ts is None else int(ts)
+
+
+class NotificationWriter:
+    """Collects notification events and inserts them with executemany.
+
+    Events are dicts with keys type, beacon_id and/or beacon_name,
+    event_time, distance and optionally event_ts (epoch seconds; parsed
+    from event_time, else the write time, when missing). Beacon names are resolved from beacon_names at
+    flush time so the ingest path never touches the database.
+
+    Pending events are committed together in one transaction once
+    `flush_interval` seconds have passed since the first of them arrived
+    (the durability window), or sooner when `batch_max` are pending or a
+    caller is waiting for its events to be durable. A failed batch is
+    retried up to `max_retries` times with doubling backoff, then dropped.
+    """
+
+    def __init__(self, flush_interval=NOTIFY_FLUSH_INTERVAL, batch_max=NOTIFY_BATCH_MAX,
+                 max_retries=NOTIFY_MAX_RETRIES, retry_backoff=NOTIFY_RETRY_BACKOFF):
+        self.flush_interval = float(flush_interval)
+        self.batch_max = int(batch_max)
+        self.max_retries = int(max_retries)
+        self.retry_backoff = float(retry_backoff)
+        self._pending = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._urgent = False
+        self._generation = 0       # batch the pending events will go out in
+        self._done_generation = -1  # last batch written or given up on
+        self._failed_generations = set()
+
+        self.written = 0
+        self.batches = 0
+        self.errors = 0
+        self.retries = 0
+        self.dropped = 0
+
+    def submit(self, events, wait=False, timeout=10.0):
+        """Queue events; with wait=True block until they are committed.
+
+        Returns True when queued (or, with wait, committed) and False when
+        waiting timed out or the batch was dropped after its retries.
+        """
+        if not events:
+            return True
+        self._ensure_worker()
+        with self._cond:
+            self._pending.extend(events)
+            generation = self._generation
+            if wait:
+                self._urgent = True
+            self._cond.notify_all()
+            if not wait:
+                return True
+            deadline = time.monotonic() + timeout
+            while self._done_generation < generation:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return generation not in self._failed_generations
+
+    def _ensure_worker(self):
+        # Started lazily so each gunicorn worker gets its own thread after fork.
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._worker_loop, name="notification-writer", daemon=True
+                )
+                self._thread.start()
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            # Let a window's worth of events accumulate, then write them together
+            deadline = time.monotonic() + self.flush_interval
+            while not self._urgent and len(self._pending) < self.batch_max:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._pending
+            self._pending = []
+            self._urgent = False
+            generation = self._generation
+            self._generation += 1
+        return generation, batch
+
+    def _worker_loop(self):
+        while True:
+            generation, batch = self._take_batch()
+            ok = self._write_with_retries(batch)
+            with self._cond:
+                self._done_generation = generation
+                if not ok:
+                    self._failed_generations.add(generation)
+                    # Only recent failures can still have waiters
+                    self._failed_generations = {
+                        g for g in self._failed_generations if g > generation - 1000
+                    }
+                self._cond.notify_all()
+
+    def _write_with_retries(self, batch):
+        delay = self.retry_backoff
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._write(batch)
+                return True
+            except Exception as e:
+                self.errors += 1
+                if attempt == self.max_retries:
+                    self.dropped += len(batch)
+                    print(f"Notification writer dropped {len(batch)} events after {attempt + 1} attempts: {e}")
+                    return False
+                self.retries += 1
+                print(f"Notification writer failed on {len(batch)} events, retrying in {delay:.1f}s: {e}")
+                time.sleep(delay)
+                delay *= 2
+
+    def _write(self, events):
+        now = time.time()
+        created_at = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(now))
+        created_ts = int(now)
+        names = metadata_cache.beacon_names()
+        with db_conn() as conn:
+            conn.executemany(
+                """
+                INSERT INTO notifications (type, beacon_name, event_time, distance, created_at, event_ts, created_ts)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (
+                        e.get("type"),
+                        e.get("beacon_name") or names.get(e.get("beacon_id")) or e.get("beacon_id"),
+                        e.get("event_time"),
+                        e.get("distance"),
+                        created_at,
+                        _event_ts(e, created_ts),
+                        created_ts,
+                    )
+                    for e in events
+                ],
+            )
+        self.written += len(events)
+        self.batches += 1
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._pending)
+        return {
+            "pending": pending,
+            "written": self.written,
+            "batches": self.batches,
+            "errors": self.errors,
+            "retries": self.retries,
+            "dropped": self.dropped,
+            "flush_interval": self.flush_interval,
+            "batch_max": self.batch_max,
+        }
+
+
+notification_writer = NotificationWriter()
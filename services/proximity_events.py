@@ -0,0 +1,290 @@
+"""Server-side IN/LEFT detection and the notification stream feed."""
+
+import queue
+import threading
+import time
+
+from config import PROXIMITY_IN_METERS, PROXIMITY_OUT_METERS
+from database import get_db
+
+
+class ProximityDetector:
+    """Classifies each beacon reading as "in" or "out" with hysteresis.
+
+    The state is stored on the beacon info itself ("proximity"), inside the
+    live_state write, so every transition is seen exactly once even when
+    several workers share one SQLite live state.
+    """
+
+    def __init__(self, in_meters=PROXIMITY_IN_METERS, out_meters=PROXIMITY_OUT_METERS,
+                 reload_interval=60.0):
+        self.in_meters = float(in_meters)
+        self.out_meters = max(float(out_meters), self.in_meters)
+        self.reload_interval = float(reload_interval)
+        self._overrides = {}  # beacon_id -> (in_meters, out_meters)
+        self._loaded_at = 0.0
+
+    def reload_thresholds(self):
+        conn = get_db()
+        rows = conn.execute("SELECT id, in_meters, out_meters FROM beacon_thresholds").fetchall()
+        conn.close()
+        self._overrides = {
+            bid: (
+                in_m if in_m is not None else self.in_meters,
+                max(out_m if out_m is not None else self.out_meters, in_m if in_m is not None else self.in_meters),
+            )
+            for bid, in_m, out_m in rows
+        }
+        self._loaded_at = time.time()
+
+    def set_threshold(self, beacon_id, in_meters, out_meters):
+        """Persist a per-beacon override (write-through to this process)."""
+        conn = get_db()
+        conn.execute(
+            "INSERT OR REPLACE INTO beacon_thresholds (id, in_meters, out_meters) VALUES (?, ?, ?)",
+            (beacon_id, in_meters, out_meters),
+        )
+        conn.commit()
+        conn.close()
+        self.reload_thresholds()
+
+    def refresh_if_due(self):
+        """Reload the overrides every reload_interval.
+
+        Called by ingest before the live_state write, never from classify(),
+        which runs inside that write and must not open another connection.
+        """
+        now = time.time()
+        if now - self._loaded_at <= self.reload_interval:
+            return
+        self._loaded_at = now  # one reload per interval, even with concurrent ingest
+        try:
+            self.reload_thresholds()
+        except Exception as e:
+            # Keep the last known overrides; retry at the next interval
+            print(f"Could not reload beacon thresholds: {e}")
+
+    def thresholds(self, beacon_id):
+        return self._overrides.get(beacon_id, (self.in_meters, self.out_meters))
+
+    def classify(self, prev, info):
+        """Set info["proximity"] from the previous reading and return an event or None.
+
+        The first reading of a beacon only seeds its state; a reading without
+        a distance keeps the previous state.
+        """
+        prev_state = prev.get("proximity") if prev else None
+        dist = info.get("distance_smoothed")
+        if dist is None:
+            dist = info.get("distance")
+        if dist is None:
+            info["proximity"] = prev_state
+            return None
+
+        in_m, out_m = self.thresholds(info.get("id"))
+        if prev_state is None:
+            info["proximity"] = "in" if dist <= in_m else "out"
+            return None
+
+        new_state = prev_state
+        if prev_state == "in" and dist > out_m:
+            new_state = "out"
+        elif prev_state == "out" and dist <= in_m:
+            new_state = "in"
+        info["proximity"] = new_state
+        if new_state == prev_state:
+            return None
+
+        return {
+            "type": "in" if new_state == "in" else "left",
+            "beacon_id": info.get("id"),
+            "device_ident": info.get("device_ident"),
+            "event_time": info.get("last_seen"),
+            "event_ts": info.get("last_seen_raw"),
+            "distance": dist,
+        }
+
+
+class Subscription:
+    """One stream's queue of notification rows (the map stream also queues its deltas here).
+
+    `overflowed` is set when the stream fell `queue_size` items behind; the
+    feed stops filling it, and the stream should end once it has drained the
+    queue so the client reconnects with Last-Event-ID and replays the rest.
+    `last_id` is the notification id the stream has caught up to.
+    """
+
+    def __init__(self, queue_size):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.overflowed = False
+        self.last_id = None
+
+    def offer(self, item):
+        """Queue `item`; False (and overflowed) if the queue is full."""
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except queue.Full:
+            self.overflowed = True
+            return False
+
+    def get(self, timeout):
+        """Next row; None once overflowed and drained. Raises queue.Empty on timeout."""
+        if self.overflowed and self.queue.empty():
+            return None
+        return self.queue.get(timeout=timeout)
+
+
+class NotificationFeed:
+    """Fans new notifications rows out to stream subscribers.
+
+    A single thread per process tails the notifications table by id while
+    anyone is subscribed, so every worker streams the same events no matter
+    which one detected or stored them, and row ids double as SSE event ids.
+    A new subscriber's backlog is read up to the live cursor under the same
+    lock the poll thread holds, so it neither misses nor repeats a row.
+    """
+
+    def __init__(self, poll_interval=1.0, backlog_limit=500, queue_size=1000):
+        self.poll_interval = float(poll_interval)
+        self.backlog_limit = int(backlog_limit)
+        self.queue_size = int(queue_size)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._last_id = None
+        self.overflows = 0
+
+    @staticmethod
+    def _row_dicts(rows):
+        return [
+            {
+                "id": r[0],
+                "type": r[1],
+                "name": r[2],
+                "time": r[3],
+                "distance": r[4],
+                "created_at": r[5],
+            }
+            for r in rows
+        ]
+
+    def _rows_after(self, conn, after_id, limit):
+        """The oldest `limit` rows with id > after_id."""
+        return self._row_dicts(conn.execute(
+            """
+            SELECT id, type, beacon_name, event_time, distance, created_at
+            FROM notifications
+            WHERE id > ?
+            ORDER BY id ASC
+            LIMIT ?
+            """,
+            (after_id, limit),
+        ).fetchall())
+
+    def _rows_between(self, conn, after_id, up_to_id, limit):
+        """The newest `limit` rows with after_id < id <= up_to_id, oldest first."""
+        return self._row_dicts(conn.execute(
+            """
+            SELECT id, type, beacon_name, event_time, distance, created_at FROM (
+                SELECT id, type, beacon_name, event_time, distance, created_at
+                FROM notifications
+                WHERE id > ? AND id <= ?
+                ORDER BY id DESC
+                LIMIT ?
+            ) ORDER BY id ASC
+            """,
+            (after_id, up_to_id, limit),
+        ).fetchall())
+
+    def subscribe(self, last_event_id=None, sub=None):
+        """Register `sub` (default: a new Subscription), pre-filled with rows after `last_event_id`.
+
+        If more than `backlog_limit` rows were missed, the backlog starts with
+        a {"resync": True, "missed": n} marker followed by the newest rows.
+        """
+        try:
+            after = int(last_event_id) if last_event_id not in (None, "") else None
+        except (TypeError, ValueError):
+            after = None
+        if sub is None:
+            sub = Subscription(self.queue_size)
+        with self._lock:
+            conn = get_db()
+            try:
+                if self._last_id is None:
+                    self._last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM notifications").fetchone()[0]
+                sub.last_id = self._last_id
+                if after is not None and after < self._last_id:
+                    # Caught up only to `after` until the backlog has been sent
+                    sub.last_id = after
+                    rows = self._rows_between(conn, after, self._last_id, self.backlog_limit)
+                    if len(rows) == self.backlog_limit:
+                        missed = conn.execute(
+                            "SELECT COUNT(*) FROM notifications WHERE id > ? AND id < ?", (after, rows[0]["id"])
+                        ).fetchone()[0]
+                        if missed:
+                            sub.offer({"resync": True, "missed": missed})
+                    for row in rows:
+                        sub.offer(row)
+            finally:
+                conn.close()
+            self._subscribers.add(sub)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._poll_loop, name="notification-feed", daemon=True
+                )
+                self._thread.start()
+        return sub
+
+    def rows_after(self, after_id, limit=None):
+        """Rows with id > after_id for clients that poll instead of streaming."""
+        conn = get_db()
+        try:
+            return self._rows_after(conn, after_id, limit or self.backlog_limit)
+        finally:
+            conn.close()
+
+    def latest_id(self):
+        conn = get_db()
+        try:
+            return conn.execute("SELECT COALESCE(MAX(id), 0) FROM notifications").fetchone()[0]
+        finally:
+            conn.close()
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def _poll_loop(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self._poll()
+            except Exception as e:
+                print(f"Notification feed poll failed: {e}")
+
+    def _poll(self):
+        with self._lock:
+            if not self._subscribers:
+                self._last_id = None
+                return
+            conn = get_db()
+            try:
+                rows = self._rows_after(conn, self._last_id, self.backlog_limit)
+            finally:
+                conn.close()
+            if not rows:
+                return
+            self._last_id = rows[-1]["id"]
+            for sub in list(self._subscribers):
+                for row in rows:
+                    if not sub.offer(row):
+                        # Slow consumer: end its stream; it resumes from Last-Event-ID
+                        self._subscribers.discard(sub)
+                        self.overflows += 1
+                        break
+
+
+proximity_detector = ProximityDetector()
+notification_feed = NotificationFeed()
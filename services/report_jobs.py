@@ -0,0 +1,245 @@
+"""Report jobs: PDF rendering in a bounded process pool, tracked in report_jobs.
+
+`submit()` records a job row and hands the render to a ProcessPoolExecutor
+of REPORT_WORKERS processes, so a long reportlab render never holds a
+gunicorn worker. The pool processes update the job row themselves (status,
+progress, result), which makes job status readable from every worker.
+
+Pool processes are started with "spawn": the web process runs threads
+(ingest, writers, SSE), and forking those is unsafe.
+"""
+
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from config import REPORT_QUEUE_MAX, REPORT_WORKERS
+from database import db_conn
+
+JOB_KINDS = ("activity", "daily")
+_PROGRESS_INTERVAL = 0.5  # seconds between progress writes from a render
+
+_COLUMNS = (
+    "id", "kind", "params", "status", "progress", "message", "result_path",
+    "error", "owner_pid", "created_at", "started_at", "finished_at",
+)
+
+
+class QueueFull(Exception):
+    """More than REPORT_QUEUE_MAX jobs of this process are queued or running."""
+
+
+def _now():
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime())
+
+
+def _update(job_id, **fields):
+    assignments = ", ".join(f"{k} = ?" for k in fields)
+    with db_conn() as conn:
+        conn.execute(f"UPDATE report_jobs SET {assignments} WHERE id = ?", list(fields.values()) + [job_id])
+
+
+class _ProgressWriter:
+    """Progress callback for the generators; writes at most every _PROGRESS_INTERVAL."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self._last = 0.0
+
+    def __call__(self, fraction):
+        now = time.monotonic()
+        if now - self._last >= _PROGRESS_INTERVAL:
+            self._last = now
+            _update(self.job_id, progress=round(min(max(fraction, 0.0), 1.0), 3))
+
+
+def run_job(job_id, kind, params, payload=None):
+    """Render one job; runs inside a pool process and returns the PDF path (or None)."""
+    from services import reporting_service
+
+    _update(job_id, status="running", started_at=_now(), owner_pid=os.getpid())
+    progress = _ProgressWriter(job_id)
+    try:
+        if kind == "activity":
+            path = reporting_service.generate_activity_report(
+                params["beacon_name"], params.get("from"), params.get("to"),
+                progress=progress, max_events=params.get("max_events"),
+            )
+        else:
+            path = reporting_service.render_daily_report(payload, params["now_ts"], progress=progress)
+    except Exception as e:
+        _update(job_id, status="failed", error=str(e), finished_at=_now())
+        raise
+    _update(
+        job_id,
+        status="done",
+        progress=1.0,
+        result_path=path,
+        message=None if path else "No data for this report",
+        finished_at=_now(),
+    )
+    return path
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _row_to_job(row):
+    job = dict(zip(_COLUMNS, row))
+    job["params"] = json.loads(job["params"] or "{}")
+    # A job whose process died (restart, crash) would otherwise stay "running"
+    if job["status"] in ("queued", "running") and job["owner_pid"] and not _pid_alive(job["owner_pid"]):
+        job["status"] = "failed"
+        job["error"] = job["error"] or "Report process exited before the job finished"
+    return job
+
+
+class ReportJobRunner:
+    """Queues report renders on a per-process pool of `workers` processes."""
+
+    def __init__(self, workers=REPORT_WORKERS, max_pending=REPORT_QUEUE_MAX):
+        self.workers = int(workers)
+        self.max_pending = int(max_pending)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+        self._pending = 0
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def _executor(self, replace=False):
+        # caller holds self._lock; one pool per process (gunicorn workers fork after import)
+        if replace or self._pool is None or self._pool_pid != os.getpid():
+            if replace and self._pool is not None:
+                self._pool.shutdown(wait=False)
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            self._pool_pid = os.getpid()
+        return self._pool
+
+    def submit(self, kind, params, payload=None, on_done=None):
+        """Queue a render; returns the job id. Raises QueueFull when at capacity.
+
+        `params` is stored with the job; `payload` only goes to the pool
+        process. `on_done(path)` runs in this process when the job succeeds.
+        """
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown report kind: {kind}")
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise QueueFull(f"{self._pending} report jobs already queued")
+            with db_conn() as conn:
+                conn.execute(
+                    """
+                    INSERT INTO report_jobs (id, kind, params, status, progress, owner_pid, created_at)
+                    VALUES (?, ?, ?, 'queued', 0, ?, ?)
+                    """,
+                    (job_id, kind, json.dumps(params), os.getpid(), _now()),
+                )
+            try:
+                future = self._executor().submit(run_job, job_id, kind, params, payload)
+            except BrokenProcessPool:
+                # A pool process died (e.g. killed for memory); start a fresh pool
+                future = self._executor(replace=True).submit(run_job, job_id, kind, params, payload)
+            self._pending += 1
+            self.submitted += 1
+        future.add_done_callback(lambda f: self._finished(job_id, f, on_done))
+        return job_id
+
+    def _finished(self, job_id, future, on_done):
+        with self._lock:
+            self._pending -= 1
+        error = future.exception()
+        if error is not None:
+            self.failed += 1
+            print(f"Report job {job_id} failed: {error}")
+            try:
+                # The pool process may have died before it could record the failure
+                with db_conn() as conn:
+                    conn.execute(
+                        "UPDATE report_jobs SET status = 'failed', error = COALESCE(error, ?), finished_at = ? "
+                        "WHERE id = ? AND status != 'failed'",
+                        (str(error), _now(), job_id),
+                    )
+            except Exception as e:
+                print(f"Could not record failure of report job {job_id}: {e}")
+            return
+        self.completed += 1
+        if on_done is not None:
+            try:
+                on_done(future.result())
+            except Exception as e:
+                print(f"Report job {job_id} completion hook failed: {e}")
+
+    def get(self, job_id):
+        with db_conn() as conn:
+            row = conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM report_jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return _row_to_job(row) if row else None
+
+    def recent(self, limit=20, kind=None):
+        sql = f"SELECT {', '.join(_COLUMNS)} FROM report_jobs"
+        params = []
+        if kind:
+            sql += " WHERE kind = ?"
+            params.append(kind)
+        sql += " ORDER BY created_at DESC, rowid DESC LIMIT ?"
+        params.append(int(limit))
+        with db_conn() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [_row_to_job(r) for r in rows]
+
+    def stats(self):
+        with self._lock:
+            pending = self._pending
+        return {
+            "pending": pending,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+        }
+
+
+report_jobs = ReportJobRunner()
+
+
+def submit_activity_report(beacon_name, start=None, end=None, max_events=None):
+    return report_jobs.submit(
+        "activity", {"beacon_name": beacon_name, "from": start, "to": end, "max_events": max_events}
+    )
+
+
+def submit_daily_report():
+    """Build the daily report here (it reads this process's live state) and render it in the pool."""
+    from services.reporting_service import build_daily_report, publish_daily_report
+
+    now_ts = time.time()
+    report = build_daily_report()
+    return report_jobs.submit(
+        "daily",
+        {"now_ts": now_ts, "beacons": len(report)},
+        payload=report,
+        on_done=lambda _path: publish_daily_report(report, now_ts),
+    )
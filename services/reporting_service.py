@@ -1,10 +1,20 @@
+import io
 import os
 import time
-import threading
 import json
 
+try:
+    from pypdf import PdfWriter
+except ImportError:  # pypdf is optional; activity reports then render in one pass without segment reuse
+    PdfWriter = None
+
 from database import get_db
-from services.beacon_logic import latest_messages
+from config import ACTIVITY_MAX_EVENTS, ACTIVITY_SEGMENT_PAGES, SAMOA_OFFSET_HOURS, TTL_SECONDS
+from services import activity_cache
+from services.beacon_logic import format_samoa_time, set_latest_message
+from services.metadata_cache import metadata_cache
+from services.sighting_index import sighting_index
+from services.time_range import range_clause
 
 
 # ---- Helpers for report storage dirs ----
@@ -25,15 +35,16 @@ def ensure_activity_reports_dir():
 
 # ---- PDF generation helpers ----
 
-def generate_report_pdf(report_entries, created_at_iso, pdf_path):
+def generate_report_pdf(report_entries, created_at_iso, pdf_path, progress=None):
     """
     Create a styled PDF daily report.
     report_entries: list of dicts with keys id, name, status, last_seen, last_device, distance (optional)
+    progress: optional callable taking the fraction done, called once per page
     """
     from reportlab.pdfgen import canvas as _canvas
     from reportlab.lib.pagesizes import A4 as _A4
 
-    c = _canvas.Canvas(pdf_path, pagesize=_A4)
+    c = _canvas.Canvas(pdf_path, pagesize=_A4, pageCompression=1)
     width, height = _A4
 
     margin = 50
@@ -68,8 +79,10 @@ def generate_report_pdf(report_entries, created_at_iso, pdf_path):
 
     # Rows
     c.setFont("Helvetica", 9)
-    for entry in report_entries:
+    for i, entry in enumerate(report_entries):
         if y < 60:
+            if progress:
+                progress(i / total)
             c.showPage()
             y = height - margin
             c.setFont("Helvetica-Bold", 10)
@@ -96,17 +109,6 @@ def generate_report_pdf(report_entries, created_at_iso, pdf_path):
 
 def save_daily_report_to_db(report_entries, pdf_path, created_at_iso, summary_text):
     conn = get_db()
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS daily_reports (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            created_at TEXT,
-            pdf_path TEXT,
-            report_json TEXT,
-            summary TEXT
-        )
-        """
-    )
     conn.execute(
         "INSERT INTO daily_reports (created_at, pdf_path, report_json, summary) VALUES (?, ?, ?, ?)",
         (created_at_iso, pdf_path, json.dumps(report_entries), summary_text),
@@ -118,17 +120,6 @@ def save_daily_report_to_db(report_entries, pdf_path, created_at_iso, summary_te
 def get_last_daily_report_time():
     from datetime import datetime as _dt
     conn = get_db()
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS daily_reports (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            created_at TEXT,
-            pdf_path TEXT,
-            report_json TEXT,
-            summary TEXT
-        )
-        """
-    )
     row = conn.execute(
         "SELECT created_at FROM daily_reports ORDER BY id DESC LIMIT 1"
     ).fetchone()
@@ -141,207 +132,331 @@ def get_last_daily_report_time():
         return None
 
 
-# ---- Daily report generation (used by 22:00 loop) ----
+# ---- Daily report generation (scheduled by services/scheduler.py) ----
 
-def generate_daily_report():
+def build_daily_report():
     """
-    Build daily report using all beacons in DB, store it in memory,
-    save to SQLite, and generate a styled PDF file.
+    Status of every named beacon: list of dicts with keys id, name, status,
+    last_seen, last_device, distance.
     """
-    conn = get_db()
-    conn.execute("CREATE TABLE IF NOT EXISTS beacon_names (id TEXT PRIMARY KEY, name TEXT)")
-    rows = conn.execute("SELECT id, name FROM beacon_names").fetchall()
-    conn.close()
-    beacon_list = [(r[0], r[1]) for r in rows]
+    beacon_list = list(metadata_cache.beacon_names().items())
 
+    # One lookup per beacon in the last-sighting index, which also remembers
+    # beacons that have expired from the live payloads
+    sightings = sighting_index.snapshot()
+    online_after = time.time() - TTL_SECONDS
     report = []
     for bid, bname in beacon_list:
-        # find last info in latest_messages
-        last_seen = None
-        distance = None
-        device = None
-        status = "Offline"
-
-        for ident, dev in latest_messages.items():
-            if ident == "DAILY_REPORT":
-                continue
-            if not isinstance(dev, dict):
-                continue
-            beacons = dev.get("beacons") or []
-            for b in beacons:
-                if b.get("id") == bid:
-                    last_seen = b.get("last_seen")
-                    distance = b.get("distance")
-                    device = ident
-
-        if last_seen:
-            status = "Online"
-
+        seen = sightings.get(bid)
         report.append(
             {
                 "id": bid,
                 "name": bname,
-                "status": status,
-                "last_seen": last_seen,
-                "last_device": device,
-                "distance": distance,
+                "status": "Online" if seen and seen["last_seen_raw"] >= online_after else "Offline",
+                "last_seen": seen["last_seen"] if seen else None,
+                "last_device": seen["device"] if seen else None,
+                "distance": seen["distance"] if seen else None,
             }
         )
 
-    now_ts = time.time()
+    return report
+
+
+def render_daily_report(report, now_ts, progress=None):
+    """
+    Render the daily report PDF and save it to daily_reports; returns the PDF path.
+    Runs in the report job pool (see services/report_jobs.py).
+    """
     created_at_iso = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(now_ts))
 
     reports_dir = ensure_reports_dir()
     filename = f"report_{time.strftime('%Y-%m-%d_%H-%M-%S', time.localtime(now_ts))}.pdf"
     pdf_path = os.path.join(reports_dir, filename)
 
-    summary_text = generate_report_pdf(report, created_at_iso, pdf_path)
+    summary_text = generate_report_pdf(report, created_at_iso, pdf_path, progress)
     save_daily_report_to_db(report, pdf_path, created_at_iso, summary_text)
+    return pdf_path
+
 
-    latest_messages["DAILY_REPORT"] = {
+def publish_daily_report(report, now_ts):
+    """Expose the latest daily report in the live state (DAILY_REPORT pseudo-device)."""
+    set_latest_message("DAILY_REPORT", {
         "timestamp_raw": now_ts,
         "timestamp": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now_ts)),
         "lat": None,
         "lon": None,
         "beacons": [],
         "report": report,
-    }
+    })
 
 
-# ---- Activity report generation (per beacon, detailed) ----
-
-def generate_activity_report(beacon_name):
+def generate_daily_report():
     """
-    Generate a detailed activity PDF for a single beacon using notifications history.
-    Returns the PDF path or None if there is no data.
+    Build daily report using all beacons in DB, store it in memory,
+    save to SQLite, and generate a styled PDF file (synchronously).
     """
-    from reportlab.pdfgen import canvas as _canvas
-    from reportlab.lib.pagesizes import A4 as _A4
+    now_ts = time.time()
+    report = build_daily_report()
+    pdf_path = render_daily_report(report, now_ts)
+    publish_daily_report(report, now_ts)
+    return pdf_path
 
-    conn = get_db()
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS activity_reports (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            beacon_name TEXT,
-            pdf_path TEXT,
-            created_at TEXT,
-            summary TEXT
-        )
-        """
-    )
-    conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS notifications (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            type TEXT,
-            beacon_name TEXT,
-            event_time TEXT,
-            distance REAL,
-            created_at TEXT
-        )
-        """
-    )
-    rows = conn.execute(
-        "SELECT type, event_time, distance, created_at FROM notifications WHERE beacon_name = ? ORDER BY id ASC",
-        (beacon_name,),
-    ).fetchall()
 
-    if not rows:
-        conn.close()
-        return None
+# ---- Activity report generation (per beacon, detailed) ----
 
-    now_ts = time.time()
-    created_at_iso = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(now_ts))
+ACTIVITY_HEADERS = ["Type", "Event time", "Distance (m)", "Recorded at"]
+DAY_HEADERS = ["Day", "Events", "IN", "LEFT", "Closest (m)", "Farthest (m)"]
+_ROW_HEIGHT = 12
+_PAGE_BOTTOM = 60
 
-    act_dir = ensure_activity_reports_dir()
-    safe_name = "".join(ch if ch.isalnum() or ch in ("-", "_") else "_" for ch in (beacon_name or "unknown"))
-    filename = f"activity_{safe_name}_{time.strftime('%Y-%m-%d_%H-%M-%S', time.localtime(now_ts))}.pdf"
-    pdf_path = os.path.join(act_dir, filename)
 
-    c = _canvas.Canvas(pdf_path, pagesize=_A4)
-    width, height = _A4
-    margin = 50
-    y = height - margin
+def _period_text(start, end):
+    """Samoa-time description of an optional [start, end) range."""
+    if start is None and end is None:
+        return ""
+    begin = format_samoa_time(start) if start is not None else "start"
+    finish = format_samoa_time(end) if end is not None else "now"
+    return f"{begin} to {finish}"
 
-    c.setFont("Helvetica-Bold", 16)
-    c.drawString(margin, y, f"Beacon Activity Report: {beacon_name}")
-    y -= 24
-    c.setFont("Helvetica", 10)
-    c.drawString(margin, y, f"Generated at: {created_at_iso}")
-    y -= 10
-    c.line(margin, y, width - margin, y)
-    y -= 20
 
-    c.setFont("Helvetica-Bold", 11)
-    total_events = len(rows)
-    left_events = sum(1 for r in rows if r[0] == "left")
-    in_events = sum(1 for r in rows if r[0] == "in")
-    c.drawString(margin, y, f"Summary: {total_events} events ({left_events} LEFT, {in_events} IN)")
-    y -= 18
+def _rows_fitting(y):
+    """Activity table rows that fit on a page below a table header drawn at y."""
+    return int((y - 26 - _PAGE_BOTTOM) // _ROW_HEIGHT) + 1
 
+
+def _draw_table_header(c, headers, col_x, y, margin, width):
     c.setFont("Helvetica-Bold", 10)
-    headers = ["Type", "Event time", "Distance (m)", "Recorded at"]
-    col_x = [margin, margin + 80, margin + 260, margin + 360]
     for x, h in zip(col_x, headers):
         c.drawString(x, y, h)
     y -= 14
     c.line(margin, y, width - margin, y)
     y -= 12
-
     c.setFont("Helvetica", 9)
-    for typ, event_time, distance, created_at in rows:
-        if y < 60:
-            c.showPage()
-            y = height - margin
-            c.setFont("Helvetica-Bold", 10)
-            for x, h in zip(col_x, headers):
-                c.drawString(x, y, h)
-            y -= 14
-            c.line(margin, y, width - margin, y)
-            y -= 12
-            c.setFont("Helvetica", 9)
+    return y
+
 
+def _distance_text(distance):
+    return f"{distance:.2f}" if distance is not None else "-"
+
+
+def _draw_activity_table(c, rows, y, margin, width):
+    """Draw the table header at y and `rows` below it; returns the next y."""
+    col_x = [margin, margin + 80, margin + 260, margin + 360]
+    y = _draw_table_header(c, ACTIVITY_HEADERS, col_x, y, margin, width)
+    for typ, event_time, distance, created_at in rows:
         c.drawString(col_x[0], y, (typ or "-").upper())
         c.drawString(col_x[1], y, event_time or "-")
-        c.drawString(col_x[2], y, f"{distance:.2f}" if distance is not None else "-")
+        c.drawString(col_x[2], y, _distance_text(distance))
         c.drawString(col_x[3], y, created_at or "-")
-        y -= 12
+        y -= _ROW_HEIGHT
+    return y
 
-    c.showPage()
-    c.save()
 
-    summary = f"{total_events} events ({left_events} LEFT, {in_events} IN)"
-    conn.execute(
-        "INSERT INTO activity_reports (beacon_name, pdf_path, created_at, summary) VALUES (?, ?, ?, ?)",
-        (beacon_name, pdf_path, created_at_iso, summary),
-    )
-    conn.commit()
-    conn.close()
-    return pdf_path
+def _render_activity_segment(rows, path, rows_per_page):
+    """Render table-only pages for `rows` into a standalone PDF at `path`."""
+    from reportlab.pdfgen import canvas as _canvas
+    from reportlab.lib.pagesizes import A4 as _A4
 
+    width, height = _A4
+    margin = 50
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    c = _canvas.Canvas(tmp_path, pagesize=_A4, pageCompression=1)
+    for i in range(0, len(rows), rows_per_page):
+        _draw_activity_table(c, rows[i:i + rows_per_page], height - margin, margin, width)
+        c.showPage()
+    c.save()
+    os.replace(tmp_path, path)  # atomic: another process may render the same segment
 
-# ---- Background daily loop starter ----
 
-def daily_beacon_check_loop():
-    """
-    Background loop that runs generate_daily_report once per day at 22:00 local time.
-    """
+def _draw_day_totals(c, days, y, margin, width, height):
+    """Draw per-day totals from the `days` cursor, one page of rows at a time; returns the next y."""
+    col_x = [margin, margin + 100, margin + 170, margin + 230, margin + 300, margin + 400]
     while True:
-        try:
-            now = time.localtime()
-            if now.tm_hour == 22 and now.tm_min == 0:
-                generate_daily_report()
-                time.sleep(60)
-            time.sleep(30)
-        except Exception:
-            time.sleep(60)
-
-
-def start_daily_beacon_check_thread():
+        fitting = _rows_fitting(y)
+        page = days.fetchmany(fitting)
+        if not page:
+            return y
+        y = _draw_table_header(c, DAY_HEADERS, col_x, y, margin, width)
+        for day, events, in_count, left_count, closest, farthest in page:
+            c.drawString(col_x[0], y, day or "-")
+            c.drawString(col_x[1], y, str(events))
+            c.drawString(col_x[2], y, str(in_count))
+            c.drawString(col_x[3], y, str(left_count))
+            c.drawString(col_x[4], y, _distance_text(closest))
+            c.drawString(col_x[5], y, _distance_text(farthest))
+            y -= _ROW_HEIGHT
+        if len(page) < fitting:
+            return y - 8
+        c.showPage()
+        y = height - margin
+
+
+def generate_activity_report(beacon_name, start=None, end=None, progress=None, max_events=None):
     """
-    Helper to start the daily check thread from app.py.
+    Generate a detailed activity PDF for a single beacon using notifications history.
+    `start`/`end` (epoch seconds) limit it to events with start <= event_ts < end.
+    `progress`, if given, is called with the fraction of rows drawn once per page.
+    With more than `max_events` events (default ACTIVITY_MAX_EVENTS, 0 = no cap)
+    the report shows per-day totals and only the most recent `max_events` events.
+    Rows are read from the cursor a page or segment at a time.
+    Returns the PDF path or None if there is no data; when nothing changed since
+    an earlier report with the same range, that report's PDF is returned.
     """
-    t = threading.Thread(target=daily_beacon_check_loop, daemon=True)
-    t.start()
-    return t
+    from reportlab.pdfgen import canvas as _canvas
+    from reportlab.lib.pagesizes import A4 as _A4
+
+    in_range, range_params = range_clause("event_ts", start, end)
+    conn = get_db()
+    try:
+        summary = activity_cache.report_summary(conn, beacon_name, in_range, range_params)
+        total_events = summary["total"]
+        if not total_events:
+            return None
+        if max_events is None:
+            max_events = ACTIVITY_MAX_EVENTS
+        summarized = bool(max_events) and total_events > max_events
+        if not summarized:
+            max_events = 0
+        key = activity_cache.cache_key(beacon_name, start, end, summary, max_events)
+        cached = activity_cache.cached_report(conn, key)
+        if cached:
+            return cached
+
+        where = f"beacon_name = ? {'AND ' + in_range if in_range else ''}"
+        params = [beacon_name] + range_params
+        if summarized:
+            rows = conn.execute(
+                f"""
+                SELECT type, event_time, distance, created_at FROM (
+                    SELECT type, event_time, distance, created_at, event_ts, id FROM notifications
+                    WHERE {where}
+                    ORDER BY event_ts DESC, id DESC LIMIT ?
+                ) ORDER BY event_ts ASC, id ASC
+                """,
+                params + [max_events],
+            )
+        else:
+            rows = conn.execute(
+                f"""
+                SELECT type, event_time, distance, created_at FROM notifications
+                WHERE {where}
+                ORDER BY event_ts ASC, id ASC
+                """,
+                params,
+            )
+        drawn_total = max_events or total_events
+
+        now_ts = time.time()
+        created_at_iso = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(now_ts))
+
+        act_dir = ensure_activity_reports_dir()
+        safe_name = "".join(ch if ch.isalnum() or ch in ("-", "_") else "_" for ch in (beacon_name or "unknown"))
+        filename = f"activity_{safe_name}_{time.strftime('%Y-%m-%d_%H-%M-%S', time.localtime(now_ts))}.pdf"
+        pdf_path = os.path.join(act_dir, filename)
+        # With pypdf the first page is rendered alone and merged with cached segments
+        head_path = pdf_path if PdfWriter is None else f"{pdf_path}.head"
+
+        c = _canvas.Canvas(head_path, pagesize=_A4, pageCompression=1)
+        width, height = _A4
+        margin = 50
+        y = height - margin
+
+        c.setFont("Helvetica-Bold", 16)
+        c.drawString(margin, y, f"Beacon Activity Report: {beacon_name}")
+        y -= 24
+        c.setFont("Helvetica", 10)
+        c.drawString(margin, y, f"Generated at: {created_at_iso}")
+        period = _period_text(start, end)
+        if period:
+            y -= 14
+            c.drawString(margin, y, f"Period: {period}")
+        y -= 10
+        c.line(margin, y, width - margin, y)
+        y -= 20
+
+        c.setFont("Helvetica-Bold", 11)
+        left_events = summary["left_count"]
+        in_events = summary["in_count"]
+        c.drawString(margin, y, f"Summary: {total_events} events ({left_events} LEFT, {in_events} IN)")
+        y -= 18
+
+        if summarized:
+            # Samoa calendar days, read through the (beacon_name, event_ts) covering index
+            days = conn.execute(
+                f"""
+                SELECT date(event_ts + ?, 'unixepoch') AS day, COUNT(*),
+                       SUM(type = 'in'), SUM(type = 'left'), MIN(distance), MAX(distance)
+                FROM notifications WHERE {where}
+                GROUP BY day ORDER BY day
+                """,
+                [SAMOA_OFFSET_HOURS * 3600] + params,
+            )
+            c.setFont("Helvetica-Bold", 11)
+            c.drawString(margin, y, "Daily totals")
+            y = _draw_day_totals(c, days, y - 18, margin, width, height)
+            if _rows_fitting(y - 18) < 1:
+                c.showPage()
+                y = height - margin
+            c.setFont("Helvetica-Bold", 11)
+            c.drawString(margin, y, f"Most recent {max_events} of {total_events} events")
+            y -= 18
+
+        done = 0
+        first_page = rows.fetchmany(_rows_fitting(y))
+        _draw_activity_table(c, first_page, y, margin, width)
+        c.showPage()
+        done += len(first_page)
+        rows_per_page = _rows_fitting(height - margin)
+
+        if PdfWriter is None:
+            # Single canvas, one page of rows in memory at a time
+            while True:
+                if progress:
+                    progress(done / drawn_total)
+                page = rows.fetchmany(rows_per_page)
+                if not page:
+                    break
+                _draw_activity_table(c, page, height - margin, margin, width)
+                c.showPage()
+                done += len(page)
+            c.save()
+        else:
+            c.save()
+            writer = PdfWriter()
+            writer.append(head_path)
+            digests = []
+            while True:
+                if progress:
+                    progress(done / drawn_total)
+                segment = rows.fetchmany(rows_per_page * ACTIVITY_SEGMENT_PAGES)
+                if not segment:
+                    break
+                digest = activity_cache.segment_digest(segment)
+                path = activity_cache.segment_path(digest)
+                if not os.path.exists(path):
+                    _render_activity_segment(segment, path, rows_per_page)
+                with open(path, "rb") as f:
+                    writer.append(io.BytesIO(f.read()))
+                digests.append(digest)
+                done += len(segment)
+            with open(pdf_path, "wb") as f:
+                writer.write(f)
+            os.remove(head_path)
+            activity_cache.touch_segments(conn, digests)
+
+        summary_text = f"{total_events} events ({left_events} LEFT, {in_events} IN)"
+        if summarized:
+            summary_text += f", daily totals and last {max_events}"
+        if period:
+            summary_text += f", {period}"
+        conn.execute(
+            """
+            INSERT INTO activity_reports (beacon_name, pdf_path, created_at, summary, cache_key, last_notification_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (beacon_name, pdf_path, created_at_iso, summary_text, key, summary["last_id"]),
+        )
+        conn.commit()
+        return pdf_path
+    finally:
+        conn.close()
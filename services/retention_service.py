@@ -0,0 +1,359 @@
+"""Rollups and retention for uptime_logs and notifications.
+
+Raw rows are summarised into hourly buckets (and hourly into daily) in
+uptime_rollups / notification_rollups, then raw rows older than the
+retention age are deleted in small batches and the freed pages handed back
+with incremental vacuum. Only hours that closed at least
+ROLLUP_GRACE_SECONDS ago are rolled up, and only rows already rolled up
+are ever purged.
+
+It runs as a scheduler job (services/scheduler.py), so only the worker
+holding the lease runs it. Each step re-reads its watermark in its own
+write transaction, and the pass stops as soon as `keep_going()` reports
+the lease lost, so a worker taking over never races a stale pass.
+"""
+
+import time
+from datetime import datetime, timedelta
+
+from config import (
+    NOTIFICATION_RETENTION_DAYS,
+    RETENTION_BATCH_SIZE,
+    RETENTION_VACUUM_PAGES,
+    ROLLUP_GRACE_SECONDS,
+    TIMESERIES_RETENTION_DAYS,
+    UPTIME_RETENTION_DAYS,
+)
+from database import connect, db_conn, get_db
+from services.activity_cache import forget_notifications
+
+HOUR_FORMAT = "%Y-%m-%d %H"
+# Raw rows are rolled up at most this many hours per transaction
+MAX_HOURS_PER_STEP = 24 * 7
+
+last_run_stats = {}
+
+
+def _hour_bucket(ts):
+    return time.strftime(HOUR_FORMAT, time.localtime(ts))
+
+
+def _add_hours(bucket, hours):
+    return (datetime.strptime(bucket, HOUR_FORMAT) + timedelta(hours=hours)).strftime(HOUR_FORMAT)
+
+
+def _next_day(day):
+    return (datetime.strptime(day, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+
+
+def _fold(fn, current, value):
+    """min/max that ignores NULLs."""
+    if value is None:
+        return current
+    return value if current is None else fn(current, value)
+
+
+def _get_state(conn, key):
+    row = conn.execute("SELECT value FROM retention_state WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def _set_state(conn, key, value):
+    conn.execute(
+        "INSERT OR REPLACE INTO retention_state (key, value) VALUES (?, ?)", (key, value)
+    )
+
+
+class _UptimeRollup:
+    name = "uptime_logs"
+    watermark_key = "uptime_rolled_until"
+    time_column = "timestamp"
+    retention_days = UPTIME_RETENTION_DAYS
+
+    @staticmethod
+    def raw_time(bucket):
+        return bucket  # 'YYYY-MM-DD HH:MM:SS'
+
+    def before_purge(self, conn, where, params):
+        pass
+
+    def roll(self, conn, lo, hi):
+        rows = conn.execute(
+            """
+            SELECT substr(timestamp, 1, 13) AS bucket, status, COUNT(*),
+                   SUM(device_count), MIN(device_count), MAX(device_count),
+                   SUM(beacon_count), MIN(beacon_count), MAX(beacon_count)
+            FROM uptime_logs
+            WHERE timestamp >= ? AND timestamp < ?
+            GROUP BY bucket, status
+            """,
+            (lo, hi),
+        ).fetchall()
+
+        status_columns = {"OK": 9, "NO_DATA": 10, "NO_DEVICES": 11, "NO_BEACONS": 12}
+        buckets = {}
+        for bucket, status, n, d_sum, d_min, d_max, b_sum, b_min, b_max in rows:
+            agg = buckets.get(bucket)
+            if agg is None:
+                agg = buckets[bucket] = ["hour", bucket, 0, 0, d_min, d_max, 0, b_min, b_max, 0, 0, 0, 0, 0]
+            agg[2] += n
+            agg[3] += d_sum or 0
+            agg[4] = _fold(min, agg[4], d_min)
+            agg[5] = _fold(max, agg[5], d_max)
+            agg[6] += b_sum or 0
+            agg[7] = _fold(min, agg[7], b_min)
+            agg[8] = _fold(max, agg[8], b_max)
+            agg[status_columns.get(status, 13)] += n
+
+        conn.execute(
+            "DELETE FROM uptime_rollups WHERE period = 'hour' AND bucket >= ? AND bucket < ?", (lo, hi)
+        )
+        conn.executemany(
+            "INSERT INTO uptime_rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            list(buckets.values()),
+        )
+
+        # Days touched by this range, recomputed from their hours
+        day_lo, day_hi = lo[:10], _next_day(hi[:10])
+        conn.execute(
+            "DELETE FROM uptime_rollups WHERE period = 'day' AND bucket >= ? AND bucket < ?",
+            (day_lo, day_hi),
+        )
+        conn.execute(
+            """
+            INSERT INTO uptime_rollups
+            SELECT 'day', substr(bucket, 1, 10), SUM(samples),
+                   SUM(device_sum), MIN(device_min), MAX(device_max),
+                   SUM(beacon_sum), MIN(beacon_min), MAX(beacon_max),
+                   SUM(status_ok), SUM(status_no_data), SUM(status_no_devices),
+                   SUM(status_no_beacons), SUM(status_other)
+            FROM uptime_rollups
+            WHERE period = 'hour' AND bucket >= ? AND bucket < ?
+            GROUP BY substr(bucket, 1, 10)
+            """,
+            (day_lo, day_hi),
+        )
+
+
+class _NotificationRollup:
+    name = "notifications"
+    watermark_key = "notifications_rolled_until"
+    time_column = "created_at"
+    retention_days = NOTIFICATION_RETENTION_DAYS
+
+    @staticmethod
+    def raw_time(bucket):
+        return bucket.replace(" ", "T")  # created_at is 'YYYY-MM-DDTHH:MM:SS'
+
+    def before_purge(self, conn, where, params):
+        forget_notifications(conn, where, params)
+
+    def roll(self, conn, lo, hi):
+        conn.execute(
+            "DELETE FROM notification_rollups WHERE period = 'hour' AND bucket >= ? AND bucket < ?",
+            (lo, hi),
+        )
+        conn.execute(
+            """
+            INSERT INTO notification_rollups
+            SELECT 'hour', replace(substr(created_at, 1, 13), 'T', ' '), COALESCE(beacon_name, ''),
+                   SUM(lower(type) = 'in'), SUM(lower(type) = 'left'),
+                   SUM(lower(COALESCE(type, '')) NOT IN ('in', 'left')),
+                   MIN(distance), MAX(distance)
+            FROM notifications
+            WHERE created_at >= ? AND created_at < ?
+            GROUP BY 2, 3
+            """,
+            (self.raw_time(lo), self.raw_time(hi)),
+        )
+
+        day_lo, day_hi = lo[:10], _next_day(hi[:10])
+        conn.execute(
+            "DELETE FROM notification_rollups WHERE period = 'day' AND bucket >= ? AND bucket < ?",
+            (day_lo, day_hi),
+        )
+        conn.execute(
+            """
+            INSERT INTO notification_rollups
+            SELECT 'day', substr(bucket, 1, 10), beacon_name,
+                   SUM(in_count), SUM(left_count), SUM(other_count),
+                   MIN(min_distance), MAX(max_distance)
+            FROM notification_rollups
+            WHERE period = 'hour' AND bucket >= ? AND bucket < ?
+            GROUP BY substr(bucket, 1, 10), beacon_name
+            """,
+            (day_lo, day_hi),
+        )
+
+
+ROLLUPS = [_UptimeRollup(), _NotificationRollup()]
+
+
+def _always():
+    return True
+
+
+def _roll_up(spec, now, keep_going=_always):
+    """Roll hours closed for at least the grace period since the watermark; returns hours rolled."""
+    # Hours before this bucket ended ROLLUP_GRACE_SECONDS or more ago; rows
+    # stamped in them may still be committing until then
+    closed = _hour_bucket(now - ROLLUP_GRACE_SECONDS)
+    hours = 0
+    while keep_going():
+        with db_conn() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            lo = _get_state(conn, spec.watermark_key)
+            if lo is None:
+                row = conn.execute(f"SELECT MIN({spec.time_column}) FROM {spec.name}").fetchone()
+                if not row[0]:
+                    return hours
+                lo = row[0][:13].replace("T", " ")
+            if lo >= closed:
+                return hours
+            hi = min(closed, _add_hours(lo, MAX_HOURS_PER_STEP))
+            spec.roll(conn, lo, hi)
+            _set_state(conn, spec.watermark_key, hi)
+        hours += int((datetime.strptime(hi, HOUR_FORMAT) - datetime.strptime(lo, HOUR_FORMAT)).total_seconds() // 3600)
+    return hours
+
+
+def _purge(spec, now, batch_size, keep_going=_always):
+    """Delete raw rows past retention that are already rolled up."""
+    cutoff = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now - spec.retention_days * 86400))
+    deleted = 0
+    while keep_going():
+        with db_conn() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            watermark = _get_state(conn, spec.watermark_key)
+            if watermark is None:
+                return deleted
+            batch_cutoff = spec.raw_time(min(cutoff, watermark))
+            # The batch is the oldest ids past the cutoff, i.e. those up to its last id
+            last_id = conn.execute(
+                f"""
+                SELECT MAX(id) FROM (
+                    SELECT id FROM {spec.name} WHERE {spec.time_column} < ? ORDER BY id LIMIT ?
+                )
+                """,
+                (batch_cutoff, batch_size),
+            ).fetchone()[0]
+            if last_id is None:
+                return deleted
+            where = f"{spec.time_column} < ? AND id <= ?"
+            spec.before_purge(conn, where, (batch_cutoff, last_id))
+            n = conn.execute(f"DELETE FROM {spec.name} WHERE {where}", (batch_cutoff, last_id)).rowcount
+        deleted += n
+        if n < batch_size:
+            return deleted
+        time.sleep(0.05)  # let webhook writes in between batches
+    return deleted
+
+
+def _purge_series(now, batch_size, keep_going=_always):
+    """Delete beacon history chunks that ended before TIMESERIES_RETENTION_DAYS."""
+    cutoff_ms = int((now - TIMESERIES_RETENTION_DAYS * 86400) * 1000)
+    deleted = 0
+    while keep_going():
+        with db_conn() as conn:
+            n = conn.execute(
+                """
+                DELETE FROM beacon_series_chunks WHERE id IN (
+                    SELECT id FROM beacon_series_chunks WHERE end_ms < ? LIMIT ?
+                )
+                """,
+                (cutoff_ms, batch_size),
+            ).rowcount
+        deleted += n
+        if n < batch_size:
+            return deleted
+        time.sleep(0.05)
+    return deleted
+
+
+def _incremental_vacuum(pages):
+    """Hand up to `pages` free pages back to the OS; None if the database is not in incremental mode."""
+    conn = get_db()
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return None  # see full_vacuum()
+        free_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+        free_after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return free_before - free_after
+    finally:
+        conn.close()
+
+
+def full_vacuum():
+    """Switch the database to incremental auto_vacuum and rebuild it.
+
+    New databases start in incremental mode; older ones need this once. VACUUM
+    rewrites the whole file and blocks every writer while it runs, so it is an
+    operator command (`python -m services.retention_service vacuum`), best run
+    with the app stopped, never part of the retention pass.
+    """
+    conn = connect(isolation_level=None)
+    try:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        started = time.perf_counter()
+        conn.execute("VACUUM")
+        return {
+            "auto_vacuum": conn.execute("PRAGMA auto_vacuum").fetchone()[0],
+            "pages": conn.execute("PRAGMA page_count").fetchone()[0],
+            "duration_ms": round((time.perf_counter() - started) * 1000.0, 1),
+        }
+    finally:
+        conn.close()
+
+
+def run_retention(now=None, batch_size=RETENTION_BATCH_SIZE, vacuum_pages=RETENTION_VACUUM_PAGES, keep_going=_always):
+    """One rollup + purge + vacuum pass; returns its stats.
+
+    `keep_going()` is checked before every step; once it returns False the
+    pass stops where it is (the next one carries on from the watermarks).
+    """
+    global last_run_stats
+    now = time.time() if now is None else now
+    started = time.perf_counter()
+    stats = {}
+    for spec in ROLLUPS:
+        stats[spec.name] = {
+            "hours_rolled": _roll_up(spec, now, keep_going),
+            "purged": _purge(spec, now, batch_size, keep_going),
+        }
+    stats["beacon_series"] = {"purged": _purge_series(now, batch_size, keep_going)}
+    stats["vacuumed_pages"] = _incremental_vacuum(vacuum_pages) if keep_going() else 0
+    stats["completed"] = keep_going()
+    stats["duration_ms"] = round((time.perf_counter() - started) * 1000.0, 1)
+    stats["ran_at"] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now))
+    last_run_stats = stats
+    return stats
+
+
+def recent_rollups(kind, period="hour", beacon_name=None, limit=168):
+    """Newest-first rollup rows as dicts; kind is "uptime" or "notifications"."""
+    table = {"uptime": "uptime_rollups", "notifications": "notification_rollups"}[kind]
+    sql = f"SELECT * FROM {table} WHERE period = ?"
+    params = [period]
+    if kind == "notifications" and beacon_name:
+        sql += " AND beacon_name = ?"
+        params.append(beacon_name)
+    sql += " ORDER BY bucket DESC LIMIT ?"
+    params.append(int(limit))
+    with db_conn() as conn:
+        cur = conn.execute(sql, params)
+        columns = [c[0] for c in cur.description]
+        return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+
+def retention_job(keep_going=_always):
+    """Scheduler entry point: one pass, logged."""
+    print(f"Retention run: {run_retention(keep_going=keep_going)}")
+
+
+if __name__ == "__main__":
+    import sys
+
+    if sys.argv[1:] != ["vacuum"]:
+        sys.exit("usage: python -m services.retention_service vacuum")
+    print(f"Full vacuum: {full_vacuum()}")
@@ -0,0 +1,316 @@
+"""Cron-style background jobs, run by a single leader among the web workers.
+
+Every worker runs the scheduler thread, but they compete for one row in
+scheduler_leases and only its holder runs jobs. The leader renews the lease
+every SCHEDULER_LEASE_SECONDS / 3; if it dies, another worker takes over
+once the lease has expired. Between renewals the leader sleeps until the
+next due time instead of checking the clock.
+
+Each job's last run is kept in scheduled_runs, written when the job
+returns. A job whose work finishes elsewhere (the daily report renders in
+the report pool) names its own record of the last completed run instead,
+so a run that was queued but never finished still counts as missed. When
+a worker becomes leader, a job that fell due since its last run (while no
+worker was up, or the old leader died) is run once to catch up
+(SCHEDULER_CATCH_UP); several missed runs are not replayed one by one.
+
+Jobs run on the scheduler thread, one at a time. A long job (retention)
+calls `scheduler.renew()` between its steps to hold on to the lease and
+stops once it returns False.
+"""
+
+import atexit
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from config import (
+    DAILY_REPORT_SCHEDULE,
+    RETENTION_ENABLED,
+    RETENTION_SCHEDULE,
+    SCHEDULER_CATCH_UP,
+    SCHEDULER_LEASE_SECONDS,
+)
+from database import db_conn
+from services.report_jobs import submit_daily_report
+from services.reporting_service import get_last_daily_report_time
+from services.retention_service import retention_job
+
+_ALIASES = {
+    "@hourly": "0 * * * *",
+    "@daily": "0 0 * * *",
+    "@weekly": "0 0 * * 0",
+    "@monthly": "0 0 1 * *",
+}
+# (low, high) of minute, hour, day of month, month, day of week (0 and 7 = Sunday)
+_FIELD_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+def _parse_field(text, lo, hi):
+    values = set()
+    for part in text.split(","):
+        part, slash, step = part.partition("/")
+        step = int(step) if slash else 1
+        if part == "*":
+            start, end = lo, hi
+        elif "-" in part:
+            start, end = (int(v) for v in part.split("-", 1))
+        else:
+            start = int(part)
+            end = hi if slash else start
+        if step < 1 or start < lo or end > hi or start > end:
+            raise ValueError(text)
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule:
+    """A five-field cron expression ("minute hour day month weekday") in local time."""
+
+    def __init__(self, expr):
+        self.expr = expr
+        fields = _ALIASES.get(expr.strip(), expr).split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron schedule needs 5 fields: {expr!r}")
+        try:
+            minutes, hours, days, months, weekdays = (
+                _parse_field(f, lo, hi) for f, (lo, hi) in zip(fields, _FIELD_RANGES)
+            )
+        except ValueError:
+            raise ValueError(f"Invalid cron schedule: {expr!r}")
+        self.minutes = minutes
+        self.hours = hours
+        self.days = days
+        self.months = months
+        self.weekdays = {d % 7 for d in weekdays}
+        # As in cron: when both day fields are restricted, either one may match
+        self._either_day = not fields[2].startswith("*") and not fields[4].startswith("*")
+        self.next_after(time.time())  # rejects schedules that never fire, e.g. "0 0 31 2 *"
+
+    def _day_matches(self, dt):
+        in_month = dt.day in self.days
+        in_week = (dt.weekday() + 1) % 7 in self.weekdays
+        return (in_month or in_week) if self._either_day else (in_month and in_week)
+
+    def next_after(self, ts):
+        """Epoch seconds of the first matching minute after `ts`."""
+        dt = datetime.fromtimestamp(ts).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = dt + timedelta(days=366 * 5)
+        # Skips whole months, days and hours that cannot match
+        while dt < limit:
+            if dt.month not in self.months:
+                dt = (dt.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+            elif dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + timedelta(hours=1)
+            elif dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+            else:
+                when = time.mktime(dt.timetuple())
+                if when > ts:  # a repeated hour when the clocks go back
+                    return when
+                dt += timedelta(minutes=1)
+        raise ValueError(f"Cron schedule never fires: {self.expr!r}")
+
+
+class _Job:
+    def __init__(self, name, schedule, fn, last_run=None):
+        self.name = name
+        self.schedule = CronSchedule(schedule)
+        self.fn = fn
+        # Epoch of the last completed run, e.g. the newest report's time;
+        # when set, scheduled_runs is not used for this job
+        self.last_run = last_run
+        self.next_run = None
+
+
+class Scheduler:
+    """Runs registered jobs on their schedules in whichever worker holds the lease."""
+
+    def __init__(self, name="scheduler", lease_seconds=SCHEDULER_LEASE_SECONDS, catch_up=SCHEDULER_CATCH_UP):
+        self.name = name
+        self.lease_seconds = float(lease_seconds)
+        self.catch_up = catch_up
+        self.owner = None
+        self.is_leader = False
+        self._renewed_at = 0.0
+        self._jobs = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.runs = 0
+        self.failures = 0
+        self.caught_up = 0
+
+    def add(self, name, schedule, fn, last_run=None):
+        """Register `fn` to run on a cron `schedule`; raises ValueError for a bad schedule.
+
+        `last_run()`, if given, returns the epoch of the job's last completed
+        run (or None); use it when `fn` only queues work that finishes later.
+        """
+        self._jobs[name] = _Job(name, schedule, fn, last_run)
+
+    # ---- lease ----
+
+    def _acquire(self, now):
+        """Take or renew the lease; True if this process holds it."""
+        try:
+            with db_conn() as conn:
+                conn.execute(
+                    """
+                    INSERT INTO scheduler_leases (name, owner, expires_at) VALUES (?, ?, ?)
+                    ON CONFLICT (name) DO UPDATE SET
+                        owner = excluded.owner,
+                        expires_at = excluded.expires_at
+                    WHERE scheduler_leases.owner = excluded.owner OR scheduler_leases.expires_at < ?
+                    """,
+                    (self.name, self.owner, now + self.lease_seconds, now),
+                )
+                row = conn.execute("SELECT owner FROM scheduler_leases WHERE name = ?", (self.name,)).fetchone()
+        except Exception as e:
+            print(f"Scheduler lease check failed: {e}")
+            return False
+        return bool(row) and row[0] == self.owner
+
+    def renew(self):
+        """Renew the lease from inside a running job; False once this process no longer holds it."""
+        now = time.time()
+        if self.is_leader and now - self._renewed_at >= self.lease_seconds / 3.0:
+            self.is_leader = self._acquire(now)
+            self._renewed_at = now
+            if not self.is_leader:
+                print(f"Scheduler: {self.owner} lost the lease during a job")
+        return self.is_leader
+
+    def release(self):
+        """Give up the lease so another worker can take over without waiting for it to expire."""
+        if not self.is_leader:
+            return
+        self.is_leader = False
+        try:
+            with db_conn() as conn:
+                conn.execute(
+                    "DELETE FROM scheduler_leases WHERE name = ? AND owner = ?", (self.name, self.owner)
+                )
+        except Exception as e:
+            print(f"Could not release scheduler lease: {e}")
+
+    # ---- runs ----
+
+    def _last_run(self, job):
+        if job.last_run is not None:
+            return job.last_run()
+        with db_conn() as conn:
+            row = conn.execute("SELECT last_run FROM scheduled_runs WHERE job = ?", (job.name,)).fetchone()
+        return row[0] if row else None
+
+    def _run(self, job):
+        started = time.time()
+        try:
+            job.fn()
+        except Exception as e:
+            self.failures += 1
+            print(f"Scheduled job {job.name} failed: {e}")
+            return
+        self.runs += 1
+        if job.last_run is not None:
+            return  # recorded by the job itself once its work is done
+        with db_conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO scheduled_runs (job, last_run) VALUES (?, ?)", (job.name, started)
+            )
+
+    def _take_over(self, now):
+        """Plan every job's next run on becoming leader, catching up runs missed since the last one."""
+        for job in self._jobs.values():
+            last = self._last_run(job)
+            if self.catch_up and last is not None and job.schedule.next_after(last) <= now:
+                print(f"Scheduler: catching up {job.name} (last run {time.ctime(last)})")
+                self.caught_up += 1
+                self._run(job)
+            job.next_run = job.schedule.next_after(now)
+
+    def _loop(self):
+        renew_every = self.lease_seconds / 3.0
+        while not self._stop.is_set():
+            wait = renew_every
+            try:
+                now = time.time()
+                leader = self._acquire(now)
+                self._renewed_at = now
+                if leader and not self.is_leader:
+                    self._take_over(now)
+                    print(f"Scheduler: {self.owner} is now the leader")
+                    self.is_leader = True
+                elif not leader and self.is_leader:
+                    print(f"Scheduler: {self.owner} is no longer the leader")
+                    self.is_leader = False
+                if leader:
+                    for job in self._jobs.values():
+                        if job.next_run <= now:
+                            self._run(job)
+                            job.next_run = job.schedule.next_after(now)
+                    # Sleep until the next job is due, waking in time to renew the lease
+                    next_due = min((job.next_run for job in self._jobs.values()), default=now + wait)
+                    wait = min(wait, max(next_due - time.time(), 0.0))
+            except Exception as e:
+                print(f"Scheduler loop error: {e}")
+            self._stop.wait(wait)
+
+    def start(self):
+        """Start the scheduler thread in this process (once)."""
+        if self._thread is not None and self._thread.is_alive():
+            return self._thread
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="scheduler", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.release()
+
+    def stats(self):
+        now = time.time()
+        with db_conn() as conn:
+            lease = conn.execute(
+                "SELECT owner, expires_at FROM scheduler_leases WHERE name = ?", (self.name,)
+            ).fetchone()
+            last_runs = dict(conn.execute("SELECT job, last_run FROM scheduled_runs").fetchall())
+        return {
+            "owner": self.owner,
+            "is_leader": self.is_leader,
+            "leader": lease[0] if lease and lease[1] >= now else None,
+            "runs": self.runs,
+            "failures": self.failures,
+            "caught_up": self.caught_up,
+            "jobs": [
+                {
+                    "name": job.name,
+                    "schedule": job.schedule.expr,
+                    "last_run": job.last_run() if job.last_run is not None else last_runs.get(job.name),
+                    "next_run": job.schedule.next_after(now),
+                }
+                for job in self._jobs.values()
+            ],
+        }
+
+
+def _last_daily_report():
+    # The daily_reports row is written after the PDF, in the report pool
+    last = get_last_daily_report_time()
+    return last.timestamp() if last else None
+
+
+scheduler = Scheduler()
+scheduler.add("daily_report", DAILY_REPORT_SCHEDULE, submit_daily_report, last_run=_last_daily_report)
+if RETENTION_ENABLED:
+    scheduler.add("retention", RETENTION_SCHEDULE, lambda: retention_job(keep_going=scheduler.renew))
+atexit.register(scheduler.release)
@@ -0,0 +1,164 @@
+"""Last sighting of every beacon: when, by which device, how far."""
+
+import atexit
+import threading
+import time
+
+from config import SIGHTING_FLUSH_INTERVAL
+from database import db_conn
+from services.live_mirror import LiveStateMirror
+
+
+class LastSightingIndex(LiveStateMirror):
+    """beacon id -> {id, last_seen_raw, last_seen, device, distance, rssi}.
+
+    Updated from each live_state write with one dict lookup per beacon, and
+    unlike the live payloads it keeps a beacon after it expires, so reports
+    can still say when and where an offline beacon was last heard. Changed
+    entries are saved to beacon_sightings every SIGHTING_FLUSH_INTERVAL
+    seconds and loaded back on first use, so they survive restarts and are
+    shared between workers through `refresh()`.
+    """
+
+    def __init__(self, flush_interval=SIGHTING_FLUSH_INTERVAL, persistent=True):
+        super().__init__()
+        self.flush_interval = float(flush_interval)
+        self.persistent = persistent
+        self._sightings = {}
+        self._dirty = set()
+        self._loaded = not persistent
+        self._thread = None
+
+    def _reset(self):
+        # A live state resync replays current payloads; older sightings stay.
+        pass
+
+    def _update(self, ident, payload):
+        if not self._loaded:
+            self._load()
+        for b in payload.get("beacons") or ():
+            bid = b.get("id")
+            seen = b.get("last_seen_raw")
+            if bid is None or seen is None:
+                continue
+            current = self._sightings.get(bid)
+            if current is not None and current["last_seen_raw"] >= seen:
+                continue
+            self._sightings[bid] = {
+                "id": bid,
+                "last_seen_raw": seen,
+                "last_seen": b.get("last_seen"),
+                "device": ident,
+                "distance": b.get("distance"),
+                "rssi": b.get("rssi"),
+            }
+            if self.persistent:
+                self._dirty.add(bid)
+        if self._dirty:
+            self._ensure_worker()
+
+    def _merge_rows(self, rows):
+        for bid, seen, last_seen, device, distance, rssi in rows:
+            current = self._sightings.get(bid)
+            if current is None or current["last_seen_raw"] < seen:
+                self._sightings[bid] = {
+                    "id": bid,
+                    "last_seen_raw": seen,
+                    "last_seen": last_seen,
+                    "device": device,
+                    "distance": distance,
+                    "rssi": rssi,
+                }
+
+    def _select(self):
+        if not self.persistent:
+            return None
+        try:
+            with db_conn() as conn:
+                return conn.execute(
+                    "SELECT beacon_id, last_seen_raw, last_seen, device, distance, rssi FROM beacon_sightings"
+                ).fetchall()
+        except Exception as e:
+            print(f"Could not load beacon sightings: {e}")
+            return None
+
+    def _load(self):
+        # caller holds self._lock
+        rows = self._select()
+        if rows is not None:
+            self._merge_rows(rows)
+            self._loaded = True
+
+    def refresh(self):
+        """Catch up with the live state and with sightings saved by other workers."""
+        self.sync()
+        rows = self._select()
+        with self._lock:
+            if rows is not None:
+                self._merge_rows(rows)
+                self._loaded = True
+
+    def _ensure_worker(self):
+        # Started lazily so each gunicorn worker gets its own thread after fork.
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._flush_loop, name="sighting-index", daemon=True)
+            self._thread.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Save changed sightings; a newer row saved by another worker is kept."""
+        with self._lock:
+            rows = [
+                (s["id"], s["last_seen_raw"], s["last_seen"], s["device"], s["distance"], s["rssi"])
+                for s in (self._sightings[bid] for bid in self._dirty)
+            ]
+            self._dirty.clear()
+        if not rows:
+            return
+        try:
+            with db_conn() as conn:
+                conn.executemany(
+                    """
+                    INSERT INTO beacon_sightings (beacon_id, last_seen_raw, last_seen, device, distance, rssi)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (beacon_id) DO UPDATE SET
+                        last_seen_raw = excluded.last_seen_raw,
+                        last_seen = excluded.last_seen,
+                        device = excluded.device,
+                        distance = excluded.distance,
+                        rssi = excluded.rssi
+                    WHERE excluded.last_seen_raw > beacon_sightings.last_seen_raw
+                    """,
+                    rows,
+                )
+        except Exception as e:
+            print(f"Could not save {len(rows)} beacon sightings: {e}")
+            with self._lock:
+                self._dirty.update(r[0] for r in rows)
+
+    def get(self, beacon_id):
+        """Last sighting of one beacon (a copy), or None if it was never heard."""
+        self.sync()
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            found = self._sightings.get(beacon_id)
+            return dict(found) if found is not None else None
+
+    def snapshot(self):
+        """{beacon id: sighting} for every beacon ever heard (copies)."""
+        self.refresh()
+        with self._lock:
+            return {bid: dict(s) for bid, s in self._sightings.items()}
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sightings)
+
+
+sighting_index = LastSightingIndex().attach()
+atexit.register(sighting_index.flush)
@@ -0,0 +1,129 @@
+"""Grid index over device positions for viewport queries and clustering."""
+
+import math
+
+from config import MAP_CLUSTER_RADIUS_PX, SPATIAL_CELL_DEGREES
+from services.live_mirror import LiveStateMirror
+
+
+def _position(payload):
+    try:
+        lat = float(payload.get("lat"))
+        lon = float(payload.get("lon"))
+    except (TypeError, ValueError):
+        return None
+    if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0):
+        return None
+    return lat, lon
+
+
+class DeviceGridIndex(LiveStateMirror):
+    """Buckets device idents into fixed lat/lon cells."""
+
+    def __init__(self, cell_degrees=SPATIAL_CELL_DEGREES):
+        super().__init__()
+        self.cell_degrees = float(cell_degrees)
+        self._positions = {}  # ident -> (lat, lon, cell)
+        self._cells = {}      # cell -> set of idents
+
+    def _cell(self, lat, lon):
+        return (int(math.floor(lat / self.cell_degrees)), int(math.floor(lon / self.cell_degrees)))
+
+    def _remove(self, ident):
+        old = self._positions.pop(ident, None)
+        if old is None:
+            return
+        members = self._cells.get(old[2])
+        if members is not None:
+            members.discard(ident)
+            if not members:
+                del self._cells[old[2]]
+
+    def _update(self, ident, payload):
+        pos = _position(payload)
+        old = self._positions.get(ident)
+        if pos is None:
+            self._remove(ident)
+            return
+        cell = self._cell(*pos)
+        if old is not None and old[2] != cell:
+            self._remove(ident)
+        self._positions[ident] = (pos[0], pos[1], cell)
+        self._cells.setdefault(cell, set()).add(ident)
+
+    def _reset(self):
+        self._positions.clear()
+        self._cells.clear()
+
+    def query(self, west, south, east, north):
+        """Return [(ident, lat, lon)] inside the box (west > east crosses the antimeridian)."""
+        self.sync()
+        boxes = [(west, east)] if west <= east else [(west, 180.0), (-180.0, east)]
+        found = []
+        with self._lock:
+            for lo_lon, hi_lon in boxes:
+                r0, c0 = self._cell(south, lo_lon)
+                r1, c1 = self._cell(north, hi_lon)
+                if (r1 - r0 + 1) * (c1 - c0 + 1) > len(self._cells):
+                    # Huge box: walking occupied cells is cheaper than the range
+                    candidates = (
+                        ident for (r, c), members in self._cells.items()
+                        if r0 <= r <= r1 and c0 <= c <= c1
+                        for ident in members
+                    )
+                else:
+                    candidates = (
+                        ident
+                        for r in range(r0, r1 + 1)
+                        for c in range(c0, c1 + 1)
+                        for ident in self._cells.get((r, c), ())
+                    )
+                for ident in candidates:
+                    lat, lon, _cell = self._positions[ident]
+                    if south <= lat <= north and lo_lon <= lon <= hi_lon:
+                        found.append((ident, lat, lon))
+        return found
+
+    def position(self, ident):
+        """(lat, lon) of one device, or None when it has no valid position."""
+        self.sync()
+        with self._lock:
+            found = self._positions.get(ident)
+        return None if found is None else found[:2]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._positions)
+
+
+def cluster(points, zoom, radius_px=MAP_CLUSTER_RADIUS_PX):
+    """Grid-cluster [(ident, lat, lon)] for a map zoom level.
+
+    Cell size is `radius_px` screen pixels at `zoom` (256 px Web Mercator
+    tiles). Returns (singles, clusters): the points alone in their cell,
+    and one {lat, lon, count, bounds, idents} per cell with two or more.
+    """
+    cell = 360.0 / (256 * 2 ** zoom) * radius_px
+    buckets = {}
+    for point in points:
+        key = (int(math.floor(point[1] / cell)), int(math.floor(point[2] / cell)))
+        buckets.setdefault(key, []).append(point)
+
+    singles, clusters = [], []
+    for members in buckets.values():
+        if len(members) == 1:
+            singles.append(members[0])
+            continue
+        lats = [p[1] for p in members]
+        lons = [p[2] for p in members]
+        clusters.append({
+            "lat": sum(lats) / len(lats),
+            "lon": sum(lons) / len(lons),
+            "count": len(members),
+            "bounds": [min(lats), min(lons), max(lats), max(lons)],
+            "idents": [p[0] for p in members[:20]],
+        })
+    return singles, clusters
+
+
+device_index = DeviceGridIndex().attach()
@@ -0,0 +1,58 @@
+"""Epoch conversions and ?from=/?to= parsing for the time-range APIs."""
+
+import calendar
+import time
+
+from config import SAMOA_OFFSET_HOURS
+
+_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M", "%Y-%m-%d")
+
+
+def samoa_to_epoch(text):
+    """Epoch seconds of a Samoa local time string (as format_samoa_time writes), or None."""
+    if not text:
+        return None
+    text = str(text).strip()
+    for fmt in _FORMATS:
+        try:
+            parsed = time.strptime(text, fmt)
+        except ValueError:
+            continue
+        return calendar.timegm(parsed) - SAMOA_OFFSET_HOURS * 3600
+    return None
+
+
+def parse_time_param(value):
+    """Epoch seconds from a query parameter: a number, or a Samoa local date/time."""
+    if value is None or str(value).strip() == "":
+        return None
+    try:
+        ts = float(value)
+    except ValueError:
+        ts = samoa_to_epoch(value)
+        if ts is None:
+            raise ValueError(f"Invalid time: {value!r}")
+    if ts > 1_000_000_000_000:  # milliseconds
+        ts /= 1000.0
+    return int(ts)
+
+
+def parse_range(args):
+    """(from_ts, to_ts) from request args; either may be None. Raises ValueError."""
+    start = parse_time_param(args.get("from"))
+    end = parse_time_param(args.get("to"))
+    if start is not None and end is not None and start > end:
+        raise ValueError("from must be before to")
+    return start, end
+
+
+def range_clause(column, start, end):
+    """SQL condition and params for start <= column < end; ("", []) when unbounded."""
+    where, params = [], []
+    if start is not None:
+        where.append(f"{column} >= ?")
+        params.append(start)
+    if end is not None:
+        where.append(f"{column} < ?")
+        params.append(end)
+    return " AND ".join(where), params
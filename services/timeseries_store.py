@@ -0,0 +1,355 @@
+"""Append-only per-beacon history of RSSI, distance and battery readings.
+
+Every reading that reaches live_state is appended to its beacon's in-memory
+tail. A tail is sealed into a chunk once it holds TIMESERIES_CHUNK_POINTS
+readings or its oldest reading is TIMESERIES_CHUNK_SECONDS old, and a
+background thread writes sealed chunks to beacon_series_chunks.
+
+A chunk is one zlib-compressed blob of fixed-width columns:
+
+    header   <qI   first timestamp (ms), point count
+    devices  <H + newline-joined device idents (dictionary for this chunk)
+    t        int32 deltas in ms from the previous point
+    device   uint16 index into the device dictionary
+    rssi     int16 dBm, -32768 when missing
+    distance int32 centimetres, -1 when missing
+    battery  int8 percent, -1 when missing
+
+Range queries read only the chunks whose [start_ms, end_ms] overlaps the
+range (indexed on beacon_id, end_ms), then the unwritten chunks and the
+tail. With several gunicorn workers each keeps its own tail, so another
+worker's most recent readings show up once its chunk is written.
+"""
+
+import atexit
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from itertools import accumulate
+
+from config import TIMESERIES_CHUNK_POINTS, TIMESERIES_CHUNK_SECONDS
+from database import db_conn
+
+_HEADER = struct.Struct("<qI")
+_COUNT = struct.Struct("<H")
+_RSSI_MISSING = -32768
+_MISSING = -1
+_DISTANCE_MAX = 2 ** 31 - 1
+_BIG_ENDIAN = sys.byteorder == "big"
+
+
+def _to_float(value):
+    try:
+        f = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if f != f or f in (float("inf"), float("-inf")) else f
+
+
+def _le_bytes(arr):
+    if _BIG_ENDIAN:
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _from_le(typecode, data, offset, count):
+    arr = array(typecode)
+    end = offset + arr.itemsize * count
+    arr.frombytes(data[offset:end])
+    if _BIG_ENDIAN:
+        arr.byteswap()
+    return arr, end
+
+
+class _Tail:
+    """Readings of one beacon not yet sealed into a chunk."""
+
+    __slots__ = ("t", "device", "rssi", "distance", "battery")
+
+    def __init__(self):
+        self.t = array("q")
+        self.device = []
+        self.rssi = array("h")
+        self.distance = array("i")
+        self.battery = array("b")
+
+    def append(self, t_ms, ident, rssi, distance, battery):
+        # Every value is converted before any column grows, so a bad reading
+        # cannot leave the columns out of step
+        rssi = _RSSI_MISSING if rssi is None else max(-32767, min(32767, int(round(rssi))))
+        # A distance past int32 centimetres (~21,000 km) is noise, not a reading
+        distance = None if distance is None else int(round(distance * 100))
+        if distance is None or not 0 <= distance <= _DISTANCE_MAX:
+            distance = _MISSING
+        battery = _MISSING if battery is None else max(0, min(127, int(round(battery))))
+        self.t.append(t_ms)
+        self.device.append(ident)
+        self.rssi.append(rssi)
+        self.distance.append(distance)
+        self.battery.append(battery)
+
+    def __len__(self):
+        return len(self.t)
+
+
+def encode_chunk(tail):
+    """Compress a tail into a chunk blob; returns (start_ms, end_ms, points, blob)."""
+    count = len(tail)
+    names = sorted(set(tail.device))
+    index = {name: i for i, name in enumerate(names)}
+    dictionary = "\n".join(names).encode("utf-8")
+    deltas = array("i", (b - a for a, b in zip(tail.t, tail.t[1:])))
+    deltas.insert(0, 0)
+    raw = b"".join((
+        _HEADER.pack(tail.t[0], count),
+        _COUNT.pack(len(dictionary)),
+        dictionary,
+        _le_bytes(deltas),
+        _le_bytes(array("H", (index[d] for d in tail.device))),
+        _le_bytes(tail.rssi),
+        _le_bytes(tail.distance),
+        _le_bytes(tail.battery),
+    ))
+    return tail.t[0], tail.t[-1], count, zlib.compress(raw, 6)
+
+
+def decode_chunk(blob):
+    """Inverse of encode_chunk: returns a _Tail with the chunk's readings."""
+    raw = zlib.decompress(blob)
+    start_ms, count = _HEADER.unpack_from(raw, 0)
+    offset = _HEADER.size
+    (size,) = _COUNT.unpack_from(raw, offset)
+    offset += _COUNT.size
+    names = raw[offset:offset + size].decode("utf-8").split("\n")
+    offset += size
+
+    deltas, offset = _from_le("i", raw, offset, count)
+    devices, offset = _from_le("H", raw, offset, count)
+    tail = _Tail()
+    tail.t = array("q", accumulate(deltas, initial=start_ms))[1:]
+    tail.device = [names[i] for i in devices]
+    tail.rssi, offset = _from_le("h", raw, offset, count)
+    tail.distance, offset = _from_le("i", raw, offset, count)
+    tail.battery, offset = _from_le("b", raw, offset, count)
+    return tail
+
+
+def _points(tail, start_ms, end_ms, device=None):
+    """Yield (t_ms, device, rssi, distance, battery) inside [start_ms, end_ms]."""
+    for t, ident, rssi, dist, batt in zip(tail.t, tail.device, tail.rssi, tail.distance, tail.battery):
+        if t < start_ms or t > end_ms or (device is not None and ident != device):
+            continue
+        yield (
+            t,
+            ident,
+            None if rssi == _RSSI_MISSING else rssi,
+            None if dist == _MISSING else dist / 100.0,
+            None if batt == _MISSING else batt,
+        )
+
+
+class TimeSeriesStore:
+    """Per-beacon tails in memory, compressed chunks in beacon_series_chunks."""
+
+    def __init__(self, chunk_points=TIMESERIES_CHUNK_POINTS, chunk_seconds=TIMESERIES_CHUNK_SECONDS):
+        self.chunk_points = int(chunk_points)
+        self.chunk_seconds = float(chunk_seconds)
+        self._tails = {}     # beacon id -> _Tail
+        self._pending = []   # sealed, not yet written: (beacon_id, start_ms, end_ms, points, blob)
+        self._cond = threading.Condition()
+        self._thread = None
+
+        self.appended = 0
+        self.chunks_written = 0
+        self.bytes_written = 0
+        self.errors = 0
+
+    def append(self, beacon_rows):
+        """Record ingest readings given as (ident, beacon_id, info) rows."""
+        if not beacon_rows:
+            return
+        self._ensure_worker()
+        with self._cond:
+            for ident, bid, info in beacon_rows:
+                distance = info.get("distance_smoothed")
+                if distance is None:
+                    distance = info.get("distance")
+                tail = self._tails.get(bid)
+                if tail is None:
+                    tail = self._tails[bid] = _Tail()
+                tail.append(
+                    int(info["last_seen_raw"] * 1000),
+                    ident,
+                    _to_float(info.get("rssi")),
+                    _to_float(distance),
+                    _to_float(info.get("battery_percent")),
+                )
+                if len(tail) >= self.chunk_points:
+                    self._seal(bid)
+            self.appended += len(beacon_rows)
+            if self._pending:
+                self._cond.notify_all()
+
+    def _seal(self, bid):
+        # caller holds self._cond
+        tail = self._tails.pop(bid, None)
+        if tail:
+            self._pending.append((bid,) + encode_chunk(tail))
+
+    def _seal_expired(self, now_ms):
+        with self._cond:
+            horizon = now_ms - self.chunk_seconds * 1000
+            for bid in [bid for bid, tail in self._tails.items() if tail.t[0] <= horizon]:
+                self._seal(bid)
+
+    def _ensure_worker(self):
+        # Started lazily so each gunicorn worker gets its own thread after fork.
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker_loop, name="timeseries-writer", daemon=True)
+                self._thread.start()
+
+    def _worker_loop(self):
+        check_interval = min(5.0, self.chunk_seconds)
+        while True:
+            with self._cond:
+                if not self._pending:
+                    self._cond.wait(check_interval)
+            self._seal_expired(time.time() * 1000)
+            self._write_pending()
+
+    def _write_pending(self):
+        with self._cond:
+            batch = list(self._pending)
+        if not batch:
+            return
+        try:
+            with db_conn() as conn:
+                conn.executemany(
+                    "INSERT INTO beacon_series_chunks (beacon_id, start_ms, end_ms, points, data) VALUES (?, ?, ?, ?, ?)",
+                    batch,
+                )
+        except Exception as e:
+            # Chunks stay pending and are retried on the next pass
+            self.errors += 1
+            print(f"Time-series writer failed on {len(batch)} chunks: {e}")
+            return
+        with self._cond:
+            del self._pending[:len(batch)]
+        self.chunks_written += len(batch)
+        self.bytes_written += sum(len(c[4]) for c in batch)
+
+    def flush(self):
+        """Seal every tail and write all pending chunks now."""
+        with self._cond:
+            for bid in list(self._tails):
+                self._seal(bid)
+        self._write_pending()
+
+    def query(self, beacon_id, start, end, device=None):
+        """Readings of one beacon between `start` and `end` (epoch seconds), oldest first.
+
+        Returns a list of (t_ms, device, rssi, distance, battery).
+        """
+        start_ms, end_ms = int(start * 1000), int(end * 1000)
+        with self._cond:
+            pending = [c for c in self._pending if c[0] == beacon_id and c[2] >= start_ms and c[1] <= end_ms]
+            tail = self._tails.get(beacon_id)
+            tail = _Tail() if tail is None else self._copy(tail)
+        seen = {(c[1], c[2], c[3]) for c in pending}
+
+        with db_conn() as conn:
+            rows = conn.execute(
+                """
+                SELECT start_ms, end_ms, points, data FROM beacon_series_chunks
+                WHERE beacon_id = ? AND end_ms >= ? AND start_ms <= ?
+                ORDER BY start_ms
+                """,
+                (beacon_id, start_ms, end_ms),
+            ).fetchall()
+
+        # A chunk written after the snapshot above is in both; keep one copy
+        chunks = [r[3] for r in rows if (r[0], r[1], r[2]) not in seen] + [c[4] for c in pending]
+        result = []
+        for blob in chunks:
+            result.extend(_points(decode_chunk(blob), start_ms, end_ms, device))
+        result.extend(_points(tail, start_ms, end_ms, device))
+        # Chunks from different workers can interleave in time
+        result.sort(key=lambda p: p[0])
+        return result
+
+    @staticmethod
+    def _copy(tail):
+        copy = _Tail()
+        copy.t = array("q", tail.t)
+        copy.device = list(tail.device)
+        copy.rssi = array("h", tail.rssi)
+        copy.distance = array("i", tail.distance)
+        copy.battery = array("b", tail.battery)
+        return copy
+
+    def stats(self):
+        with self._cond:
+            tails = len(self._tails)
+            tail_points = sum(len(t) for t in self._tails.values())
+            pending = len(self._pending)
+        return {
+            "appended": self.appended,
+            "tails": tails,
+            "tail_points": tail_points,
+            "pending_chunks": pending,
+            "chunks_written": self.chunks_written,
+            "bytes_written": self.bytes_written,
+            "errors": self.errors,
+            "chunk_points": self.chunk_points,
+            "chunk_seconds": self.chunk_seconds,
+        }
+
+
+def downsample(points, bucket_seconds):
+    """Average readings into fixed time buckets for charts.
+
+    Returns (t_ms, samples, rssi_avg, distance_avg, distance_min, distance_max,
+    battery_last) per non-empty bucket.
+    """
+    width = int(bucket_seconds * 1000)
+    out = []
+    current = None
+    for t, _ident, rssi, dist, batt in points:
+        key = t - t % width
+        if current is None or current[0] != key:
+            current = [key, 0, 0.0, 0, 0.0, 0, None, None, None]
+            out.append(current)
+        current[1] += 1
+        if rssi is not None:
+            current[2] += rssi
+            current[3] += 1
+        if dist is not None:
+            current[4] += dist
+            current[5] += 1
+            current[6] = dist if current[6] is None else min(current[6], dist)
+            current[7] = dist if current[7] is None else max(current[7], dist)
+        if batt is not None:
+            current[8] = batt
+    return [
+        (
+            key,
+            n,
+            round(rssi_sum / rssi_n, 1) if rssi_n else None,
+            round(dist_sum / dist_n, 2) if dist_n else None,
+            dist_min,
+            dist_max,
+            batt,
+        )
+        for key, n, rssi_sum, rssi_n, dist_sum, dist_n, dist_min, dist_max, batt in out
+    ]
+
+
+timeseries_store = TimeSeriesStore()
+atexit.register(timeseries_store.flush)
@@ -35,21 +35,9 @@ def log_uptime_snapshot(min_interval_seconds: int = 60) -> None:
     ts_str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now))
 
     conn = get_db()
-    # Ensure table exists (also created in init_db but safe to repeat)
     conn.execute(
-        """
-        CREATE TABLE IF NOT EXISTS uptime_logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT,
-            device_count INTEGER,
-            beacon_count INTEGER,
-            status TEXT
-        )
-        """
-    )
-    conn.execute(
-        "INSERT INTO uptime_logs (timestamp, device_count, beacon_count, status) VALUES (?, ?, ?, ?)",
-        (ts_str, active_devices, active_beacons, status),
+        "INSERT INTO uptime_logs (timestamp, ts, device_count, beacon_count, status) VALUES (?, ?, ?, ?, ?)",
+        (ts_str, int(now), active_devices, active_beacons, status),
     )
     conn.commit()
     conn.close()
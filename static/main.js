@@ -1,15 +1,26 @@
 const FETCH_INTERVAL_MS = 4000;
+// How long to poll before trying the stream again after the server said "poll"
+const STREAM_RETRY_MS = 60000;
+// Above this many devices the map asks /data for just the visible viewport
+// (server-side clustered at low zoom) instead of drawing the whole fleet.
+const VIEWPORT_MODE_MIN_DEVICES = 300;
 
 let map;
 let deviceMarkers = {};   // ident -> Leaflet marker
 let beaconCircles = {};   // beaconKey -> Leaflet circle
-let beaconPrevState = {}; // for in/out detection
+let clusterMarkers = [];  // Leaflet markers for server-side clusters
+let viewportEtag = null;
+let viewportTimer = null;
 let notifications = [];
+let lastNotificationId = null;  // id of the newest notification shown
 let reports = [];
 let unreadCount = 0;
 let heatLayer = null;
 
 let currentBeaconNames = {};
+let dataCursor = null;          // `version` of the last /data response
+let deviceState = {};           // ident -> device, patched by /data deltas
+let beaconState = {};           // beacon id -> server beacon entry (best device, sightings)
 let lastDevices = [];
 let lastBeaconsAgg = [];
 let currentDeviceFilter = '';   // '' = all devices
@@ -26,108 +37,185 @@ function initMap() {
     maxZoom: 19,
     attribution: '&copy; OpenStreetMap'
   }).addTo(map);
+
+  map.on('moveend', () => {
+    if (useViewportMode()) scheduleViewportFetch();
+  });
 }
 
 
-// ---- Fetch + update loop ----
+// ---- Live updates: SSE push, polling fallback ----
 
-async function fetchAndUpdateMapData() {
-  try {
-    const resp = await fetch('/data');
-    if (!resp.ok) {
-      console.error('Failed to fetch /data', resp.status);
-      return;
-    }
-    const payload = await resp.json();
-    const devices = payload.devices || [];
-    const beaconNames = payload.beacon_names || {};
-
-    currentBeaconNames = beaconNames;
-    lastDevices = devices;
-
-    // Extract daily report if present
-    const dailyReport = devices.find(d => d && d.ident === 'DAILY_REPORT');
-    if (dailyReport && dailyReport.report) {
-      addDailyReport(dailyReport);
-    }
+function applyMapPayload(payload) {
+  if (payload.full !== false) {
+    deviceState = {};
+    beaconState = {};
+    currentBeaconNames = payload.beacon_names || {};
+  }
+  (payload.devices || []).forEach(d => {
+    if (d && d.ident) deviceState[d.ident] = d;
+  });
+  // Each beacon comes once, already resolved to its best device by the server
+  (payload.beacons || []).forEach(b => {
+    beaconState[b.id] = b;
+  });
+  (payload.removed_beacon_ids || []).forEach(id => {
+    delete beaconState[id];
+  });
+  dataCursor = payload.version || null;
 
-    // Build aggregated beacon list (across devices)
-    const aggBeacons = aggregateBeacons(devices, beaconNames);
-
-    // in/out detection
-    aggBeacons.forEach(b => {
-      const key = `${b.deviceIdent || 'unknown'}::${b.id}`;
-      const dist = b.distance ?? 9999;
-      const prev = beaconPrevState[key] || 'unknown';
-      const nowState = dist <= 3 ? 'in' : 'out';
-
-      if (prev !== nowState) {
-        beaconPrevState[key] = nowState;
-        if (nowState === 'out') {
-          addNotification('left', b.name || b.id, b.last_seen, dist);
-        } else if (nowState === 'in' && prev !== 'unknown') {
-          addNotification('in', b.name || b.id, b.last_seen, dist);
-        }
-      }
-    });
+  const devices = Object.values(deviceState);
+  const beaconNames = currentBeaconNames;
+  lastDevices = devices;
 
-    lastBeaconsAgg = aggBeacons;
-    // ---- Update summary sidebar ----
-    const goodDevices = devices.filter(d => d.ident !== "DAILY_REPORT");
-    document.getElementById("summary-devices").textContent = goodDevices.length;
+  // Extract daily report if present
+  const dailyReport = devices.find(d => d && d.ident === 'DAILY_REPORT');
+  if (dailyReport && dailyReport.report) {
+    addDailyReport(dailyReport);
+  }
 
-    document.getElementById("summary-beacons").textContent = aggBeacons.length;
+  const aggBeacons = beaconsFromView(Object.values(beaconState), deviceState, beaconNames);
 
-    let latestTS = "-";
-    goodDevices.forEach(d => {
-        if (d.timestamp && d.timestamp !== "-" && d.timestamp !== null) {
-            latestTS = d.timestamp;
-        }
-    });
+  lastBeaconsAgg = aggBeacons;
+  // ---- Update summary sidebar ----
+  const goodDevices = devices.filter(d => d.ident !== "DAILY_REPORT");
+  document.getElementById("summary-devices").textContent = goodDevices.length;
 
+  document.getElementById("summary-beacons").textContent = aggBeacons.length;
 
+  if (useViewportMode()) {
+    scheduleViewportFetch();
+  } else {
     updateMap(devices, aggBeacons);
-    updateSidebar(devices, beaconNames);
+  }
+  updateSidebar(devices, beaconNames);
+}
+
+async function fetchAndUpdateMapData() {
+  try {
+    // Ask only for what changed since our cursor; 304 means nothing did
+    // The server resolves each beacon to its best device (view=beacons)
+    const url = dataCursor
+      ? `/data?view=beacons&since=${encodeURIComponent(dataCursor)}`
+      : '/data?view=beacons';
+    const headers = dataCursor ? { 'If-None-Match': `"${dataCursor}"` } : {};
+    const resp = await fetch(url, { headers, cache: 'no-store' });
+    if (resp.status === 304) return;
+    if (!resp.ok) {
+      console.error('Failed to fetch /data', resp.status);
+      return;
+    }
+    applyMapPayload(await resp.json());
   } catch (e) {
     console.error('Error in fetchAndUpdateMapData', e);
   }
 }
 
-function startPolling() {
+async function fetchNotifications() {
+  try {
+    const url = lastNotificationId != null
+      ? `/api/notifications?after_id=${lastNotificationId}`
+      : '/api/notifications';
+    const resp = await fetch(url, { cache: 'no-store' });
+    if (!resp.ok) return;
+    const data = await resp.json();
+    // The first poll only learns where to start from
+    if (lastNotificationId == null) lastNotificationId = data.last_id;
+    (data.rows || []).forEach(handleNotificationRow);
+  } catch (e) {
+    console.error('Error in fetchNotifications', e);
+  }
+}
+
+function pollOnce() {
   fetchAndUpdateMapData();
-  setInterval(fetchAndUpdateMapData, FETCH_INTERVAL_MS);
+  fetchNotifications();
 }
 
+let pollTimer = null;
 
-// ---- Aggregate beacons across devices ----
+function startPolling() {
+  if (pollTimer) return;
+  pollOnce();
+  pollTimer = setInterval(pollOnce, FETCH_INTERVAL_MS);
+}
 
-function aggregateBeacons(devices, beaconNames) {
-  const result = [];
-  devices.forEach(d => {
-    if (!d || !d.beacons || d.ident === 'DAILY_REPORT') return;
-    (d.beacons || []).forEach(b => {
-      const id = b.id;
-      const name = beaconNames[id] || b.name || id;
-      result.push({
-        id,
-        name,
-        deviceIdent: d.ident,
-        deviceName: d.name || d.ident,
-        deviceColor: d.color || '#3b82f6',
-        distance: b.distance,
-        last_seen: b.last_seen,
-        rssi: b.rssi,
-        lat: d.lat,
-        lon: d.lon
-      });
-    });
+function stopPolling() {
+  if (!pollTimer) return;
+  clearInterval(pollTimer);
+  pollTimer = null;
+}
+
+function startLiveUpdates() {
+  if (!window.EventSource) {
+    startPolling();
+    return;
+  }
+  // One stream carries map updates and notifications. Resume from our
+  // cursors; EventSource sends Last-Event-ID on its own reconnects.
+  let url = '/data/stream?view=beacons';
+  if (dataCursor) {
+    url += `&since=${encodeURIComponent(`${dataCursor}~${lastNotificationId ?? ''}`)}`;
+  }
+  const source = new EventSource(url);
+  source.addEventListener('open', () => stopPolling());
+  source.addEventListener('map', e => {
+    try {
+      applyMapPayload(JSON.parse(e.data));
+      // The event id also says which notification the stream starts after
+      const notifId = e.lastEventId.split('~')[1];
+      if (lastNotificationId == null && notifId) lastNotificationId = Number(notifId);
+    } catch (err) {
+      console.error('Bad map event', err);
+    }
+  });
+  source.addEventListener('notification', e => {
+    try {
+      handleNotificationRow(JSON.parse(e.data));
+    } catch (err) {
+      console.error('Bad notification event', err);
+    }
+  });
+  // More events were missed than the server replays; they are in the history page
+  source.addEventListener('resync', e => {
+    const info = JSON.parse(e.data);
+    addNotification('missed', `${info.missed} earlier events (see history)`, '-', null);
+  });
+  // The server has no stream slot free: poll for a while, then try again
+  source.addEventListener('poll', () => {
+    source.close();
+    startPolling();
+    setTimeout(startLiveUpdates, STREAM_RETRY_MS);
+  });
+  source.addEventListener('error', () => {
+    // Poll while the stream is down; the next 'open' stops it again
+    startPolling();
   });
-  return result;
 }
 
 
 // ---- Map rendering ----
 
+// Server-aggregated view: one entry per beacon, drawn at its best device
+function beaconsFromView(beacons, byIdent, names) {
+  return beacons.map(b => {
+    const d = byIdent[b.best.ident] || {};
+    return {
+      id: b.id,
+      name: names[b.id] || b.name || b.id,
+      deviceIdent: b.best.ident,
+      deviceName: d.name || b.best.ident,
+      deviceColor: d.color || '#3b82f6',
+      distance: b.best.distance,
+      last_seen: b.last_seen,
+      rssi: b.best.rssi,
+      sightings: b.sightings.length,
+      lat: d.lat,
+      lon: d.lon
+    };
+  });
+}
+
 function getDeviceColor(ident, fallback) {
   if (deviceColors[ident]) return deviceColors[ident];
   if (fallback) {
@@ -141,8 +229,85 @@ function getDeviceColor(ident, fallback) {
 function clearMapLayers() {
   Object.values(deviceMarkers).forEach(m => map.removeLayer(m));
   Object.values(beaconCircles).forEach(c => map.removeLayer(c));
+  clusterMarkers.forEach(m => map.removeLayer(m));
   deviceMarkers = {};
   beaconCircles = {};
+  clusterMarkers = [];
+}
+
+
+// ---- Viewport mode (large fleets) ----
+
+function useViewportMode() {
+  return Object.keys(deviceState).length > VIEWPORT_MODE_MIN_DEVICES;
+}
+
+function scheduleViewportFetch() {
+  // Coalesce bursts of pans and live updates into one request
+  if (viewportTimer) return;
+  viewportTimer = setTimeout(() => {
+    viewportTimer = null;
+    fetchViewport();
+  }, 250);
+}
+
+async function fetchViewport() {
+  if (!map) return;
+  const b = map.getBounds();
+  const clamp = v => Math.max(-180, Math.min(180, v));
+  const bbox = [clamp(b.getWest()), Math.max(-90, b.getSouth()), clamp(b.getEast()), Math.min(90, b.getNorth())]
+    .map(v => v.toFixed(5)).join(',');
+  const url = `/data?bbox=${bbox}&zoom=${map.getZoom()}&view=beacons`;
+  try {
+    const headers = viewportEtag ? { 'If-None-Match': viewportEtag } : {};
+    const resp = await fetch(url, { headers, cache: 'no-store' });
+    if (resp.status === 304) return;
+    if (!resp.ok) {
+      console.error('Failed to fetch viewport', resp.status);
+      return;
+    }
+    viewportEtag = resp.headers.get('ETag');
+    const payload = await resp.json();
+    const devices = payload.devices || [];
+    const byIdent = {};
+    devices.forEach(d => { if (d && d.ident) byIdent[d.ident] = d; });
+    const names = payload.beacon_names || currentBeaconNames;
+    updateMap(devices, beaconsFromView(payload.beacons || [], byIdent, names), false);
+    drawClusters(payload.clusters || []);
+  } catch (e) {
+    console.error('Error in fetchViewport', e);
+  }
+}
+
+function redrawMap() {
+  if (useViewportMode()) {
+    viewportEtag = null;  // same viewport, but the device filter changed
+    scheduleViewportFetch();
+  } else {
+    updateMap(lastDevices, lastBeaconsAgg);
+  }
+}
+
+function drawClusters(clusters) {
+  clusters.forEach(c => {
+    const size = c.count < 10 ? 30 : c.count < 100 ? 38 : 46;
+    const icon = L.divIcon({
+      className: '',
+      html: `<div style="width:${size}px;height:${size}px;line-height:${size}px;border-radius:50%;
+        background:rgba(59,130,246,0.85);color:white;text-align:center;font-size:0.8rem;
+        font-weight:600;border:2px solid white;">${c.count}</div>`,
+      iconSize: [size, size],
+      iconAnchor: [size / 2, size / 2]
+    });
+    const marker = L.marker([c.lat, c.lon], { icon });
+    marker.bindTooltip(`${c.count} devices`, { direction: 'top' });
+    marker.on('click', () => {
+      const [s, w, n, e] = c.bounds;
+      map.fitBounds([[s, w], [n, e]], { padding: [40, 40] });
+    });
+    marker.addTo(map);
+    clusterMarkers.push(marker);
+  });
 }
 
 
@@ -162,7 +327,7 @@ function makeDeviceIcon(color) {
   });
 }
 
-function updateMap(devices, aggBeacons) {
+function updateMap(devices, aggBeacons, fit = true) {
   if (!map) return;
 
   clearMapLayers();
@@ -228,6 +393,7 @@ function updateMap(devices, aggBeacons) {
         <div>Device: ${b.deviceName}</div>
         <div>Distance: ${b.distance != null ? b.distance.toFixed(2) + ' m' : '-'}</div>
         <div>Last seen: ${b.last_seen || '-'}</div>
+        ${b.sightings > 1 ? `<div>Heard by: ${b.sightings} devices</div>` : ''}
       </div>
     `;
     circle.bindTooltip(tooltipHtml, { direction: 'top', sticky: true });
@@ -236,7 +402,7 @@ function updateMap(devices, aggBeacons) {
     beaconCircles[`${b.deviceIdent}::${b.id}`] = circle;
   });
 
-  if (bounds.length > 0) {
+  if (fit && bounds.length > 0) {
     const latLngBounds = L.latLngBounds(bounds);
     map.fitBounds(latLngBounds.pad(0.2));
   }
@@ -248,7 +414,7 @@ function setDeviceFilter(ident) {
   } else {
     currentDeviceFilter = ident;
   }
-  updateMap(lastDevices, lastBeaconsAgg);
+  redrawMap();
   updateSidebar(lastDevices, currentBeaconNames);
 }
 
@@ -279,13 +445,26 @@ function updateSidebar(devices, beaconNames) {
   if (allBtn) {
     allBtn.addEventListener('click', () => {
       currentDeviceFilter = '';
-      updateMap(lastDevices, lastBeaconsAgg);
+      redrawMap();
       updateSidebar(lastDevices, beaconNames);
     });
   }
 
   const visibleDevices = devices.filter(d => d && d.ident !== 'DAILY_REPORT');
 
+  // Each device's list comes from the sightings of the beacons it hears
+  const heardBy = {};
+  Object.values(beaconState).forEach(b => {
+    (b.sightings || []).forEach(s => {
+      (heardBy[s.ident] = heardBy[s.ident] || []).push({
+        id: b.id,
+        name: beaconNames[b.id] || b.name || b.id,
+        distance: s.distance,
+        last_seen: s.last_seen
+      });
+    });
+  });
+
   visibleDevices.forEach(d => {
     const ident = d.ident;
     const color = getDeviceColor(ident, d.color || '#3b82f6');
@@ -299,16 +478,7 @@ function updateSidebar(devices, beaconNames) {
     const deviceBlock = document.createElement('div');
     deviceBlock.className = 'device-block';
 
-    const beaconsForDevice = (d.beacons || []).map(b => {
-      const id = b.id;
-      const bName = beaconNames[id] || b.name || id;
-      return {
-        id,
-        name: bName,
-        distance: b.distance,
-        last_seen: b.last_seen
-      };
-    });
+    const beaconsForDevice = heardBy[ident] || [];
 
     deviceBlock.innerHTML = `
       <div class="device-block-header" data-device-ident="${ident}">
@@ -378,7 +548,7 @@ function updateSidebar(devices, beaconNames) {
         // ignore clicks that were for the pencil button
         if (e.target.closest('.rename-beacon-btn')) return;
         currentDeviceFilter = ident;
-        updateMap(lastDevices, lastBeaconsAgg);
+        redrawMap();
       });
     });
 
@@ -388,6 +558,15 @@ function updateSidebar(devices, beaconNames) {
 
 
 // ---- Notifications ----
+// IN/LEFT events are detected and stored by the server; they arrive on the
+// map stream (or by polling). Row ids only grow, so a row seen both ways is
+// shown once.
+
+function handleNotificationRow(n) {
+  if (lastNotificationId != null && n.id <= lastNotificationId) return;
+  lastNotificationId = n.id;
+  addNotification(n.type, n.name, n.time, n.distance);
+}
 
 function addNotification(type, beaconName, eventTime, distance) {
   const timeStr = eventTime || '-';
@@ -399,16 +578,6 @@ function addNotification(type, beaconName, eventTime, distance) {
   };
   notifications.push(msg);
 
-  try {
-    fetch('/api/notifications', {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify(msg)
-    });
-  } catch (e) {
-    console.error('Failed to send notification to server', e);
-  }
-
   unreadCount += 1;
   updateNotificationBadge();
   renderNotificationsList();
@@ -563,7 +732,7 @@ async function saveRenameModal() {
   }
 
   closeRenameModal();
-  // refresh to pick up new names
+  // refresh to pick up new names (the changed metadata forces a full reply)
   fetchAndUpdateMapData();
 }
 
@@ -678,5 +847,5 @@ document.addEventListener('DOMContentLoaded', () => {
   setupMenu();
   setupRenameModalHandlers();
   setupNotificationsUI();
-  startPolling();
+  startLiveUpdates();
 });
\ No newline at end of file